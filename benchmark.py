@@ -0,0 +1,661 @@
+"""Load benchmark for the bot against local stand-ins of the Telegram Bot API and Twitter v2.
+
+    python benchmark.py --chats 50 --raids 200 --duration 60
+
+Both APIs are served by aiohttp on localhost with configurable latency, rate limits and
+engagement growth, and bot.py is pointed at them through TELEGRAM_API_URL and
+TWITTER_API_URL. /raid commands go through the real dispatcher and handlers, then the
+tracker runs for `--duration` seconds. With `--shards N` bot.py runs as a coordinator with
+N worker processes instead and receives the commands through getUpdates, so throughput
+can be compared across shard counts. `--queue N` instead times the operations of one
+chat's raid queue holding N raids, and `--table N` the progress evaluation of N concurrent
+raids. `--startup N` times a cold start of bot.py restoring N raids, with a backlog of
+stale commands waiting, until it answers a fresh /raid. `--webhook` runs bot.py with
+BOT_MODE=webhook and posts the /raid updates to WEBHOOK_PATH, then runs it again fetching
+the same updates with getUpdates, and compares how long the chats waited for an answer.
+Each run is appended to BENCHMARK_RESULTS and compared with the last run that used the
+same parameters, so regressions show up between commits.
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+import aiohttp
+from aiohttp import web
+
+BENCHMARK_RESULTS = os.getenv('BENCHMARK_RESULTS', 'benchmark_results.jsonl')
+BENCHMARK_TOKEN = '123456:BENCHMARKBENCHMARKBENCHMARKBENCHMARK'
+ADMIN = {'id': 1, 'is_bot': False, 'first_name': 'Admin'}
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+
+# Engagement gained `minutes` after a tweet is first looked up, for a growth `rate` in likes per minute
+GROWTH_CURVES = {
+    'flat': lambda minutes, rate: 0,
+    'linear': lambda minutes, rate: rate * minutes,
+    # Levels off at 30 minutes' worth of linear growth, rising fastest around the 15th minute
+    'logistic': lambda minutes, rate: rate * 30 / (1 + math.exp(-(minutes - 15) / 4)),
+}
+
+
+class Latency:
+    def __init__(self, mean_ms, jitter):
+        self.mean = mean_ms / 1000
+        self.jitter = jitter  # Fraction of the mean each response is randomly shifted by
+
+    async def wait(self):
+        if self.mean > 0:
+            await asyncio.sleep(random.uniform(self.mean * (1 - self.jitter), self.mean * (1 + self.jitter)))
+
+
+class FakeTelegram:
+    """Bot API stand-in that answers every method the bot calls and enforces the flood limits."""
+
+    def __init__(self, latency, global_rate, chat_rate):
+        self.latency = latency
+        self.global_rate = global_rate  # Calls per second across all chats
+        self.chat_rate = chat_rate  # Messages per minute in one group
+        self.calls = {}
+        self.throttled = 0
+        self.answered = 0  # /raid commands that got their banner or "already ongoing" reply
+        self.answered_at = {}  # chat_id -> perf_counter() of the first answer in the chat
+        self.pinned = {}  # chat_id -> id of the message pinned in the chat
+        self._message_ids = itertools.count(1)
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._global = deque()
+        self._chats = {}
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def deliver(self, updates):
+        """Queue updates for the bot to receive through getUpdates."""
+        self._updates.extend(updates)
+        self._new_updates.set()
+
+    async def _get_updates(self, form):
+        offset = int(form.get('offset') or 0)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and form.get('timeout'):
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(form['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(form.get('limit') or 100)]
+
+    def _retry_after(self, chat_id):
+        """Return the seconds to wait if the call breaks a limit, otherwise count it."""
+        now = time.monotonic()
+        windows = [(self._global, 1, self.global_rate)]
+        if chat_id is not None:
+            windows.append((self._chats.setdefault(chat_id, deque()), 60, self.chat_rate))
+        for sent, period, limit in windows:
+            while sent and sent[0] <= now - period:
+                sent.popleft()
+            if len(sent) >= limit:
+                return max(math.ceil(sent[0] + period - now), 1)
+        for sent, _, _ in windows:
+            sent.append(now)
+        return 0
+
+    def _result(self, method, form):
+        chat = {'id': int(form.get('chat_id', 0)), 'type': 'supergroup', 'title': 'Benchmark'}
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getChatAdministrators':
+            return [{'user': ADMIN, 'status': 'creator', 'is_anonymous': False}]
+        if method == 'getChatMember':
+            return {'user': ADMIN, 'status': 'creator', 'is_anonymous': False}
+        if method == 'getChat':
+            if chat['id'] in self.pinned:
+                chat['pinned_message'] = {'message_id': self.pinned[chat['id']], 'date': int(time.time()),
+                                          'chat': dict(chat), 'from': BOT_USER, 'text': 'Raid card'}
+            return chat
+        if method == 'pinChatMessage':
+            self.pinned[chat['id']] = int(form['message_id'])
+        elif method == 'unpinChatMessage':
+            self.pinned.pop(chat['id'], None)
+        if not method.startswith(('send', 'edit')):
+            return True
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': chat}
+        media = {'file_id': 'banner', 'file_unique_id': 'banner', 'width': 1, 'height': 1, 'duration': 1}
+        if method == 'sendVideo':
+            message['video'] = media
+        elif method == 'sendAnimation':
+            message['animation'] = media
+        elif method == 'sendPhoto':
+            message['photo'] = [media]
+        if 'text' in form:
+            message['text'] = form['text']
+        if 'caption' in form:
+            message['caption'] = form['caption']
+        return message
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        form = await request.post()
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self._get_updates(form)})
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await self.latency.wait()
+        # Only calls that change a chat count against the flood limits, lookups such as getChatAdministrators do not
+        retry_after = 0 if method.startswith('get') else self._retry_after(form.get('chat_id'))
+        if retry_after:
+            self.throttled += 1
+            return web.json_response({'ok': False, 'error_code': 429,
+                                      'description': f'Too Many Requests: retry after {retry_after}',
+                                      'parameters': {'retry_after': retry_after}}, status=429)
+        if method in ('sendVideo', 'sendAnimation', 'sendPhoto') or 'already ongoing' in form.get('text', ''):
+            self.answered += 1
+            self.answered_at.setdefault(int(form.get('chat_id', 0)), time.perf_counter())
+        return web.json_response({'ok': True, 'result': self._result(method, form)})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+
+class FakeTwitter:
+    """Twitter v2 tweet lookup stand-in with per-endpoint rate-limit windows and growing metrics."""
+
+    def __init__(self, latency, quota, window, curve, growth):
+        self.latency = latency
+        self.quota = quota  # Requests allowed per endpoint and window
+        self.window = window
+        self.curve = GROWTH_CURVES[curve]
+        self.growth = growth
+        self.requests = 0
+        self.throttled = 0
+        self._windows = {}  # endpoint -> [window start, requests used]
+        self._first_seen = {}
+
+    def _public_metrics(self, post_id, now):
+        minutes = (now - self._first_seen.setdefault(post_id, now)) / 60
+        gained = self.curve(minutes, self.growth)
+        return {'like_count': int(gained), 'retweet_count': int(gained / 4), 'reply_count': int(gained / 10),
+                'bookmark_count': int(gained / 20), 'quote_count': 0, 'impression_count': int(gained * 50)}
+
+    async def _respond(self, endpoint, ids):
+        self.requests += 1
+        await self.latency.wait()
+        now = time.time()
+        window = self._windows.get(endpoint)
+        if window is None or now >= window[0] + self.window:
+            window = self._windows[endpoint] = [now, 0]
+        headers = {'x-rate-limit-limit': str(self.quota),
+                   'x-rate-limit-remaining': str(max(self.quota - window[1] - 1, 0)),
+                   'x-rate-limit-reset': str(int(window[0] + self.window))}
+        if window[1] >= self.quota:
+            self.throttled += 1
+            return None, headers
+        window[1] += 1
+        return [{'id': post_id, 'text': '', 'public_metrics': self._public_metrics(post_id, now)}
+                for post_id in ids], headers
+
+    async def lookup_one(self, request):
+        data, headers = await self._respond('/2/tweets/:id', [request.match_info['id']])
+        if data is None:
+            return web.json_response({'title': 'Too Many Requests'}, status=429, headers=headers)
+        return web.json_response({'data': data[0]}, headers=headers)
+
+    async def lookup_many(self, request):
+        data, headers = await self._respond('/2/tweets', request.query['ids'].split(','))
+        if data is None:
+            return web.json_response({'title': 'Too Many Requests'}, status=429, headers=headers)
+        return web.json_response({'data': data}, headers=headers)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/2/tweets/{id}', self.lookup_one)
+        app.router.add_get('/2/tweets', self.lookup_many)
+        return app
+
+
+async def serve(app):
+    """Start `app` on a free localhost port and return `(runner, base_url)`."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def raid_update(update_id, chat_id, post_id, goal, sent_at=None):
+    text = f"/raid https://x.com/benchmark/status/{post_id} {goal} {goal // 4} {goal // 10} {goal // 20}"
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(sent_at or time.time()), 'from': ADMIN, 'text': text,
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Benchmark'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}],
+    }}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def start_stand_ins(args):
+    """Start both stand-ins and return them, their runners and the environment pointing the bot at them."""
+    telegram = FakeTelegram(Latency(args.telegram_latency, args.jitter), args.telegram_global_rate,
+                            args.telegram_chat_rate)
+    twitter = FakeTwitter(Latency(args.twitter_latency, args.jitter), args.twitter_quota, args.twitter_window,
+                          args.curve, args.growth)
+    telegram_runner, telegram_url = await serve(telegram.app())
+    twitter_runner, twitter_url = await serve(twitter.app())
+    workdir = tempfile.mkdtemp(prefix='deraid-benchmark-')
+    env = {
+        'API_TOKEN': BENCHMARK_TOKEN,
+        'BEARER_TOKEN': 'benchmark',
+        'TELEGRAM_API_URL': telegram_url,
+        'TWITTER_API_URL': twitter_url,
+        'RAID_DB_PATH': os.path.join(workdir, 'raids.db'),
+        'MEDIA_CACHE_PATH': os.path.join(workdir, 'media_cache.json'),
+        'SHARD_SOCKET': os.path.join(workdir, 'shards.sock'),
+        'MIN_POLL_INTERVAL': str(args.poll_interval),
+    }
+    return telegram, twitter, [telegram_runner, twitter_runner], env
+
+
+def raid_updates(args):
+    return [raid_update(i + 1, -1000000000000 - i % args.chats, 1000 + i, args.goal) for i in range(args.raids)]
+
+
+def summarize(args, command_seconds, ticks, tick_seconds, raid_hours, twitter, telegram, twitter_before,
+              telegram_before, rss_mb):
+    """Summarize a run; `ticks`, `tick_seconds` and the call counts cover the tracking period only."""
+    twitter_calls = twitter.requests - twitter_before
+    return {
+        'commands_per_second': round(args.raids / command_seconds, 2),
+        'ticks': ticks,
+        'mean_tick_ms': round(tick_seconds / ticks * 1000, 2) if ticks else None,
+        'twitter_calls_per_tick': round(twitter_calls / ticks, 2) if ticks else None,
+        'twitter_calls_per_raid_hour': round(twitter_calls / raid_hours, 2) if raid_hours else None,
+        'telegram_calls_per_raid_hour': round((telegram.total_calls() - telegram_before) / raid_hours, 2) if raid_hours else None,
+        'twitter_throttled': twitter.throttled,
+        'telegram_throttled': telegram.throttled,
+        'max_rss_mb': round(rss_mb, 1),
+    }
+
+
+async def run(args):
+    """Drive the handlers of an imported bot module in this process."""
+    telegram, twitter, runners, env = await start_stand_ins(args)
+    os.environ.update(env)
+    bot = importlib.import_module('bot')
+    bot.Bot.set_current(bot.bot)
+    bot.Dispatcher.set_current(bot.dp)
+
+    tracker = asyncio.create_task(bot.track_engagement())
+    updates = [bot.types.Update(**update) for update in raid_updates(args)]
+    started = time.perf_counter()
+    await asyncio.gather(*(bot.dp.process_update(update) for update in updates))
+    command_seconds = time.perf_counter() - started
+
+    # Track for the requested duration, sampling how many raids are live to get raid-hours
+    twitter_before, telegram_before = twitter.requests, telegram.total_calls()
+    ticks_before, tick_seconds_before = bot.metrics.totals('deraid_tracker_tick_seconds')
+    raid_seconds = 0.0
+    tracking_started = time.perf_counter()
+    while time.perf_counter() - tracking_started < args.duration:
+        await asyncio.sleep(1)
+        raid_seconds += bot.raid_manager.active_count()
+    ticks, tick_seconds = bot.metrics.totals('deraid_tracker_tick_seconds')
+    ticks, tick_seconds = ticks - ticks_before, tick_seconds - tick_seconds_before
+
+    tracker.cancel()
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+    await bot.twitter_client.close()
+    await bot.raid_store.close()
+    await (await bot.bot.get_session()).close()
+    for runner in runners:
+        await runner.cleanup()
+    return summarize(args, command_seconds, ticks, tick_seconds, raid_seconds / 3600, twitter, telegram,
+                     twitter_before, telegram_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def run_queue(args):
+    """Microbenchmark RaidQueue with `--queue` raids queued by 50 admins, in microseconds per operation."""
+    os.environ.setdefault('API_TOKEN', BENCHMARK_TOKEN)
+    bot = importlib.import_module('bot')
+    queue = bot.RaidQueue()
+    entries = [{'queue_id': i, 'chat_id': -1, 'message_id': i, 'post_link': f"https://x.com/i/status/{i}",
+                'likes_goal': args.goal, 'retweets_goal': 0, 'replies_goal': 0, 'bookmarks_goal': 0,
+                'requested_by': i % 50, 'priority': 0} for i in range(args.queue)]
+    sample = random.Random(0).sample(range(args.queue), min(1000, args.queue // 10))
+
+    def timed(operation, items):
+        started = time.perf_counter()
+        for item in items:
+            operation(item)
+        return round((time.perf_counter() - started) / len(items) * 1e6, 2)
+
+    results = {'push_us': timed(queue.push, entries)}
+    results['reprioritize_us'] = timed(lambda i: queue.reprioritize(i, 1), sample)
+    results['cancel_us'] = timed(queue.remove, sample)
+    results['first_page_us'] = timed(queue.page, [1] * 100)
+    results['position_100_us'] = timed(queue.at, [100] * 100)
+    results['pop_us'] = timed(lambda _: queue.pop(), range(len(queue)))
+    return results
+
+
+def run_table(args):
+    """Microbenchmark one tracker tick's progress evaluation and card rendering over `--table` raids."""
+    os.environ.setdefault('API_TOKEN', BENCHMARK_TOKEN)
+    bot = importlib.import_module('bot')
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    raids = [bot.new_raid(f"https://x.com/i/status/{i}", args.goal, args.goal // 10, 0, args.goal // 20, -i, i,
+                          baseline={'like_count': i % 1000, 'retweet_count': i % 100})
+             for i in range(args.table)]
+    allocated = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+    table = bot.raid_table
+    columns = (table.goals, table.baselines, table.counts, table.percentages, table.colors, table.overall,
+               table.filled, table.complete)
+
+    ticks = 10
+    evaluate_seconds = render_seconds = 0.0
+    for tick in range(1, ticks + 1):
+        for raid in raids:
+            raid.set_counts([count + tick * args.goal // ticks for count in raid.baselines()])
+        started = time.perf_counter()
+        table.evaluate([raid.slot for raid in raids])
+        evaluate_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        for raid in raids:
+            bot.render_raid_card(raid)
+        render_seconds += time.perf_counter() - started
+    return {
+        'evaluate_ms_per_tick': round(evaluate_seconds / ticks * 1000, 2),
+        'render_ms_per_tick': round(render_seconds / ticks * 1000, 2),
+        'completed': sum(raid.complete for raid in raids),
+        'bytes_per_raid': round(allocated / args.table),
+        'table_bytes_per_raid': round(sum(column.itemsize * len(column) for column in columns) / args.table),
+    }
+
+
+def process_tree_rss_mb(pid):
+    """Return the resident memory of a process and all its descendants, read from /proc."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            total += next(int(line.split()[1]) for line in status if line.startswith('VmRSS:')) / 1024
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            total += sum(process_tree_rss_mb(int(child)) for child in children.read().split())
+    except (OSError, StopIteration):
+        pass
+    return total
+
+
+async def scrape(session, port):
+    """Return `{sample: value}` from a /metrics endpoint, or {} while it is not up."""
+    try:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+            text = await response.text()
+    except aiohttp.ClientError:
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+async def scrape_ticks(session, ports):
+    """Return the tracker ticks and the seconds they took, summed over the processes on `ports`."""
+    ticks = tick_seconds = 0
+    for samples in await asyncio.gather(*(scrape(session, port) for port in ports)):
+        ticks += samples.get('deraid_tracker_tick_seconds_count', 0)
+        tick_seconds += samples.get('deraid_tracker_tick_seconds_sum', 0)
+    return ticks, tick_seconds
+
+
+async def run_sharded(args):
+    """Run bot.py with `--shards` worker processes, feeding it the commands through getUpdates."""
+    telegram, twitter, runners, env = await start_stand_ins(args)
+    # With one shard bot.py runs unsharded and serves its metrics itself
+    ports = [args.metrics_port] if args.shards == 1 else [args.metrics_port + 1 + shard for shard in range(args.shards)]
+    env.update(SHARD_COUNT=str(args.shards), METRICS_PORT=str(args.metrics_port))
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath('bot.py'),
+                                                   env=dict(os.environ, **env))
+    async with aiohttp.ClientSession() as session:
+        while not all(await asyncio.gather(*(scrape(session, port) for port in ports))):
+            await asyncio.sleep(0.2)
+
+        started = time.perf_counter()
+        telegram.deliver(raid_updates(args))
+        while telegram.answered < args.raids:
+            await asyncio.sleep(0.01)
+        command_seconds = time.perf_counter() - started
+
+        twitter_before, telegram_before = twitter.requests, telegram.total_calls()
+        ticks, tick_seconds = await scrape_ticks(session, ports)
+        raid_seconds, rss_mb = 0.0, 0.0
+        tracking_started = time.perf_counter()
+        while time.perf_counter() - tracking_started < args.duration:
+            await asyncio.sleep(1)
+            for samples in await asyncio.gather(*(scrape(session, port) for port in ports)):
+                raid_seconds += samples.get('deraid_active_raids', 0)
+            rss_mb = max(rss_mb, process_tree_rss_mb(process.pid))
+        ticks_after, tick_seconds_after = await scrape_ticks(session, ports)
+        ticks, tick_seconds = ticks_after - ticks, tick_seconds_after - tick_seconds
+
+    process.terminate()
+    await process.wait()
+    for runner in runners:
+        await runner.cleanup()
+    return summarize(args, command_seconds, int(ticks), tick_seconds, raid_seconds / 3600, twitter, telegram,
+                     twitter_before, telegram_before, rss_mb)
+
+
+async def seed_store(args, path):
+    """Store `--startup` ongoing raids, one per chat with its card pinned and a pending deletion."""
+    bot = importlib.import_module('bot')
+    store = bot.RaidStore(path=path)
+    started_at = datetime.utcnow()
+    for i in range(args.startup):
+        chat_id = -1000000000000 - i
+        raid = bot.new_raid(f"https://x.com/benchmark/status/{1000 + i}", args.goal, args.goal // 4, args.goal // 10,
+                            args.goal // 20, chat_id, 1)
+        raid.pinned_message_id = 2
+        store.save_raid(chat_id, raid, started_at)
+        store.save_deletion(chat_id, 3, time.time() + 3600)
+    await store.close()
+
+
+async def run_startup(args):
+    """Start bot.py on a store of `--startup` raids and time it until it answers a fresh /raid."""
+    telegram, twitter, runners, env = await start_stand_ins(args)
+    env['STALE_UPDATE_POLICY'] = args.stale_policy
+    os.environ.update(env)
+    await seed_store(args, env['RAID_DB_PATH'])
+    # Every tenth card was unpinned while the bot was down
+    telegram.pinned = {-1000000000000 - i: 2 for i in range(args.startup) if i % 10}
+
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import bot'], env=dict(os.environ), check=True)
+    import_seconds = time.perf_counter() - started
+
+    # The backlog was sent ten minutes before the restart, the fresh command comes after it
+    fresh_chat = -2000000000000
+    telegram.deliver([raid_update(i + 1, -3000000000000 - i, 5000 + i, args.goal, sent_at=time.time() - 600)
+                      for i in range(args.backlog)]
+                     + [raid_update(args.backlog + 1, fresh_chat, 9999, args.goal)])
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath('bot.py'),
+                                                   env=dict(os.environ))
+    first_command_seconds = reconciled_seconds = None
+    while time.perf_counter() - started < 120 and None in (first_command_seconds, reconciled_seconds):
+        await asyncio.sleep(0.01)
+        if first_command_seconds is None and fresh_chat in telegram.answered_at:
+            first_command_seconds = telegram.answered_at[fresh_chat] - started
+        if telegram.calls.get('getChat', 0) >= args.startup and len(telegram.pinned) >= args.startup:
+            reconciled_seconds = time.perf_counter() - started
+    stale_answered = len([chat_id for chat_id in telegram.answered_at if chat_id != fresh_chat])
+
+    process.terminate()
+    await process.wait()
+    for runner in runners:
+        await runner.cleanup()
+    return {
+        'import_s': round(import_seconds, 3),
+        'time_to_first_command_s': first_command_seconds and round(first_command_seconds, 3),
+        'reconciled_s': reconciled_seconds and round(reconciled_seconds, 3),
+        'stale_answered': stale_answered,
+        'telegram_calls': telegram.total_calls(),
+    }
+
+
+async def time_answers(args, mode):
+    """Run bot.py in `mode` ('polling' or 'webhook') and return the seconds until each chat got its answer."""
+    telegram, twitter, runners, env = await start_stand_ins(args)
+    webhook_url = f"http://127.0.0.1:{args.webhook_port}"
+    webhook_path = os.environ.get('WEBHOOK_PATH', '/telegram')
+    env.update(BOT_MODE=mode, METRICS_PORT=str(args.metrics_port), WEBHOOK_URL=webhook_url,
+               WEBHOOK_SECRET='benchmark', WEBAPP_HOST='127.0.0.1', PORT=str(args.webhook_port))
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath('bot.py'),
+                                                   env=dict(os.environ, **env))
+    updates = raid_updates(args)
+    chats = {update['message']['chat']['id'] for update in updates}
+    # Telegram opens up to 40 connections to a webhook by default
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=40)) as session:
+        # The webhook takes updates once the bot registered it with Telegram
+        while not (await scrape(session, args.metrics_port)
+                   and (mode == 'polling' or 'setWebhook' in telegram.calls)):
+            await asyncio.sleep(0.2)
+
+        async def post(update):
+            async with session.post(webhook_url + webhook_path, json=update,
+                                    headers={'X-Telegram-Bot-Api-Secret-Token': 'benchmark'}) as response:
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        if mode == 'webhook':
+            await asyncio.gather(*(post(update) for update in updates))
+        else:
+            telegram.deliver(updates)
+        while len(telegram.answered_at) < len(chats) and time.perf_counter() - started < 120:
+            await asyncio.sleep(0.01)
+
+    process.terminate()
+    await process.wait()
+    for runner in runners:
+        await runner.cleanup()
+    return sorted(answered_at - started for answered_at in telegram.answered_at.values())
+
+
+async def run_webhook_comparison(args):
+    """Time the first answer in every chat with the updates posted to the webhook, then fetched with getUpdates."""
+    results = {}
+    for mode in ('webhook', 'polling'):
+        seconds = await time_answers(args, mode)
+        results[f'{mode}_answered'] = len(seconds)
+        for percentile in (50, 95):
+            value = seconds[min(int(len(seconds) * percentile / 100), len(seconds) - 1)] if seconds else None
+            results[f'{mode}_p{percentile}_ms'] = value and round(value * 1000, 1)
+    if results['webhook_p50_ms'] and results['polling_p50_ms']:
+        results['webhook_vs_polling_p50'] = round(results['webhook_p50_ms'] / results['polling_p50_ms'], 2)
+    return results
+
+
+def compare(params, results):
+    """Print the change of every result against the last stored run with the same parameters."""
+    previous = None
+    if os.path.exists(BENCHMARK_RESULTS):
+        with open(BENCHMARK_RESULTS) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['params'] == params:
+                    previous = record
+    for name, value in results.items():
+        line = f"{name:>30}: {value}"
+        before = previous and previous['results'].get(name)
+        if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+            line += f"  ({(value - before) / before * 100:+.1f}% vs {previous['commit']})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--raids', type=int, default=100, help="spread over the chats; the extra ones are queued")
+    parser.add_argument('--duration', type=float, default=60, help="seconds the tracker runs after the commands")
+    parser.add_argument('--goal', type=int, default=1000, help="likes goal of every raid")
+    parser.add_argument('--poll-interval', type=float, default=5, help="MIN_POLL_INTERVAL of the bot")
+    parser.add_argument('--curve', choices=sorted(GROWTH_CURVES), default='linear')
+    parser.add_argument('--growth', type=float, default=20, help="likes per minute of every tweet")
+    parser.add_argument('--telegram-latency', type=float, default=50, help="milliseconds")
+    parser.add_argument('--twitter-latency', type=float, default=150, help="milliseconds")
+    parser.add_argument('--jitter', type=float, default=0.5, help="fraction of the latency responses vary by")
+    parser.add_argument('--telegram-global-rate', type=int, default=30, help="calls per second")
+    parser.add_argument('--telegram-chat-rate', type=int, default=20, help="messages per minute in one group")
+    parser.add_argument('--twitter-quota', type=int, default=300, help="requests per endpoint and window")
+    parser.add_argument('--twitter-window', type=float, default=900, help="seconds")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="run bot.py in a subprocess with this SHARD_COUNT instead of in-process, 1 is unsharded")
+    parser.add_argument('--metrics-port', type=int, default=19100, help="metrics port of the sharded coordinator")
+    parser.add_argument('--queue', type=int, default=0,
+                        help="only microbenchmark a raid queue holding this many raids")
+    parser.add_argument('--table', type=int, default=0,
+                        help="only microbenchmark progress evaluation over this many concurrent raids")
+    parser.add_argument('--startup', type=int, default=0,
+                        help="only time a cold start of bot.py restoring this many raids")
+    parser.add_argument('--backlog', type=int, default=100, help="stale /raid commands waiting at startup")
+    parser.add_argument('--stale-policy', choices=('drain', 'skip'), default='drain',
+                        help="STALE_UPDATE_POLICY of the bot at startup")
+    parser.add_argument('--webhook', action='store_true',
+                        help="only compare how fast bot.py answers updates posted to its webhook and fetched with getUpdates")
+    parser.add_argument('--webhook-port', type=int, default=19200, help="port bot.py serves its webhook on")
+    parser.add_argument('--no-save', action='store_true', help="do not append the results to BENCHMARK_RESULTS")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # bot.py opens its banner relative to the repo
+    params = {name: value for name, value in vars(args).items()
+              if name not in ('no_save', 'metrics_port', 'webhook', 'webhook_port')}
+    if args.queue:
+        params = {'queue': args.queue, 'goal': args.goal}
+        results = run_queue(args)
+    elif args.table:
+        params = {'table': args.table, 'goal': args.goal}
+        results = run_table(args)
+    elif args.startup:
+        params = {'startup': args.startup, 'backlog': args.backlog, 'stale_policy': args.stale_policy,
+                  'goal': args.goal, 'telegram_latency': args.telegram_latency,
+                  'twitter_latency': args.twitter_latency}
+        results = asyncio.run(run_startup(args))
+    elif args.webhook:
+        params = {'webhook': True, 'chats': args.chats, 'raids': args.raids, 'goal': args.goal,
+                  'telegram_latency': args.telegram_latency, 'twitter_latency': args.twitter_latency,
+                  'telegram_global_rate': args.telegram_global_rate, 'telegram_chat_rate': args.telegram_chat_rate}
+        results = asyncio.run(run_webhook_comparison(args))
+    else:
+        results = asyncio.run(run_sharded(args) if args.shards else run(args))
+    compare(params, results)
+    if not args.no_save:
+        with open(BENCHMARK_RESULTS, 'a') as f:
+            f.write(json.dumps({'commit': git_commit(), 'timestamp': int(time.time()), 'params': params,
+                                'results': results}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,1967 @@
 import os
 import asyncio
+from array import array
+from bisect import bisect_left
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types import InlineQuery, InputTextMessageContent, InlineQueryResultArticle
-from collections import deque
-import tweepy
+from aiogram.utils.exceptions import (BadRequest, ChatNotFound, MessageCantBeEdited, MessageIdInvalid,
+                                      MessageNotModified, MessageToEditNotFound, RetryAfter, Unauthorized,
+                                      WrongFileIdentifier, WrongRemoteFileIdSpecified)
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import random
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import aiohttp
 from dotenv import load_dotenv
-from aiohttp import ServerDisconnectedError
+from aiohttp import ServerDisconnectedError, web
 from datetime import datetime, timedelta
 
 # Load environment variables from .env file
 load_dotenv()
 
 API_TOKEN = os.getenv('API_TOKEN')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # Alternative Bot API server, e.g. a local stand-in for benchmarks
 BEARER_TOKEN = os.getenv('BEARER_TOKEN')
+TWITTER_API_URL = os.getenv('TWITTER_API_URL', 'https://api.twitter.com')
+TWITTER_TIMEOUT = float(os.getenv('TWITTER_TIMEOUT', '10'))  # Seconds before a Twitter call is abandoned
+TWITTER_MAX_CONCURRENCY = int(os.getenv('TWITTER_MAX_CONCURRENCY', '8'))  # Simultaneous Twitter requests
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '3'))  # Consecutive failed requests that open an endpoint's circuit
+CIRCUIT_BASE_DELAY = float(os.getenv('CIRCUIT_BASE_DELAY', '15'))  # Seconds a circuit first stays open, doubled after every failed probe
+CIRCUIT_MAX_DELAY = float(os.getenv('CIRCUIT_MAX_DELAY', '600'))  # Longest a circuit stays open before the next probe
+TWEET_LOOKUP_BATCH_SIZE = 100  # Maximum number of ids accepted by one GET /2/tweets lookup
+METRICS_CACHE_TTL = float(os.getenv('METRICS_CACHE_TTL', '10'))  # Seconds fetched metrics stay fresh
+METRICS_CACHE_SIZE = int(os.getenv('METRICS_CACHE_SIZE', '10000'))  # Tweets kept before evicting the least used
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Port of the Prometheus /metrics endpoint, 0 disables it
+EVENT_LOOP_LAG_INTERVAL = 0.5  # Seconds between two event-loop lag probes
+WATCHDOG_THRESHOLD = float(os.getenv('WATCHDOG_THRESHOLD', '0'))  # Seconds the loop may block before its stack is logged, 0 disables the watchdog
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0'))  # Seconds between stack samples of the loop, 0 disables the profiler
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    """Minimal registry of counters, gauges and histograms exposed in the Prometheus text format.
+
+    Counters and histograms are updated in place by the code being measured. Gauges are
+    callbacks evaluated when the endpoint is scraped, returning either a number or a list of
+    `(labels, value)` pairs, so reading bot state costs nothing between scrapes. A counter
+    can be read through such a callback too when the code already keeps the running total.
+    """
+
+    def __init__(self):
+        self._descriptions = {}  # name -> (type, help), in registration order
+        self._counters = {}  # name -> {labels: value}
+        self._histograms = {}  # name -> {labels: [count per bucket..., count above the last bucket, sum]}
+        self._buckets = {}
+        self._callbacks = {}  # name -> callback of gauges and callback-backed counters
+
+    def counter(self, name, help_text, callback=None):
+        self._descriptions[name] = ('counter', help_text)
+        self._counters[name] = {}
+        if callback is not None:
+            self._callbacks[name] = callback
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._descriptions[name] = ('histogram', help_text)
+        self._histograms[name] = {}
+        self._buckets[name] = buckets
+
+    def gauge(self, name, help_text, callback):
+        self._descriptions[name] = ('gauge', help_text)
+        self._callbacks[name] = callback
+
+    def inc(self, name, amount=1, **labels):
+        series = self._counters[name]
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        series = self._histograms[name]
+        key = tuple(sorted(labels.items()))
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * (len(self._buckets[name]) + 1) + [0.0]
+        counts[bisect_left(self._buckets[name], value)] += 1
+        counts[-1] += value
+
+    def totals(self, name):
+        """Return `(count, sum)` of a histogram across all of its labels."""
+        series = self._histograms[name].values()
+        return sum(sum(counts[:-1]) for counts in series), sum(counts[-1] for counts in series)
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        pairs = ",".join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                         for key, value in labels)
+        return "{" + pairs + "}"
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, (kind, help_text) in self._descriptions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self._callbacks:
+                try:
+                    value = self._callbacks[name]()
+                except Exception as e:
+                    print(f"Error collecting metric {name}: {str(e)}")
+                    continue
+                samples = value if isinstance(value, list) else [({}, value)]
+                for labels, sample in samples:
+                    lines.append(f"{name}{self._format_labels(tuple(sorted(labels.items())))} {sample}")
+            elif kind == 'counter':
+                for labels, value in self._counters[name].items():
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+            else:
+                for labels, counts in self._histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(self._buckets[name] + (float('inf'),), counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else bound
+                        lines.append(f"{name}_bucket{self._format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {counts[-1]}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.histogram('deraid_twitter_request_seconds', 'Latency of Twitter API requests.')
+metrics.counter('deraid_twitter_errors_total', 'Twitter API requests that failed, by error.')
+metrics.histogram('deraid_telegram_request_seconds', 'Latency of Telegram Bot API calls, by API method.')
+metrics.counter('deraid_telegram_errors_total', 'Telegram Bot API calls that failed, by error.')
+metrics.histogram('deraid_event_loop_lag_seconds', 'How late the event loop wakes up from a short sleep.')
+metrics.histogram('deraid_tracker_tick_seconds', 'Time spent polling and updating raids in one tracker tick.')
+metrics.histogram('deraid_handler_seconds', 'Time spent handling one update, by command or update type.')
+metrics.counter('deraid_twitter_circuit_trips_total', 'Times the circuit of a Twitter endpoint opened.')
+metrics.counter('deraid_event_loop_stalls_total', 'Times the event loop was blocked past WATCHDOG_THRESHOLD.')
+metrics.counter('deraid_stale_updates_total', 'Messages sent while the bot was down that were skipped as stale.')
+metrics.gauge('deraid_twitter_quota_remaining', 'Requests left in the current Twitter rate-limit window.',
+              lambda: [({'endpoint': endpoint}, remaining)
+                       for endpoint, (remaining, _) in twitter_client.rate_limits.items()])
+metrics.gauge('deraid_twitter_quota_reset_seconds', 'Seconds until the Twitter rate-limit window resets.',
+              lambda: [({'endpoint': endpoint}, max(reset_at - time.time(), 0))
+                       for endpoint, (_, reset_at) in twitter_client.rate_limits.items()])
+metrics.gauge('deraid_twitter_circuit_open', 'Whether requests to a Twitter endpoint are currently refused.',
+              lambda: [({'endpoint': endpoint}, int(breaker.is_open()))
+                       for endpoint, breaker in twitter_client.breakers.items()])
+metrics.gauge('deraid_active_raids', 'Raids currently being tracked.', lambda: raid_manager.active_count())
+metrics.gauge('deraid_raided_tweets', 'Distinct tweets being raided, each looked up once for all of its chats.',
+              lambda: raid_manager.subscriptions.tweet_count())
+# Summarized rather than per chat, which would add a series for every group the bot is in
+metrics.gauge('deraid_poll_interval_seconds', 'Effective seconds between the polls of the active raids, by statistic.',
+              lambda: [({'stat': stat}, interval) for stat, interval in poll_scheduler.summary().items()])
+metrics.gauge('deraid_queued_raids', 'Raids waiting in chat queues.', lambda: raid_manager.queued_count())
+metrics.gauge('deraid_pending_deletions', 'Messages scheduled for deletion.', lambda: deletion_scheduler.pending())
+metrics.gauge('deraid_telegram_pending_calls', 'Outbound Telegram calls waiting in the dispatcher.',
+              lambda: outbox.pending())
+metrics.counter('deraid_metrics_cache_lookups_total', 'Tweet metric lookups by how they were served.',
+                lambda: [({'result': result}, count) for result, count in metrics_cache.stats().items()
+                         if result != 'size'])
+metrics.counter('deraid_card_updates_total', 'Tracker card refreshes sent or skipped because nothing changed.',
+                lambda: [({'result': result}, count) for result, count in card_update_stats.items()])
+
+
+class TwitterError(Exception):
+    """Base of every error raised while looking tweets up."""
+
+
+class TwitterHTTPError(TwitterError):
+    """Twitter answered a request with an error status."""
+
+    def __init__(self, response, response_json=None):
+        self.response = response
+        self.status = response.status
+        payload = response_json or {}
+        errors = payload.get('errors', []) + ([payload] if 'detail' in payload else [])
+        self.api_messages = [error.get('message') or error.get('detail') for error in errors]
+        super().__init__("\n".join([f"{response.status} {response.reason}"] + [m for m in self.api_messages if m]))
+
+
+class CircuitOpenError(TwitterError):
+    """Raised instead of calling a Twitter endpoint whose circuit is open."""
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f"Twitter is not responding, trying again in {retry_in:.0f} seconds")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Stops calling a failing endpoint and probes it with exponential backoff.
+
+    After `threshold` consecutive failures the circuit opens and requests are refused for a
+    delay that doubles with every failed probe, up to `max_delay`, less a random jitter of up
+    to half so processes restarted together don't probe in lockstep. When the delay is over a
+    single request goes through as a probe: its success closes the circuit, its failure
+    opens it again. Other requests are refused while the probe is in flight, for at most
+    `probe_timeout` seconds.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+    MIN_RETRY_IN = 1.0  # Least wait reported while a probe is in flight, it may be queued past its timeout
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, base_delay=CIRCUIT_BASE_DELAY,
+                 max_delay=CIRCUIT_MAX_DELAY, probe_timeout=TWITTER_TIMEOUT):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0  # Consecutive failed requests
+        self.trips = 0  # Consecutive times the circuit opened, sets the backoff
+        self.open_until = 0.0
+        self.probing = False
+
+    def retry_in(self):
+        """Seconds until a request may be sent again; positive whenever `is_open()`."""
+        if self.probing:
+            # The probe's answer decides, it is due by the time its request times out
+            return max(self.open_until - time.monotonic(), self.MIN_RETRY_IN)
+        return max(self.open_until - time.monotonic(), 0.0)
+
+    def is_open(self):
+        """Whether a request made now would be refused."""
+        return (self.state == self.OPEN and self.retry_in() > 0) or self.probing
+
+    def acquire(self):
+        """Return whether a request may be sent now, making it the probe when the delay is over."""
+        if self.state == self.CLOSED:
+            return True
+        if self.is_open():
+            return False
+        self.state = self.HALF_OPEN
+        self.probing = True
+        self.open_until = time.monotonic() + self.probe_timeout
+        return True
+
+    def succeeded(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def failed(self):
+        """Count a failed request; return True when it opened the circuit."""
+        self.failures += 1
+        if self.state == self.CLOSED and self.failures < self.threshold:
+            return False
+        delay = min(self.base_delay * 2 ** self.trips, self.max_delay)
+        self.trips += 1
+        self.open_until = time.monotonic() + delay * random.uniform(0.5, 1)
+        self.state = self.OPEN
+        self.probing = False
+        return True
+
+    def abandoned(self):
+        """The probe was canceled before it got an answer; the next request probes instead."""
+        self.probing = False
+        self.open_until = 0.0
+
+    def mirror(self, open_for):
+        """Follow a circuit kept by another process, open for `open_for` more seconds."""
+        if open_for > 0:
+            self.state = self.OPEN
+            self.open_until = time.monotonic() + open_for
+        elif self.state == self.OPEN:
+            self.state = self.CLOSED
+            self.failures = 0
+
+
+class TwitterMetricsClient:
+    """Non-blocking client for the Twitter v2 tweet lookup endpoint.
+
+    Every call shares one keep-alive aiohttp session, waits on a semaphore so at most
+    `max_concurrency` requests are in flight, and is abandoned after `timeout` seconds.
+    Cancelling the awaiting task cancels the HTTP request with it. Errors are raised as
+    TwitterError, error statuses as TwitterHTTPError.
+    Every endpoint has a CircuitBreaker: while it is open requests fail at once with
+    CircuitOpenError instead of reaching Twitter.
+    """
+
+    def __init__(self, bearer_token, base_url=TWITTER_API_URL, timeout=TWITTER_TIMEOUT,
+                 max_concurrency=TWITTER_MAX_CONCURRENCY):
+        self.bearer_token = bearer_token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._semaphore = None
+        self.rate_limits = {}  # endpoint -> (remaining requests, window reset as a unix timestamp)
+        self.breakers = {}  # endpoint -> CircuitBreaker
+
+    def _get_session(self):
+        """Create the pooled session lazily, inside the running event loop."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Bearer {self.bearer_token}"},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    def _record_rate_limit(self, endpoint, headers):
+        try:
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset_at = int(headers['x-rate-limit-reset'])
+        except (KeyError, ValueError):
+            return
+        self.rate_limits[endpoint] = (remaining, reset_at)
+
+    def _breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker()
+        return breaker
+
+    def _record_failure(self, endpoint, breaker):
+        if breaker.failed():
+            metrics.inc('deraid_twitter_circuit_trips_total', endpoint=endpoint)
+            print(f"Twitter circuit for {endpoint} opened, next probe in {breaker.retry_in():.0f} seconds")
+
+    def _record_success(self, endpoint, breaker):
+        if breaker.state != CircuitBreaker.CLOSED:
+            print(f"Twitter circuit for {endpoint} closed")
+        breaker.succeeded()
+
+    def circuit_open(self, endpoint):
+        """Whether requests to `endpoint` are currently refused."""
+        breaker = self.breakers.get(endpoint)
+        return breaker is not None and breaker.is_open()
+
+    def circuits(self):
+        """Return `{endpoint: seconds its circuit stays open}`, 0 for circuits letting requests through."""
+        return {endpoint: breaker.retry_in() if breaker.is_open() else 0 for endpoint, breaker in self.breakers.items()}
+
+    def mirror_circuits(self, circuits):
+        """Follow the circuits of the process that makes the requests on our behalf."""
+        for endpoint, open_for in circuits.items():
+            self._breaker(endpoint).mirror(open_for)
+
+    async def request(self, route, params=None, endpoint=None):
+        """Perform a GET request against the API and return the decoded JSON body.
+
+        The rate-limit headers of the response are kept in `rate_limits` under `endpoint`
+        (the route itself by default). Timeouts, connection errors, 429 and 5xx responses
+        count towards opening the endpoint's circuit.
+        """
+        endpoint = endpoint or route
+        breaker = self._breaker(endpoint)
+        if not breaker.acquire():
+            raise CircuitOpenError(endpoint, breaker.retry_in())
+        session = self._get_session()
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.get(self.base_url + route, params=params) as response:
+                        body = await response.read()
+                except asyncio.TimeoutError:
+                    metrics.inc('deraid_twitter_errors_total', endpoint=endpoint, error='timeout')
+                    raise TwitterError(f"Twitter did not respond within {self.timeout} seconds")
+                except aiohttp.ClientError as e:
+                    metrics.inc('deraid_twitter_errors_total', endpoint=endpoint, error=type(e).__name__)
+                    raise
+                finally:
+                    metrics.observe('deraid_twitter_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+        except asyncio.CancelledError:
+            breaker.abandoned()
+            raise
+        except Exception:
+            self._record_failure(endpoint, breaker)
+            raise
+        self._record_rate_limit(endpoint, response.headers)
+
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+
+        if response.status == 429 or response.status >= 500:
+            self._record_failure(endpoint, breaker)
+        else:
+            self._record_success(endpoint, breaker)
+        if not 200 <= response.status < 300:
+            metrics.inc('deraid_twitter_errors_total', endpoint=endpoint, error=str(response.status))
+            raise TwitterHTTPError(response, response_json=payload)
+        return payload
+
+    async def get_public_metrics(self, post_id):
+        """Return the `public_metrics` dict of a single tweet."""
+        payload = await self.request(f"/2/tweets/{post_id}", params={"tweet.fields": "public_metrics"},
+                                     endpoint="/2/tweets/:id")
+        data = payload.get('data')
+        if not data:
+            raise TwitterError(f"Tweet {post_id} could not be found")
+        return data['public_metrics']
+
+    async def get_public_metrics_batch(self, post_ids):
+        """Return `{post_id: public_metrics}` for many tweets in ceil(n / 100) lookups.
+
+        Duplicate ids are fetched once and tweets that no longer exist are left out.
+        """
+        unique_ids = list(dict.fromkeys(str(post_id) for post_id in post_ids))
+        batches = [unique_ids[i:i + TWEET_LOOKUP_BATCH_SIZE]
+                   for i in range(0, len(unique_ids), TWEET_LOOKUP_BATCH_SIZE)]
+        payloads = await asyncio.gather(*(
+            self.request("/2/tweets", params={"ids": ",".join(batch), "tweet.fields": "public_metrics"})
+            for batch in batches
+        ))
+
+        metrics = {}
+        for payload in payloads:
+            for tweet in payload.get('data') or []:
+                metrics[tweet['id']] = tweet['public_metrics']
+        return metrics
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class MetricsCache:
+    """TTL-bounded LRU cache of tweet metrics shared by /raid, /status and the tracker.
+
+    Fresh entries are served without an API call. Missing or stale ids are fetched in one
+    batched lookup, and callers asking for a tweet that is already being fetched wait for
+    that request instead of starting their own. `hits`, `misses` and `coalesced` count how
+    lookups were served; every hit or coalesced lookup is an API call saved.
+    """
+
+    def __init__(self, client, ttl=METRICS_CACHE_TTL, max_size=METRICS_CACHE_SIZE):
+        self.client = client
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # post_id -> (fetched_at, public_metrics), least recently used first
+        self._in_flight = {}  # post_id -> future resolving to the {post_id: public_metrics} of its lookup
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _lookup(self, post_id, now, max_age):
+        entry = self._entries.get(post_id)
+        if entry is None or now - entry[0] >= max_age:
+            return None
+        self._entries.move_to_end(post_id)
+        return entry[1]
+
+    def _store(self, post_id, metrics, now):
+        self._entries[post_id] = (now, metrics)
+        self._entries.move_to_end(post_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "size": len(self._entries)}
+
+    async def get(self, post_id):
+        """Return the `public_metrics` dict of a single tweet."""
+        metrics = (await self.get_many([post_id])).get(str(post_id))
+        if metrics is None:
+            raise TwitterError(f"Tweet {post_id} could not be found")
+        return metrics
+
+    async def get_many(self, post_ids, max_age=None):
+        """Return `{post_id: public_metrics}` for many tweets; tweets that do not exist are left out.
+
+        `max_age` lowers the TTL for callers that need fresher numbers than usual.
+        """
+        now = time.monotonic()
+        max_age = self.ttl if max_age is None else min(max_age, self.ttl)
+        result = {}
+        pending = {}
+        to_fetch = []
+        for post_id in dict.fromkeys(str(post_id) for post_id in post_ids):
+            metrics = self._lookup(post_id, now, max_age)
+            if metrics is not None:
+                self.hits += 1
+                result[post_id] = metrics
+            elif post_id in self._in_flight:
+                self.coalesced += 1
+                pending[post_id] = self._in_flight[post_id]
+            else:
+                self.misses += 1
+                to_fetch.append(post_id)
+
+        if to_fetch:
+            lookup = asyncio.get_running_loop().create_future()
+            for post_id in to_fetch:
+                self._in_flight[post_id] = lookup
+            try:
+                fetched = await self.client.get_public_metrics_batch(to_fetch)
+            except asyncio.CancelledError:
+                lookup.cancel()
+                raise
+            except Exception as e:
+                lookup.set_exception(e)
+                lookup.exception()  # Waiters re-raise it; don't warn when there are none
+                raise
+            finally:
+                for post_id in to_fetch:
+                    self._in_flight.pop(post_id, None)
+
+            fetched_at = time.monotonic()
+            for post_id, metrics in fetched.items():
+                self._store(post_id, metrics, fetched_at)
+            lookup.set_result(fetched)
+            result.update(fetched)
+
+        for post_id, lookup in pending.items():
+            # Shielded so a waiter being canceled does not cancel the lookup other callers share
+            fetched = await asyncio.shield(lookup)
+            if post_id in fetched:
+                result[post_id] = fetched[post_id]
+        return result
+
+
+# All Twitter traffic goes through this client so it never blocks the event loop
+twitter_client = TwitterMetricsClient(bearer_token=BEARER_TOKEN)
+metrics_cache = MetricsCache(twitter_client)
+
+class InstrumentedBot(Bot):
+    """Bot that times every Bot API request and counts its errors, whether or not it went through the outbox."""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception as e:
+            metrics.inc('deraid_telegram_errors_total', method=method, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe('deraid_telegram_request_seconds', time.perf_counter() - started, method=method)
 
-# Initialize the Tweepy client with OAuth2 Bearer Token
-twitter_client = tweepy.Client(bearer_token=BEARER_TOKEN)
 
 # Initialize bot and dispatcher
-bot = Bot(token=API_TOKEN)
+bot = InstrumentedBot(token=API_TOKEN,
+                      server=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION)
 dp = Dispatcher(bot)
 
-raid_queue = deque()  # Using deque for efficient queue management
-ongoing_raid = None
-stop_engagement_task = False  # Flag to stop engagement tracking
-raid_start_time = None  # To track the start time of the raid
-queue_enabled = False  # Flag to enable/disable queue system
+
+class HandlerTimer(BaseMiddleware):
+    """Records how long each update takes to handle, labelled by its command or update type.
+
+    Hooks the per-type events rather than `update` ones, which only fire for updates that
+    arrive through `process_updates` and would miss the webhook server.
+    """
+
+    @staticmethod
+    def start(data: dict):
+        data['handler_started'] = time.perf_counter()
+
+    @staticmethod
+    def record(handler, data: dict):
+        started = data.get('handler_started')
+        if started is not None:
+            metrics.observe('deraid_handler_seconds', time.perf_counter() - started, handler=handler)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self.start(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self.record(message.get_command(pure=True) or 'message', data)
+
+    async def on_pre_process_inline_query(self, inline_query: InlineQuery, data: dict):
+        self.start(data)
+
+    async def on_post_process_inline_query(self, inline_query: InlineQuery, results, data: dict):
+        self.record('inline_query', data)
+
+    async def on_pre_process_chat_member(self, update: types.ChatMemberUpdated, data: dict):
+        self.start(data)
+
+    async def on_post_process_chat_member(self, update: types.ChatMemberUpdated, results, data: dict):
+        self.record('chat_member', data)
+
+    async def on_pre_process_my_chat_member(self, update: types.ChatMemberUpdated, data: dict):
+        self.start(data)
+
+    async def on_post_process_my_chat_member(self, update: types.ChatMemberUpdated, results, data: dict):
+        self.record('my_chat_member', data)
+
+
+dp.middleware.setup(HandlerTimer())
+
+STALE_UPDATE_POLICY = os.getenv('STALE_UPDATE_POLICY', 'drain')  # 'drain' answers what was sent while the bot was down, 'skip' ignores stale messages
+STALE_UPDATE_AGE = float(os.getenv('STALE_UPDATE_AGE', '60'))  # Seconds a message must predate startup by to be stale
+
+
+class StaleUpdateFilter(BaseMiddleware):
+    """Drops the messages sent while the bot was down, when STALE_UPDATE_POLICY is 'skip'.
+
+    A message is stale when it was sent more than `max_age` seconds before the process
+    started, so after a restart the backlog Telegram kept is not answered minutes late and
+    does not hold up the first fresh command. Messages sent since startup are never dropped
+    however long they waited, and chat_member updates always go through to keep the admin
+    rosters right.
+    """
+
+    def __init__(self, policy=STALE_UPDATE_POLICY, max_age=STALE_UPDATE_AGE):
+        super().__init__()
+        self.policy = policy
+        self.cutoff = time.time() - max_age
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if self.policy == 'skip' and message.date.timestamp() < self.cutoff:
+            metrics.inc('deraid_stale_updates_total')
+            raise CancelHandler()
+
+
+dp.middleware.setup(StaleUpdateFilter())
+
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # Outbound calls per second, all chats together
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '20')) / 60  # Outbound calls per second in one chat
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '5'))  # Calls a quiet chat may make back to back
+TELEGRAM_MAX_IN_FLIGHT = int(os.getenv('TELEGRAM_MAX_IN_FLIGHT', '16'))  # Simultaneous outbound calls
+TELEGRAM_MAX_RETRIES = 5  # RetryAfter errors absorbed before a call fails
+
+# Outbound priorities, lowest value sent first
+PRIORITY_COMMAND = 0  # Replies to commands and raid announcements
+PRIORITY_PROGRESS = 1  # Live raid card updates
+PRIORITY_BACKGROUND = 2  # Cleanup of old messages
+
+
+class TokenBucket:
+    """`rate` tokens per second with bursts of up to `capacity`, optionally paused by a RetryAfter."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+
+    def wait_time(self, now):
+        """Return how long to wait before a token is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+
+class OutboundCall:
+    __slots__ = ('priority', 'seq', 'chat_id', 'method', 'args', 'kwargs', 'coalesce_key', 'future', 'attempts',
+                 'reopened')
+
+    def __init__(self, priority, seq, chat_id, method, args, kwargs, coalesce_key, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.future = future
+        self.attempts = 0
+        self.reopened = []  # Upload files opened again for a retry, closed once the call is over
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class TelegramDispatcher:
+    """Central queue every outbound Telegram call goes through.
+
+    Bot API methods are called through the dispatcher (`outbox.send_message(chat_id=...)`)
+    and accept two extra keyword arguments: `priority` and `coalesce_key`. Calls are released
+    under a global token bucket and one bucket per chat, highest priority first and one at a
+    time per chat so a chat's messages keep their order. A call with a `coalesce_key` replaces
+    the arguments of a queued call with the same key that has not been sent yet, so stale
+    card updates are dropped and both callers get the result of the newest one. RetryAfter
+    pauses the chat's bucket and re-queues the call instead of surfacing as an error.
+
+    Chats waiting on their bucket sit in a timer heap and chats that may send sit in a ready
+    heap ordered by their best queued call, so picking the next call is O(log n) however
+    many chats have something queued.
+    """
+
+    def __init__(self, bot, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 chat_burst=TELEGRAM_CHAT_BURST, max_in_flight=TELEGRAM_MAX_IN_FLIGHT):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_in_flight = max_in_flight
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._pending = {}  # chat_id -> heap of calls waiting to be sent
+        self._states = {}  # chat_id -> 'ready', 'sleeping' or 'busy' while the chat has work
+        self._ready = []  # heap of (priority, seq, chat_id) of the best call of each ready chat
+        self._sleeping = []  # heap of (ready_at, chat_id) of chats waiting for their bucket
+        self._coalescing = {}  # coalesce_key -> queued call
+        self._in_flight = 0
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self.coalesced = 0
+        self.retried = 0
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self.bot, name)
+
+        async def call(*args, priority=PRIORITY_COMMAND, coalesce_key=None, **kwargs):
+            return await self.submit(method, args, kwargs, priority, coalesce_key)
+
+        return call
+
+    def pending(self):
+        return sum(len(calls) for calls in self._pending.values())
+
+    def set_global_rate(self, rate):
+        """Change the calls per second allowed across all chats, e.g. when shards split the bot's limit."""
+        bucket = self._global_bucket
+        bucket.rate = bucket.capacity = rate
+        bucket.tokens = min(bucket.tokens, rate)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, method, args, kwargs, priority=PRIORITY_COMMAND, coalesce_key=None, chat_id=None):
+        """Queue `method(*args, **kwargs)` and return its result once it has been sent.
+
+        The call is rate-limited as part of its `chat_id` keyword argument's chat, or of
+        `chat_id` for calls that pass the chat some other way, such as raw requests.
+        """
+        self._ensure_running()
+        if coalesce_key is not None:
+            queued = self._coalescing.get(coalesce_key)
+            if queued is not None:
+                queued.args, queued.kwargs = args, kwargs
+                if priority < queued.priority:
+                    queued.priority = priority
+                    heapq.heapify(self._pending[queued.chat_id])
+                    self._push_ready(queued.chat_id)
+                self.coalesced += 1
+                return await asyncio.shield(queued.future)
+
+        chat_id = kwargs.get('chat_id', chat_id)
+        call = OutboundCall(priority, next(self._seq), chat_id, method, args, kwargs, coalesce_key,
+                            asyncio.get_running_loop().create_future())
+        if coalesce_key is not None:
+            self._coalescing[coalesce_key] = call
+        self._enqueue(call)
+        return await asyncio.shield(call.future)
+
+    def _enqueue(self, call):
+        heapq.heappush(self._pending.setdefault(call.chat_id, []), call)
+        state = self._states.get(call.chat_id)
+        if state is None:
+            self._schedule(call.chat_id)
+        elif state == 'ready':
+            self._push_ready(call.chat_id)  # The new call may now be the chat's best one
+        self._wakeup.set()
+
+    def _push_ready(self, chat_id):
+        if self._states.get(chat_id) == 'ready':
+            head = self._pending[chat_id][0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _schedule(self, chat_id):
+        """Put a chat that is not sending into the ready or timer heap, or forget it when idle."""
+        if not self._pending.get(chat_id):
+            self._pending.pop(chat_id, None)
+            self._states.pop(chat_id, None)
+            return
+        now = time.monotonic()
+        wait = 0 if chat_id is None else self._chat_bucket(chat_id).wait_time(now)
+        if wait > 0:
+            self._states[chat_id] = 'sleeping'
+            heapq.heappush(self._sleeping, (now + wait, chat_id))
+        else:
+            self._states[chat_id] = 'ready'
+            self._push_ready(chat_id)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _has_ready(self):
+        """Drop stale heap entries until the top of `_ready` is the chat whose best call goes next.
+
+        Returns False when no chat is ready. The chat is read from the heap rather than
+        returned, since calls outside a chat are queued under None.
+        """
+        while self._ready:
+            _, seq, chat_id = self._ready[0]
+            calls = self._pending.get(chat_id)
+            if self._states.get(chat_id) == 'ready' and calls and calls[0].seq == seq:
+                return True
+            heapq.heappop(self._ready)
+        return False
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._sleeping and self._sleeping[0][0] <= now:
+                _, chat_id = heapq.heappop(self._sleeping)
+                if self._states.get(chat_id) == 'sleeping':
+                    self._schedule(chat_id)
+
+            if self._in_flight >= self.max_in_flight or not self._has_ready():
+                self._wakeup.clear()
+                timeout = self._sleeping[0][0] - now if self._sleeping else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = self._global_bucket.wait_time(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            call = heapq.heappop(self._pending[chat_id])
+            if call.coalesce_key is not None and self._coalescing.get(call.coalesce_key) is call:
+                del self._coalescing[call.coalesce_key]
+
+            self._global_bucket.take()
+            self._in_flight += 1
+            if chat_id is None:
+                self._schedule(chat_id)  # Calls outside a chat (inline answers) may run side by side
+            else:
+                self._chat_bucket(chat_id).take()
+                self._states[chat_id] = 'busy'
+            asyncio.create_task(self._send(call))
+
+    @staticmethod
+    def _reopen_uploads(call):
+        """Open the files of an upload sent again: aiohttp closed them once the first attempt was sent."""
+        for name, value in call.kwargs.items():
+            if isinstance(value, io.BufferedReader) and value.closed:
+                call.kwargs[name] = open(value.name, 'rb')
+                call.reopened.append(call.kwargs[name])
+
+    async def _send(self, call):
+        # Latency and errors are recorded by InstrumentedBot, for the calls that bypass the outbox too
+        try:
+            result = await call.method(*call.args, **call.kwargs)
+        except RetryAfter as e:
+            call.attempts += 1
+            self.retried += 1
+            bucket = self._global_bucket if call.chat_id is None else self._chat_bucket(call.chat_id)
+            bucket.block(time.monotonic(), e.timeout)
+            if call.attempts > TELEGRAM_MAX_RETRIES:
+                call.future.set_exception(e)
+            elif call.chat_id is None:
+                self._reopen_uploads(call)
+                self._enqueue(call)
+            else:
+                self._reopen_uploads(call)
+                heapq.heappush(self._pending.setdefault(call.chat_id, []), call)  # Rescheduled below
+        except Exception as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            if call.chat_id is not None:
+                self._schedule(call.chat_id)
+            self._wakeup.set()
+            if call.future.done():
+                for upload in call.reopened:
+                    upload.close()
+                if not call.future.cancelled():
+                    call.future.exception()  # Callers that gave up must not trigger "never retrieved" warnings
+
+
+# Every outbound Telegram call goes through the dispatcher so rate limits are respected
+outbox = TelegramDispatcher(bot)
 
 BANNER_IMAGE_PATH = "1Green_1.mp4"
+MEDIA_CACHE_PATH = os.getenv('MEDIA_CACHE_PATH', 'media_cache.json')  # On-disk index of uploaded banner file_ids
+ADMIN_CACHE_TTL = float(os.getenv('ADMIN_CACHE_TTL', '300'))  # Seconds before a chat's admin list is fetched again
+# chat_member updates are only delivered when asked for explicitly; they keep the admin cache current
+ALLOWED_UPDATES = ['message', 'inline_query', 'chat_member', 'my_chat_member']
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling')  # 'polling' or 'webhook'
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public base URL Telegram posts updates to, e.g. https://app.herokuapp.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Echoed by Telegram in X-Telegram-Bot-Api-Secret-Token
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', '8080'))  # Heroku passes the port to bind in $PORT
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '32'))  # Updates processed concurrently
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))  # Updates accepted before asking Telegram to retry
+STARTUP_CONCURRENCY = int(os.getenv('STARTUP_CONCURRENCY', '8'))  # Chats checked against Telegram at once after a restart
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '1'))  # Worker processes chats are spread over, 1 runs everything in one process
+SHARD_ID = os.getenv('SHARD_ID')  # Set by the coordinator in the worker processes it starts
+SHARD_SOCKET = os.getenv('SHARD_SOCKET', '/tmp/deraid-shards.sock')  # Unix socket the coordinator and workers talk over
+SHARD_LOOKUP_WINDOW = 0.05  # Seconds the coordinator gathers the shards' tweet lookups into one batch
+MAX_SHARDS = 256  # Also the stride of queue ids, which end in the id of the shard that created them
+HASH_RING_REPLICAS = 100  # Points per shard on the hash ring, more spread the chats more evenly
+BROKER_LINE_LIMIT = 1 << 24  # Largest message exchanged with the coordinator, in bytes
+TRACKING_INTERVAL = 15  # Seconds between two engagement checks of a newly started raid
+MIN_POLL_INTERVAL = float(os.getenv('MIN_POLL_INTERVAL', '5'))  # Fastest a raid is polled, also the tracker tick
+MAX_POLL_INTERVAL = float(os.getenv('MAX_POLL_INTERVAL', '60'))  # Slowest an idle raid is polled
+POLL_QUOTA_RESERVE = int(os.getenv('POLL_QUOTA_RESERVE', '10'))  # Lookups left to /raid and /status each window
+NEAR_GOAL_PERCENTAGE = 80  # Raids whose every metric is past this are polled as fast as possible
+METRIC_NAMES = ('likes', 'retweets', 'replies', 'bookmarks')
+PUBLIC_METRIC_KEYS = ('like_count', 'retweet_count', 'reply_count', 'bookmark_count')  # Twitter's names for METRIC_NAMES
+COMPLETION_COLORS = ("🟥", "🟧", "🟨", "🟩")  # Below 50% of a goal, from 50%, from 75% and once reached
+PROGRESS_BAR_BLOCKS = 20
+SERIES_CAPACITY = int(os.getenv('SERIES_CAPACITY', '60'))  # Metric samples kept per raid
+RATE_WINDOW_SAMPLES = 6  # Samples the current pace of a raid is measured over
+CARD_UPDATE_MODE = os.getenv('CARD_UPDATE_MODE', 'edit')  # 'edit' the pinned card in place or 'resend' it every tick
+RAID_TIME_LIMIT = timedelta(hours=1)  # Raids that miss their goals by then are failed
+RAID_DB_PATH = os.getenv('RAID_DB_PATH', 'raids.db')  # SQLite file raids and queues are persisted to
+QUEUE_PAGE_SIZE = 10  # Queued raids listed per /queue page
+RAID_DB_FLUSH_INTERVAL = float(os.getenv('RAID_DB_FLUSH_INTERVAL', '0.5'))  # Seconds changes are batched for
+DELETION_BATCH_WINDOW = 1  # Messages due within this many seconds of each other are deleted together
+DELETE_MESSAGES_LIMIT = 100  # Message ids Telegram accepts in one deleteMessages call
+
+RAID_COLUMNS = (
+    'chat_id', 'message_id', 'pinned_message_id', 'card_has_caption', 'post_link',
+    'likes_goal', 'retweets_goal', 'replies_goal', 'bookmarks_goal',
+    'initial_likes', 'initial_retweets', 'initial_replies', 'initial_bookmarks', 'started_at',
+)
+QUEUED_RAID_COLUMNS = (
+    'queue_id', 'chat_id', 'message_id', 'post_link', 'likes_goal', 'retweets_goal', 'replies_goal', 'bookmarks_goal',
+    'requested_by', 'priority',
+)
+
+
+class RaidStore:
+    """Durable copy of the raids, queues and queue toggles in a WAL-mode SQLite database.
+
+    Only compact records are stored: ids, link, goals, baselines and start time. Changes are
+    buffered in memory, where a newer change to the same row replaces the older one, and
+    written in one transaction every RAID_DB_FLUSH_INTERVAL seconds. All SQLite work runs on a
+    single dedicated thread, which also owns the connection, so the event loop never waits
+    on the disk.
+    """
+
+    def __init__(self, path=RAID_DB_PATH, flush_interval=RAID_DB_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='raid-store')
+        self._connection = None
+        self._raids = {}  # chat_id -> row to write, or None to delete
+        self._queued = {}  # queue_id -> row to write, or None to delete
+        self._chats = {}  # chat_id -> (queue_enabled, leaderboard_listed)
+        self._deletions = {}  # (chat_id, message_id) -> due_at, or None to delete
+        self._flush_task = None
+        self._queue_serial = 0
+        self.shard = 0  # Queue ids are `serial * queue_id_stride + shard` so worker processes never collide
+        self.queue_id_stride = 1
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS raids (
+                    chat_id INTEGER PRIMARY KEY, message_id INTEGER, pinned_message_id INTEGER,
+                    card_has_caption INTEGER, post_link TEXT,
+                    likes_goal INTEGER, retweets_goal INTEGER, replies_goal INTEGER, bookmarks_goal INTEGER,
+                    initial_likes INTEGER, initial_retweets INTEGER, initial_replies INTEGER,
+                    initial_bookmarks INTEGER, started_at TEXT
+                );
+                CREATE TABLE IF NOT EXISTS queued_raids (
+                    queue_id INTEGER PRIMARY KEY, chat_id INTEGER, message_id INTEGER, post_link TEXT,
+                    likes_goal INTEGER, retweets_goal INTEGER, replies_goal INTEGER, bookmarks_goal INTEGER,
+                    requested_by INTEGER DEFAULT 0, priority INTEGER DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS chats (
+                    chat_id INTEGER PRIMARY KEY, queue_enabled INTEGER, leaderboard_listed INTEGER DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS deletions (
+                    chat_id INTEGER, message_id INTEGER, due_at REAL, PRIMARY KEY (chat_id, message_id)
+                );
+                """
+            )
+            # Databases created before queued raids recorded who requested them
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(queued_raids)")}
+            for column in ('requested_by', 'priority'):
+                if column not in columns:
+                    self._connection.execute(f"ALTER TABLE queued_raids ADD COLUMN {column} INTEGER DEFAULT 0")
+            # ... and before chats could opt in to leaderboards
+            if 'leaderboard_listed' not in {row[1] for row in self._connection.execute("PRAGMA table_info(chats)")}:
+                self._connection.execute("ALTER TABLE chats ADD COLUMN leaderboard_listed INTEGER DEFAULT 0")
+        return self._connection
+
+    def _read(self):
+        connection = self._connect()
+        raids = connection.execute(f"SELECT {', '.join(RAID_COLUMNS)} FROM raids").fetchall()
+        queued = connection.execute(
+            f"SELECT {', '.join(QUEUED_RAID_COLUMNS)} FROM queued_raids ORDER BY queue_id").fetchall()
+        chats = connection.execute("SELECT chat_id, queue_enabled, leaderboard_listed FROM chats").fetchall()
+        deletions = connection.execute("SELECT chat_id, message_id, due_at FROM deletions").fetchall()
+        return raids, queued, chats, deletions
+
+    def _write(self, raids, queued, chats, deletions):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO raids VALUES ({', '.join('?' * len(RAID_COLUMNS))})",
+                [row for row in raids.values() if row is not None])
+            connection.executemany("DELETE FROM raids WHERE chat_id = ?",
+                                   [(chat_id,) for chat_id, row in raids.items() if row is None])
+            connection.executemany(
+                f"INSERT OR REPLACE INTO queued_raids VALUES ({', '.join('?' * len(QUEUED_RAID_COLUMNS))})",
+                [row for row in queued.values() if row is not None])
+            connection.executemany("DELETE FROM queued_raids WHERE queue_id = ?",
+                                   [(queue_id,) for queue_id, row in queued.items() if row is None])
+            connection.executemany("INSERT OR REPLACE INTO chats VALUES (?, ?, ?)",
+                                   [(chat_id, *flags) for chat_id, flags in chats.items()])
+            connection.executemany("INSERT OR REPLACE INTO deletions VALUES (?, ?, ?)",
+                                   [key + (due_at,) for key, due_at in deletions.items() if due_at is not None])
+            connection.executemany("DELETE FROM deletions WHERE chat_id = ? AND message_id = ?",
+                                   [key for key, due_at in deletions.items() if due_at is None])
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def load(self):
+        """Return all stored `(raids, queued_raids, chats, deletions)` rows."""
+        raids, queued, chats, deletions = await self._run(self._read)
+        if queued:
+            self._queue_serial = max(self._queue_serial, queued[-1][0] // self.queue_id_stride)
+        return raids, queued, chats, deletions
+
+    def next_queue_id(self):
+        self._queue_serial += 1
+        return self._queue_serial * self.queue_id_stride + self.shard
+
+    def save_raid(self, chat_id, raid, started_at):
+        self._raids[chat_id] = (
+            chat_id, raid.message_id, raid.pinned_message_id, int(raid.card_has_caption), raid.post_link,
+            *raid.goals(), *raid.baselines(), started_at.isoformat(),
+        )
+        self._schedule_flush()
+
+    def delete_raid(self, chat_id):
+        self._raids[chat_id] = None
+        self._schedule_flush()
+
+    def save_queued(self, entry):
+        self._queued[entry['queue_id']] = tuple(entry[column] for column in QUEUED_RAID_COLUMNS)
+        self._schedule_flush()
+
+    def delete_queued(self, entry):
+        self._queued[entry['queue_id']] = None
+        self._schedule_flush()
+
+    def save_chat(self, chat_id, queue_enabled, leaderboard_listed):
+        self._chats[chat_id] = (int(queue_enabled), int(leaderboard_listed))
+        self._schedule_flush()
+
+    def save_deletion(self, chat_id, message_id, due_at):
+        self._deletions[(chat_id, message_id)] = due_at
+        self._schedule_flush()
+
+    def delete_deletions(self, chat_id, message_ids):
+        for message_id in message_ids:
+            self._deletions[(chat_id, message_id)] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = run_in_background(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Write every buffered change in one transaction."""
+        if not (self._raids or self._queued or self._chats or self._deletions):
+            return
+        raids, queued, chats, deletions = self._raids, self._queued, self._chats, self._deletions
+        self._raids, self._queued, self._chats, self._deletions = {}, {}, {}, {}
+        try:
+            await self._run(self._write, raids, queued, chats, deletions)
+        except sqlite3.Error as e:
+            print(f"Error saving raids: {str(e)}")
+
+    async def close(self):
+        await self.flush()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+class EngagementSeries:
+    """Fixed-size ring buffer of timestamped metric samples for one raid.
+
+    Timestamps are kept in an `array('d')` and the counts of all metrics interleaved in one
+    `array('q')`, so a raid costs about SERIES_CAPACITY * 40 bytes however long it runs.
+    Appending overwrites the oldest sample in O(1); rates and ETAs are computed for all
+    metrics at once from two slices of the counts array.
+    """
+
+    __slots__ = ('capacity', 'width', 'times', 'counts', 'size', 'next')
+
+    def __init__(self, capacity=SERIES_CAPACITY, width=len(METRIC_NAMES)):
+        self.capacity = capacity
+        self.width = width
+        self.times = array('d', bytes(8 * capacity))
+        self.counts = array('q', bytes(8 * capacity * width))
+        self.size = 0
+        self.next = 0  # Slot the next sample is written to
+
+    def append(self, timestamp, counts):
+        slot = self.next
+        self.times[slot] = timestamp
+        self.counts[slot * self.width:(slot + 1) * self.width] = array('q', counts)
+        self.next = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _sample(self, age):
+        """Return the slot of the sample `age` samples older than the newest one."""
+        return (self.next - 1 - age) % self.capacity
+
+    def latest(self):
+        slot = self._sample(0)
+        return self.counts[slot * self.width:(slot + 1) * self.width]
+
+    def rates(self, samples=RATE_WINDOW_SAMPLES):
+        """Per-second growth of every metric over the last `samples` samples."""
+        if self.size < 2:
+            return [0.0] * self.width
+        newest = self._sample(0)
+        oldest = self._sample(min(samples, self.size) - 1)
+        elapsed = self.times[newest] - self.times[oldest]
+        if elapsed <= 0:
+            return [0.0] * self.width
+        newest_counts = self.counts[newest * self.width:(newest + 1) * self.width]
+        oldest_counts = self.counts[oldest * self.width:(oldest + 1) * self.width]
+        return [(new - old) / elapsed for new, old in zip(newest_counts, oldest_counts)]
+
+    def etas(self, targets, samples=RATE_WINDOW_SAMPLES):
+        """Projected seconds until each metric reaches its target: 0 once reached, None if stalled."""
+        etas = []
+        for current, target, rate in zip(self.latest(), targets, self.rates(samples)):
+            if current >= target:
+                etas.append(0)
+            elif rate > 0:
+                etas.append((target - current) / rate)
+            else:
+                etas.append(None)
+        return etas
+
+
+class RaidTable:
+    """Column store of the goals, baselines and current counts of every ongoing raid.
+
+    Each raid owns a slot, and its metrics sit side by side in flat `array` columns in
+    METRIC_NAMES order, the way EngagementSeries stores samples. `evaluate()` derives the
+    percentages, color buckets, bar fill and completion flag of many raids in one pass, which
+    the cards, the tracker and the leaderboard then read instead of each recomputing them.
+    Slots of finished raids are reused.
+    """
+
+    WIDTH = len(METRIC_NAMES)
+
+    def __init__(self):
+        self.goals = array('q')
+        self.baselines = array('q')
+        self.counts = array('q')
+        self.percentages = array('d')  # Progress of each metric, 100 for metrics without a goal
+        self.colors = array('b')  # Index in COMPLETION_COLORS of each metric
+        self.overall = array('d')  # Mean progress of the metrics with a goal, per slot
+        self.filled = array('b')  # Progress bar blocks filled, per slot
+        self.complete = array('b')  # Whether every goal is reached, per slot
+        self._free = []
+
+    def __len__(self):
+        return len(self.overall) - len(self._free)
+
+    def allocate(self, goals, baselines):
+        """Store a new raid's goals and baselines, starting its counts at the baselines; return its slot."""
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self.overall)
+            for column in (self.goals, self.baselines, self.counts, self.percentages):
+                column.extend(array(column.typecode, bytes(8 * self.WIDTH)))
+            self.colors.extend(array('b', bytes(self.WIDTH)))
+            self.overall.append(0.0)
+            self.filled.append(0)
+            self.complete.append(0)
+        start = slot * self.WIDTH
+        self.goals[start:start + self.WIDTH] = array('q', goals)
+        self.baselines[start:start + self.WIDTH] = array('q', baselines)
+        self.counts[start:start + self.WIDTH] = array('q', baselines)
+        self.evaluate((slot,))
+        return slot
+
+    def release(self, slot):
+        self._free.append(slot)
+
+    def row(self, column, slot):
+        return column[slot * self.WIDTH:(slot + 1) * self.WIDTH].tolist()
+
+    def evaluate(self, slots):
+        """Recompute the progress of the raids in `slots` from their counts."""
+        width = self.WIDTH
+        goals, baselines, counts = self.goals, self.baselines, self.counts
+        percentages, colors = self.percentages, self.colors
+        for slot in slots:
+            total = 0.0
+            with_goal = 0
+            complete = 1
+            for i in range(slot * width, slot * width + width):
+                goal = goals[i]
+                if goal > 0:
+                    percentage = (counts[i] - baselines[i]) * 100 / goal
+                    total += percentage
+                    with_goal += 1
+                else:
+                    percentage = 100.0
+                percentages[i] = percentage
+                if percentage >= 100:
+                    colors[i] = 3
+                else:
+                    complete = 0
+                    colors[i] = 2 if percentage >= 75 else 1 if percentage >= 50 else 0
+            overall = total / with_goal if with_goal else 100.0
+            self.overall[slot] = overall
+            self.filled[slot] = min(max(int(PROGRESS_BAR_BLOCKS * overall / 100), 0), PROGRESS_BAR_BLOCKS)
+            self.complete[slot] = complete
+
+
+raid_table = RaidTable()
+
+
+class Raid:
+    """The ongoing raid of one chat.
+
+    Goals, baselines, counts and progress live in the raid's slot of `raid_table`; the record
+    itself only keeps the link, ids and polling state. `slot` is None once the raid ended.
+    """
+
+    __slots__ = ('slot', 'post_link', 'post_id', 'chat_id', 'message_id', 'pinned_message_id', 'card_has_caption',
+                 'card_fingerprint', 'series', 'poll_interval', 'effective_poll_interval', 'last_polled_at',
+                 'next_poll_at', 'metrics_delayed_since')
+
+    def __init__(self, post_link, goals, chat_id, message_id, baselines):
+        self.slot = raid_table.allocate(goals, baselines)
+        self.post_link = post_link
+        self.post_id = extract_post_id(post_link)
+        self.chat_id = chat_id
+        self.message_id = message_id  # The /raid command that requested it
+        self.pinned_message_id = None
+        self.card_has_caption = False  # Whether the pinned card is a media message edited through its caption
+        self.card_fingerprint = None  # card_fingerprint() of what the pinned card currently shows
+        self.series = EngagementSeries()  # Metric samples taken by the tracker
+        self.series.append(time.monotonic(), baselines)
+        self.poll_interval = TRACKING_INTERVAL  # Target seconds between polls, adapted by the PollScheduler
+        self.effective_poll_interval = None  # Seconds actually observed between the last two polls
+        self.last_polled_at = None
+        self.next_poll_at = 0
+        self.metrics_delayed_since = None  # When Twitter became unreachable; the raid's clock is paused since then
+
+    def goals(self):
+        return raid_table.row(raid_table.goals, self.slot)
+
+    def baselines(self):
+        return raid_table.row(raid_table.baselines, self.slot)
+
+    def counts(self):
+        return raid_table.row(raid_table.counts, self.slot)
+
+    def average_rates(self, elapsed):
+        """Per-second growth of every metric from the baselines, over the `elapsed` seconds of the raid."""
+        if elapsed <= 0:
+            return [0.0] * RaidTable.WIDTH
+        return [(count - baseline) / elapsed for count, baseline in zip(self.counts(), self.baselines())]
+
+    def targets(self):
+        """Counts at which each goal is reached."""
+        return [baseline + goal for baseline, goal in zip(self.baselines(), self.goals())]
+
+    def set_counts(self, counts):
+        """Store freshly fetched counts; call `raid_table.evaluate()` afterwards to update the progress."""
+        start = self.slot * RaidTable.WIDTH
+        raid_table.counts[start:start + RaidTable.WIDTH] = array('q', counts)
+
+    def percentages(self):
+        return raid_table.row(raid_table.percentages, self.slot)
+
+    def colors(self):
+        return [COMPLETION_COLORS[bucket] for bucket in raid_table.row(raid_table.colors, self.slot)]
+
+    @property
+    def overall(self):
+        return raid_table.overall[self.slot]
+
+    @property
+    def filled(self):
+        return raid_table.filled[self.slot]
+
+    @property
+    def complete(self):
+        return bool(raid_table.complete[self.slot])
+
+    def release(self):
+        if self.slot is not None:
+            raid_table.release(self.slot)
+            self.slot = None
+
+
+class RaidQueue:
+    """Queued raids of one chat, served fairly between the admins who requested them.
+
+    Entries sit in a heap ordered by `(-priority, round, queue_id)`. A requester's n-th waiting
+    raid is in round n, so raids are served round-robin between requesters and one admin
+    queueing dozens of raids can't hold everybody else back. An index by queue id makes
+    cancelling and reprioritizing O(log n): the replaced heap item is only marked dead,
+    skipped when it reaches the top and dropped once dead items outnumber live ones. Pages
+    of the listing walk the heap from its root, so showing the first k entries costs
+    O(k log k) however long the queue is.
+    """
+
+    def __init__(self):
+        self._heap = []  # [-priority, round, queue_id, entry], live only while in `_items`
+        self._items = {}  # queue_id -> live heap item
+        self._by_message = {}  # message_id -> queue ids of the raids the message requested
+        self._next_round = {}  # requester -> round of their next raid, while they have raids waiting
+        self._waiting = {}  # requester -> number of their raids in the queue
+        self._round = 0  # Round of the raid served last
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        """Entries in the order they will be served."""
+        return (item[3] for item in sorted(self._items.values()))
+
+    def _push(self, entry, round_number):
+        item = [-entry['priority'], round_number, entry['queue_id'], entry]
+        self._items[entry['queue_id']] = item
+        self._by_message.setdefault(entry['message_id'], set()).add(entry['queue_id'])
+        heapq.heappush(self._heap, item)
+
+    def _forget(self, item):
+        entry = self._items.pop(item[2])[3]
+        requester = entry['requested_by']
+        self._waiting[requester] -= 1
+        if not self._waiting[requester]:
+            # Nothing of theirs is left waiting: their next raid joins the current round again
+            del self._waiting[requester]
+            self._next_round.pop(requester, None)
+        queue_ids = self._by_message[entry['message_id']]
+        queue_ids.discard(item[2])
+        if not queue_ids:
+            del self._by_message[entry['message_id']]
+
+    def _smallest(self, count):
+        """The first `count` live items in serving order, found by a best-first walk of the heap."""
+        heap = self._heap
+        result = []
+        frontier = [(heap[0][:3], 0)] if heap else []
+        while frontier and len(result) < count:
+            _, index = heapq.heappop(frontier)
+            item = heap[index]
+            if self._items.get(item[2]) is item:
+                result.append(item)
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child][:3], child))
+        return result
+
+    def _compact(self):
+        heap = self._heap
+        while heap and self._items.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        if len(heap) > 2 * len(self._items) + 64:
+            self._heap = list(self._items.values())
+            heapq.heapify(self._heap)
+
+    def push(self, entry):
+        requester = entry['requested_by']
+        round_number = max(self._next_round.get(requester, 0), self._round)
+        self._next_round[requester] = round_number + 1
+        self._waiting[requester] = self._waiting.get(requester, 0) + 1
+        self._push(entry, round_number)
+
+    def pop(self):
+        """Remove and return the entry to serve next."""
+        while True:
+            item = heapq.heappop(self._heap)
+            if self._items.get(item[2]) is item:
+                break
+        self._forget(item)
+        if not item[0]:
+            # A bumped raid is served out of turn, it doesn't move the round forward
+            self._round = item[1]
+        return item[3]
+
+    def remove(self, queue_id):
+        """Remove an entry wherever it is in the queue; return it, or None if it isn't queued."""
+        item = self._items.get(queue_id)
+        if item is None:
+            return None
+        self._forget(item)
+        self._compact()
+        return item[3]
+
+    def reprioritize(self, queue_id, priority):
+        """Move an entry ahead of (or behind) the ones with a lower priority, keeping its round."""
+        item = self._items[queue_id]
+        if item[3]['priority'] == priority:
+            return
+        item[3]['priority'] = priority
+        self._push(item[3], item[1])  # Replaces the item in `_items`, leaving the old one dead
+        self._compact()
+
+    def by_message(self, message_id):
+        """Entries requested by the command with this message id."""
+        return [self._items[queue_id][3] for queue_id in self._by_message.get(message_id, ())]
+
+    def page(self, number, size=QUEUE_PAGE_SIZE):
+        """Entries at positions `(number - 1) * size + 1` to `number * size`, in serving order."""
+        return [item[3] for item in self._smallest(number * size)[(number - 1) * size:]]
+
+    def at(self, position):
+        """Entry at `position`, counted from 1 in serving order, or None."""
+        if not 1 <= position <= len(self._items):
+            return None
+        return self._smallest(position)[-1][3]
+
+
+class SubscriptionRegistry:
+    """Raids of every chat grouped by the tweet they target.
+
+    Raids of several chats on the same tweet are federated: each keeps its own goals,
+    baselines and card, but the tracker looks the tweet up once per tick and fans the
+    metrics out to all of them, so Twitter usage stays flat however many groups join in.
+    """
+
+    def __init__(self):
+        self._raids = {}  # post_id -> {chat_id: raid}
+        self.titles = {}  # chat_id -> name shown on leaderboards
+
+    def subscribe(self, raid):
+        self._raids.setdefault(raid.post_id, {})[raid.chat_id] = raid
+
+    def unsubscribe(self, raid):
+        raids = self._raids.get(raid.post_id)
+        if raids and raids.get(raid.chat_id) is raid:
+            del raids[raid.chat_id]
+            if not raids:
+                del self._raids[raid.post_id]
+
+    def raids(self, post_id):
+        """Ongoing raids of every chat on the tweet."""
+        return list(self._raids.get(post_id, {}).values())
+
+    def tweet_count(self):
+        return len(self._raids)
+
+    async def title(self, chat_id):
+        """Name of a chat for leaderboards, fetched once from Telegram."""
+        title = self.titles.get(chat_id)
+        if title is None:
+            try:
+                chat = await bot.get_chat(chat_id)
+            except Exception as e:
+                print(f"Error fetching chat {chat_id}: {str(e)}")
+                return f"Group {chat_id}"
+            title = self.titles[chat_id] = chat.title or chat.full_name
+        return title
+
+
+class ChatRaidState:
+    """Ongoing raid, queue and queue toggle of a single chat."""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.ongoing_raid = None
+        self.raid_start_time = None  # To track the start time of the raid
+        self.raid_queue = RaidQueue()
+        self.queue_enabled = False  # Flag to enable/disable queue system
+        self.leaderboard_listed = False  # Whether other groups raiding the same tweet see this group's name
+
+
+class RaidManager:
+    """Independent raid state for every chat the bot is in.
+
+    States are looked up by chat id in a dict, and chats with a raid in progress are indexed
+    separately so the shared tracker only walks the raids it actually has to poll. Ongoing
+    raids are also indexed by tweet in `subscriptions`.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._chats = {}
+        self._active = {}
+        self.subscriptions = SubscriptionRegistry()
+
+    def get(self, chat_id):
+        """Return the state of `chat_id`, creating it on first use."""
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = ChatRaidState(chat_id)
+        return state
+
+    def activate(self, state, raid, started_at=None, persist=True):
+        state.ongoing_raid = raid
+        state.raid_start_time = started_at or datetime.utcnow()
+        self._active[state.chat_id] = state
+        self.subscriptions.subscribe(raid)
+        if persist:
+            self.save(state)
+
+    def save(self, state):
+        """Persist the chat's ongoing raid after it changed."""
+        if state.ongoing_raid is not None:
+            self.store.save_raid(state.chat_id, state.ongoing_raid, state.raid_start_time)
+
+    def deactivate(self, state):
+        if state.ongoing_raid is not None:
+            self.subscriptions.unsubscribe(state.ongoing_raid)
+            state.ongoing_raid.release()
+        state.ongoing_raid = None
+        state.raid_start_time = None
+        self._active.pop(state.chat_id, None)
+        self.store.delete_raid(state.chat_id)
+
+    def enqueue(self, state, entry, persist=True):
+        state.raid_queue.push(entry)
+        if persist:
+            self.store.save_queued(entry)
+
+    def enqueue_many(self, state, entries):
+        """Queue several raids at once; their rows are buffered together and land in one transaction."""
+        for entry in entries:
+            state.raid_queue.push(entry)
+            self.store.save_queued(entry)
+
+    def dequeue(self, state):
+        entry = state.raid_queue.pop()
+        self.store.delete_queued(entry)
+        return entry
+
+    def remove_queued(self, state, entry):
+        """Remove a queued raid; return it, or None if it was no longer queued."""
+        removed = state.raid_queue.remove(entry['queue_id'])
+        self.store.delete_queued(entry)
+        return removed
+
+    def reprioritize(self, state, entry, priority):
+        state.raid_queue.reprioritize(entry['queue_id'], priority)
+        self.store.save_queued(entry)
+
+    def clear_queue(self, state):
+        for entry in state.raid_queue:
+            self.store.delete_queued(entry)
+        state.raid_queue = RaidQueue()
+
+    def set_queue_enabled(self, state, enabled):
+        state.queue_enabled = enabled
+        self.store.save_chat(state.chat_id, state.queue_enabled, state.leaderboard_listed)
+
+    def set_leaderboard_listed(self, state, listed):
+        state.leaderboard_listed = listed
+        self.store.save_chat(state.chat_id, state.queue_enabled, state.leaderboard_listed)
+
+    def active_chats(self):
+        """Return the states of all chats with an ongoing raid."""
+        return list(self._active.values())
+
+    def states(self):
+        return list(self._chats.values())
+
+    def forget(self, state):
+        """Drop a chat from memory only, leaving its stored rows for the process that takes it over."""
+        self._chats.pop(state.chat_id, None)
+        self._active.pop(state.chat_id, None)
+        if state.ongoing_raid is not None:
+            self.subscriptions.unsubscribe(state.ongoing_raid)
+            state.ongoing_raid.release()
+        state.ongoing_raid = None  # Makes an in-flight tracker tick skip the chat
+        state.raid_queue = RaidQueue()
+
+    def active_count(self):
+        return len(self._active)
+
+    def queued_count(self):
+        return sum(len(state.raid_queue) for state in self._chats.values())
+
+
+class DeletionScheduler:
+    """Deletes messages once their delay has passed, without parking a coroutine per message.
+
+    Due times live in one heap watched by a single task. Messages coming due within
+    DELETION_BATCH_WINDOW of each other are grouped by chat and removed with one
+    deleteMessages call per chat. The schedule is mirrored to the store, so deletions
+    survive a restart and the ones that came due while the bot was down run right away.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._heap = []  # (due_at, chat_id, message_id), due_at in wall-clock time so it can be persisted
+        self._task = None
+        self._wakeup = None
+
+    def pending(self):
+        return len(self._heap)
+
+    def chat_ids(self):
+        return {chat_id for _, chat_id, _ in self._heap}
+
+    def forget(self, chat_ids):
+        """Drop the deletions of `chat_ids` from memory, leaving them stored for another process."""
+        self._heap = [entry for entry in self._heap if entry[1] not in chat_ids]
+        heapq.heapify(self._heap)
+
+    def discard(self, chat_id):
+        """Drop the deletions of `chat_id` for good, such as when the bot is no longer in the chat."""
+        message_ids = [message_id for _, entry_chat_id, message_id in self._heap if entry_chat_id == chat_id]
+        self.forget({chat_id})
+        self.store.delete_deletions(chat_id, message_ids)
+
+    def schedule(self, chat_id, message_id, delay):
+        """Delete `message_id` from `chat_id` in `delay` seconds."""
+        self.schedule_at(chat_id, message_id, time.time() + delay)
+
+    def schedule_at(self, chat_id, message_id, due_at, persist=True):
+        if persist:
+            self.store.save_deletion(chat_id, message_id, due_at)
+        heapq.heappush(self._heap, (due_at, chat_id, message_id))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        if self._heap[0][0] == due_at:
+            self._wakeup.set()  # The new deletion is the earliest, the task must sleep less
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = {}
+            horizon = time.time() + DELETION_BATCH_WINDOW
+            while self._heap and self._heap[0][0] <= horizon:
+                _, chat_id, message_id = heapq.heappop(self._heap)
+                due.setdefault(chat_id, []).append(message_id)
+            for chat_id, message_ids in due.items():
+                for i in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+                    run_in_background(self._delete(chat_id, message_ids[i:i + DELETE_MESSAGES_LIMIT]))
+
+    async def _delete(self, chat_id, message_ids):
+        try:
+            # deleteMessages postdates aiogram 2, so it is called through the raw request method,
+            # submitted with its chat so it waits on the chat's bucket like every other call there
+            await outbox.submit(outbox.bot.request,
+                                ('deleteMessages', {'chat_id': chat_id, 'message_ids': json.dumps(message_ids)}), {},
+                                PRIORITY_BACKGROUND, chat_id=chat_id)
+        except Exception as e:
+            print(f"Error deleting messages in chat {chat_id}: {str(e)}")
+        finally:
+            self.store.delete_deletions(chat_id, message_ids)
+
+
+raid_store = RaidStore()
+raid_manager = RaidManager(raid_store)
+deletion_scheduler = DeletionScheduler(raid_store)
+
+
+class MediaCache:
+    """Uploads each banner to Telegram once and reuses the returned `file_id` afterwards.
+
+    Local files are keyed by the SHA-256 of their content, so an edited banner is uploaded
+    again while identical files are never uploaded twice; URLs are keyed by the URL itself.
+    Chats can override the banner with media that already lives on Telegram. Both maps are
+    kept in a small JSON index so they survive restarts.
+    """
+
+    def __init__(self, index_path=MEDIA_CACHE_PATH):
+        self.index_path = index_path
+        self._index = None  # {"files": {key: file_id}, "chats": {chat_id: [kind, file_id]}}, loaded lazily
+        self._hashes = {}  # path -> (mtime, size, key) so unchanged files are not hashed again
+        self._upload_locks = {}  # key -> lock, so concurrent sends of a new banner upload it once
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('files', {})
+        index.setdefault('chats', {})
+        return index
+
+    def _save_index(self, section, key, value):
+        """Write one change to the on-disk index, re-reading it first to keep other processes' changes."""
+        index = self._load_index()
+        if value is None:
+            index[section].pop(key, None)
+        else:
+            index[section][key] = value
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(temp_path, self.index_path)
+
+    def reload(self):
+        """Forget the in-memory index so it is read again, e.g. after taking over chats from another process."""
+        self._index = None
+
+    def _file_key(self, path):
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as banner:
+            for chunk in iter(lambda: banner.read(1 << 16), b''):
+                digest.update(chunk)
+        key = 'sha256:' + digest.hexdigest()
+        self._hashes[path] = (stat.st_mtime, stat.st_size, key)
+        return key
+
+    async def _run(self, func, *args):
+        """Run file I/O in the default executor so it never blocks the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _get_index(self):
+        if self._index is None:
+            index = await self._run(self._load_index)
+            if self._index is None:  # Another send may have loaded it while we were reading
+                self._index = index
+        return self._index
+
+    async def set_chat_banner(self, chat_id, kind, file_id):
+        """Use already uploaded media as the chat's banner, or the default one if `file_id` is None."""
+        index = await self._get_index()
+        if file_id is None:
+            index['chats'].pop(str(chat_id), None)
+        else:
+            index['chats'][str(chat_id)] = [kind, file_id]
+        await self._run(self._save_index, 'chats', str(chat_id), index['chats'].get(str(chat_id)))
+
+    async def send_banner(self, chat_id, caption, banner=BANNER_IMAGE_PATH, parse_mode=None,
+                          priority=PRIORITY_COMMAND):
+        """Send the chat's banner with `caption`, uploading it only if Telegram does not have it yet."""
+        index = await self._get_index()
+        override = index['chats'].get(str(chat_id))
+        if override:
+            try:
+                return await send_media(chat_id, override[0], override[1], caption, parse_mode, priority)
+            except (WrongFileIdentifier, WrongRemoteFileIdSpecified):
+                await self.set_chat_banner(chat_id, None, None)  # Media is gone, fall back to the default
+
+        kind = 'video' if banner.lower().endswith('.mp4') else 'photo'
+        is_url = banner.startswith("http://") or banner.startswith("https://")
+        if not is_url and not os.path.exists(banner):
+            return await outbox.send_message(chat_id=chat_id, text=caption, parse_mode=parse_mode, priority=priority)
+        key = banner if is_url else await self._run(self._file_key, banner)
+
+        file_id = index['files'].get(key)
+        if file_id:
+            try:
+                return await send_media(chat_id, kind, file_id, caption, parse_mode, priority)
+            except (WrongFileIdentifier, WrongRemoteFileIdSpecified):
+                index['files'].pop(key, None)
+
+        lock = self._upload_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            file_id = index['files'].get(key)
+            if file_id:  # Uploaded by a concurrent send while we were waiting
+                return await send_media(chat_id, kind, file_id, caption, parse_mode, priority)
+            if is_url:
+                sent = await send_media(chat_id, kind, banner, caption, parse_mode, priority)
+            else:
+                with open(banner, 'rb') as banner_file:
+                    sent = await send_media(chat_id, kind, banner_file, caption, parse_mode, priority)
+            file_id = media_file_id(sent)
+            if file_id:
+                index['files'][key] = file_id
+                await self._run(self._save_index, 'files', key, file_id)
+        return sent
+
+
+media_cache = MediaCache()
+
+
+class AdminRoster:
+    """Per-chat cache of administrator ids used by the admin-only commands.
+
+    A chat's roster is filled with one get_chat_administrators call, concurrent commands in
+    a chat that is not cached yet share that call, and the roster expires after `ttl`
+    seconds. chat_member updates patch it in place so promotions and demotions apply at once.
+    """
+
+    def __init__(self, ttl=ADMIN_CACHE_TTL):
+        self.ttl = ttl
+        self._rosters = {}  # chat_id -> (fetched_at, set of admin user ids)
+        self._loading = {}  # chat_id -> task fetching the roster
+
+    async def _fetch(self, chat_id):
+        administrators = await bot.get_chat_administrators(chat_id)
+        admins = {member.user.id for member in administrators}
+        self._rosters[chat_id] = (time.monotonic(), admins)
+        return admins
+
+    async def get(self, chat_id):
+        """Return the set of admin user ids of `chat_id`."""
+        entry = self._rosters.get(chat_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        task = self._loading.get(chat_id)
+        if task is None:
+            task = self._loading[chat_id] = asyncio.ensure_future(self._fetch(chat_id))
+            task.add_done_callback(lambda _: self._loading.pop(chat_id, None))
+        return await asyncio.shield(task)
+
+    async def is_admin(self, chat_id, user_id):
+        return user_id in await self.get(chat_id)
+
+    def apply_update(self, update: types.ChatMemberUpdated):
+        """Add or remove the member from the cached roster after a promotion or demotion."""
+        entry = self._rosters.get(update.chat.id)
+        if entry is None:
+            return
+        member = update.new_chat_member
+        if member.is_chat_admin():
+            entry[1].add(member.user.id)
+        else:
+            entry[1].discard(member.user.id)
+
+    def invalidate(self, chat_id):
+        self._rosters.pop(chat_id, None)
+
+
+admin_roster = AdminRoster()
+
+
+class PollScheduler:
+    """Decides which raids the tracker polls on each tick, within Twitter's rate limit.
+
+    Every raid has its own target interval between MIN_POLL_INTERVAL and MAX_POLL_INTERVAL:
+    raids whose metrics moved since the last poll or that are close to their goals are polled
+    more often, idle raids back off. Lookups are paid for from a token bucket refilled at the
+    rate the remaining quota allows until the window resets (minus POLL_QUOTA_RESERVE), so
+    polls are spread over the window and the quota is never exhausted. When there are not
+    enough tokens the most overdue raids go first and the others' effective interval grows.
+    Lookups are paid per tweet: when a raid is due, every other chat's raid on the same
+    tweet is polled along with it for free.
+    """
+
+    def __init__(self, client, endpoint="/2/tweets"):
+        self.client = client
+        self.endpoint = endpoint
+        self._tokens = 1.0  # One lookup is always allowed to learn the quota
+        self._refilled_at = None
+        self.share = 1.0  # Fraction of the quota this process may spend, shard workers split it
+
+    def _refill(self, now):
+        elapsed = 0 if self._refilled_at is None else now - self._refilled_at
+        self._refilled_at = now
+        quota = self.client.rate_limits.get(self.endpoint)
+        if quota is None:
+            self._tokens = max(self._tokens, 1.0)
+            return
+        remaining, reset_at = quota
+        window = reset_at - time.time()
+        if window <= 0:
+            # The window has reset since the last response: one lookup fetches the new quota
+            self._tokens = max(self._tokens, 1.0)
+            return
+        usable = (remaining - POLL_QUOTA_RESERVE) * self.share
+        if usable <= 0:
+            self._tokens = 0.0
+            return
+        self._tokens = min(self._tokens + usable / window * elapsed, usable)
+
+    def select(self, raids, now):
+        """Return the raids to poll now, spending at most the lookups the quota allows."""
+        self._refill(now)
+        # Most overdue relative to their own interval first, so fast-moving raids keep their pace
+        due = sorted((raid for raid in raids if raid.next_poll_at <= now),
+                     key=lambda raid: (now - raid.next_poll_at) / raid.poll_interval, reverse=True)
+        capacity = int(self._tokens) * TWEET_LOOKUP_BATCH_SIZE
+        post_ids = set()
+        for raid in due:
+            if len(post_ids) >= capacity:
+                break
+            post_ids.add(raid.post_id)
+        self._tokens -= -(-len(post_ids) // TWEET_LOOKUP_BATCH_SIZE)
+        return [raid for raid in raids if raid.post_id in post_ids]
+
+    def record(self, raid, previous, now):
+        """Adapt the raid's interval after a poll; `previous` holds its counts before the poll."""
+        percentages = [percentage for percentage, goal in zip(raid.percentages(), raid.goals()) if goal > 0]
+        if percentages and min(percentages) >= NEAR_GOAL_PERCENTAGE:
+            interval = MIN_POLL_INTERVAL
+        elif raid.counts() != previous:
+            interval = raid.poll_interval / 2
+        else:
+            interval = raid.poll_interval * 1.5
+        raid.poll_interval = min(max(interval, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+        if raid.last_polled_at is not None:
+            raid.effective_poll_interval = now - raid.last_polled_at
+        raid.last_polled_at = now
+        raid.next_poll_at = now + raid.poll_interval
 
+    @staticmethod
+    def interval(raid):
+        """Seconds between the raid's polls: as observed once it was polled twice, its target before."""
+        return raid.effective_poll_interval or raid.poll_interval
+
+    def report(self):
+        """Return `{chat_id: effective poll interval}` for every active raid."""
+        return {state.chat_id: self.interval(state.ongoing_raid) for state in raid_manager.active_chats()}
+
+    def summary(self):
+        """Return the shortest, median and longest effective poll interval of the active raids."""
+        intervals = sorted(self.report().values())
+        if not intervals:
+            return {}
+        return {'min': intervals[0], 'median': intervals[len(intervals) // 2], 'max': intervals[-1]}
 
-def get_color_for_completion(percentage):
-    if percentage >= 100:
-        return "🟩"  # Green for 100% completion
-    elif percentage >= 75:
-        return "🟨"  # Yellow for 75% to 99%
-    elif percentage >= 50:
-        return "🟧"  # Orange for 50% to 74%
-    elif percentage > 0:
-        return "🟥"  # Red for 1% to 49%
-    else:
-        return "🟥"  # Red for 0%
+
+poll_scheduler = PollScheduler(twitter_client)
+background_tasks = set()  # Strong references to fire-and-forget tasks
+card_update_stats = {"sent": 0, "skipped": 0}  # Tracker card refreshes sent vs. skipped as unchanged
 
 
 def create_text_progress_bar(percentage):
@@ -63,15 +1984,216 @@ def format_duration(seconds):
         return f"{seconds} seconds"
 
 
-async def send_message_with_deletion(chat_id: int, text: str, delay: int, parse_mode=None):
-    """Helper function to send a message and delete it after a delay."""
-    message = await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+def run_in_background(coro):
+    """Schedule `coro` without awaiting it, keeping a reference until it finishes."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def new_raid(post_link, likes_goal, retweets_goal, replies_goal, bookmarks_goal, chat_id, message_id, baseline=None):
+    """Build the raid tracked for a chat, starting from the tweet's `baseline` public metrics."""
+    baseline = baseline or {}
+    return Raid(post_link, [likes_goal, retweets_goal, replies_goal, bookmarks_goal], chat_id, message_id,
+                [baseline.get(key, 0) for key in PUBLIC_METRIC_KEYS])
+
+
+RAID_USAGE = "<post link> <likes> <retweets> <replies> <bookmarks>"
+
+
+def parse_raid_args(args):
+    """Return `(post_link, goals)` from the words describing a raid.
+
+    Raises ValueError with a message meant for the user when they are not valid.
+    """
+    if len(args) != 5:
+        raise ValueError(f"expected {RAID_USAGE}")
+    post_link = args[0]
+    if not extract_post_id(post_link).isdigit():
+        raise ValueError(f"{post_link} is not a link to a tweet")
+    try:
+        goals = [int(arg) for arg in args[1:]]
+    except ValueError:
+        raise ValueError("goals must be whole numbers") from None
+    if any(goal < 0 for goal in goals):
+        raise ValueError("goals cannot be negative")
+    return post_link, goals
+
+
+def queued_raid(chat_id, message_id, post_link, goals, requested_by):
+    """Build the queue entry of a raid waiting for the chat's ongoing one to end."""
+    likes_goal, retweets_goal, replies_goal, bookmarks_goal = goals
+    return {
+        "queue_id": raid_store.next_queue_id(),
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "post_link": post_link,
+        "likes_goal": likes_goal,
+        "retweets_goal": retweets_goal,
+        "replies_goal": replies_goal,
+        "bookmarks_goal": bookmarks_goal,
+        "requested_by": requested_by,  # Admin whose turn the raid takes in the round-robin
+        "priority": 0,  # Raised by /bump to serve the raid before the others
+    }
+
+
+async def start_raid(state, raid):
+    """Make `raid` the chat's ongoing raid and pin its live card."""
+    raid_manager.activate(state, raid)
+    # Ensure initial progress is 0%
+    pinned_message = await send_full_raid_update(state.chat_id, raid)
+    await pin_raid_card(state, raid, pinned_message, priority=PRIORITY_COMMAND)
+    raid.card_fingerprint = card_fingerprint(raid)
+
+
+def card_fingerprint(raid):
+    """Cheap summary of everything a raid card shows: equal fingerprints render identical cards.
+
+    Goals, baselines and the link never change during a raid, so the card only changes when
+    one of the displayed counts does, or when the card switches to or from showing the
+    metrics as delayed; the colors and the bar are derived from the counts.
+    """
+    return tuple(raid.counts()) + (raid.metrics_delayed_since is not None,)
+
+
+async def pin_raid_card(state, raid, card: types.Message, priority=PRIORITY_PROGRESS):
+    """Pin a freshly sent raid card and remember it for later edits and deletion."""
+    await outbox.pin_chat_message(chat_id=state.chat_id, message_id=card.message_id, disable_notification=True,
+                                  priority=priority)
+    raid.pinned_message_id = card.message_id
+    raid.card_has_caption = card.content_type != types.ContentType.TEXT
+    if state.ongoing_raid is raid:
+        raid_manager.save(state)
+
+
+async def refresh_raid_card(state, raid):
+    """Bring the chat's pinned raid card up to date with the raid's latest metrics.
+
+    In "edit" mode the pinned card is edited in place: one API call, no upload and no pin
+    notification. It is only re-sent and re-pinned when it can no longer be edited.
+    """
+    chat_id = state.chat_id
+    fingerprint = card_fingerprint(raid)
+    if raid.pinned_message_id and raid.card_fingerprint == fingerprint:
+        card_update_stats['skipped'] += 1  # Nothing visible changed since the last update
+        return
+    card_update_stats['sent'] += 1
+
+    if CARD_UPDATE_MODE == 'edit' and raid.pinned_message_id:
+        card_text = render_raid_card(raid)
+        # A newer update of the same card replaces this one if it is still queued
+        coalesce_key = ('card', chat_id, raid.pinned_message_id)
+        try:
+            if raid.card_has_caption:
+                await outbox.edit_message_caption(chat_id=chat_id, message_id=raid.pinned_message_id,
+                                                  caption=card_text, parse_mode="Markdown",
+                                                  priority=PRIORITY_PROGRESS, coalesce_key=coalesce_key)
+            else:
+                await outbox.edit_message_text(text=card_text, chat_id=chat_id, message_id=raid.pinned_message_id,
+                                               parse_mode="Markdown", priority=PRIORITY_PROGRESS,
+                                               coalesce_key=coalesce_key)
+            raid.card_fingerprint = fingerprint
+            return
+        except MessageNotModified:
+            raid.card_fingerprint = fingerprint
+            return
+        except (MessageToEditNotFound, MessageCantBeEdited, MessageIdInvalid):
+            raid.pinned_message_id = None  # The card is gone, send a new one below
+
+    # Delete the previously pinned message before sending the next update
+    if raid.pinned_message_id:
+        try:
+            await outbox.delete_message(chat_id=chat_id, message_id=raid.pinned_message_id,
+                                        priority=PRIORITY_PROGRESS)
+        except Exception as e:
+            print(f"Error deleting pinned message: {str(e)}")
+
+    # Send the updated raid status and pin it
+    pinned_message = await send_full_raid_update(state.chat_id, raid, priority=PRIORITY_PROGRESS)
+    await pin_raid_card(state, raid, pinned_message)
+    raid.card_fingerprint = fingerprint
+
+
+async def start_next_queued_raid(state):
+    """Start the next queued raid of the chat, if queueing is enabled and one is waiting.
+
+    The raid's baseline is the tweet's engagement when the raid starts, not when it was
+    queued. Queued raids whose tweet can't be looked up are skipped; while Twitter's circuit
+    is open the queue waits and is tried again once a probe is allowed.
+    """
+    while state.queue_enabled and state.raid_queue and state.ongoing_raid is None:
+        entry = state.raid_queue.at(1)
+        try:
+            baseline = await metrics_cache.get(extract_post_id(entry['post_link']))
+        except CircuitOpenError as e:
+            # Never sooner than a tracker tick, so a chat can't spin on a circuit that stays open
+            run_in_background(start_next_queued_raid_later(state, max(e.retry_in, MIN_POLL_INTERVAL)))
+            return
+        except TwitterError as e:
+            if raid_manager.remove_queued(state, entry) is not None:
+                await outbox.send_message(chat_id=state.chat_id,
+                                          text=f"Skipped the queued raid on {entry['post_link']}: {str(e)}")
+            continue
+        if state.raid_queue.at(1) is not entry or state.ongoing_raid is not None:
+            continue  # The queue or the chat changed during the lookup
+        raid_manager.dequeue(state)
+        await start_raid(state, new_raid(entry['post_link'], entry['likes_goal'], entry['retweets_goal'],
+                                         entry['replies_goal'], entry['bookmarks_goal'], state.chat_id,
+                                         entry['message_id'], baseline=baseline))
+        return
+
+
+async def start_next_queued_raid_later(state, delay):
     await asyncio.sleep(delay)
-    await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+    await start_next_queued_raid(state)
+
+
+async def finish_raid(state, raid, cleanup_delay):
+    """End the chat's raid, remove its card after `cleanup_delay` and start the next queued one."""
+    raid_manager.deactivate(state)
+    run_in_background(cleanup_tracking_messages(state.chat_id, delay=cleanup_delay,
+                                                message_id=raid.pinned_message_id))
+    await start_next_queued_raid(state)
+
+
+async def send_media(chat_id, kind, media, caption, parse_mode=None, priority=PRIORITY_COMMAND):
+    """Send a photo or video given as a file, URL or Telegram file_id."""
+    if kind == 'video':
+        return await outbox.send_video(chat_id=chat_id, video=media, caption=caption, parse_mode=parse_mode,
+                                       priority=priority)
+    if kind == 'animation':
+        return await outbox.send_animation(chat_id=chat_id, animation=media, caption=caption, parse_mode=parse_mode,
+                                           priority=priority)
+    return await outbox.send_photo(chat_id=chat_id, photo=media, caption=caption, parse_mode=parse_mode,
+                                   priority=priority)
+
+
+def media_file_id(message: types.Message):
+    """Return the file_id of the media attached to `message`, if any."""
+    if message.video:
+        return message.video.file_id
+    if message.animation:
+        return message.animation.file_id
+    if message.photo:
+        return message.photo[-1].file_id
+    return None
+
+
+async def send_message_with_deletion(chat_id: int, text: str, delay: int, parse_mode=None):
+    """Helper function to send a message and schedule its deletion after a delay."""
+    message = await outbox.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+    deletion_scheduler.schedule(chat_id, message.message_id, delay)
 
 
 async def is_admin(message: types.Message):
     """Check if the user is an admin."""
+    if message.chat.type != types.ChatType.PRIVATE:  # Private chats have no administrator list to cache
+        try:
+            return await admin_roster.is_admin(message.chat.id, message.from_user.id)
+        except BadRequest:
+            pass
+    # Chats without an administrator list are checked member by member
     chat_member = await bot.get_chat_member(message.chat.id, message.from_user.id)
     return chat_member.is_chat_admin()
 
@@ -95,12 +2217,21 @@ async def send_welcome_handler(message: types.Message):
         "/start or /help - Display this help message.\n\n"
         "/raid <post link> <likes> <retweets> <replies> <bookmarks> - Start a new raid on a specific tweet. "
         "You must provide the link to the tweet and the goals for likes, retweets, replies, and bookmarks.\n\n"
-        "/cancel - Cancel the current ongoing raid.\n\n"
+        "/raidbatch - Queue several raids at once, one <post link> <likes> <retweets> <replies> <bookmarks> "
+        "per line after the command.\n\n"
+        "/cancel - Cancel the current ongoing raid. /cancel <position> cancels a queued raid instead.\n\n"
+        "/bump <position> - Move a queued raid ahead of the others.\n\n"
         "/cancelall - Cancel all ongoing and queued raids.\n\n"
         "/queueon - Enable the raid queue system.\n\n"
         "/queueoff - Disable the raid queue system.\n\n"
-        "/queue - Display the status of the current raid and the list of queued raids.\n\n"
+        "/queue [page] - Display the status of the current raid and the list of queued raids.\n\n"
         "/status - Check the current status of the ongoing raid.\n\n"
+        "/stats - Show how fast the ongoing raid is moving and when each goal should be reached.\n\n"
+        "/leaderboard - Rank every group raiding the same tweet by progress towards its goals.\n\n"
+        "/leaderboardon - Show this group's name on the leaderboards of other groups.\n\n"
+        "/leaderboardoff - List this group anonymously on other groups' leaderboards (the default).\n\n"
+        "/setbanner - Reply to a photo or video to use it as this group's raid banner, "
+        "or send it alone to restore the default banner.\n\n"
     )
     await send_message_with_deletion(message.chat.id, help_text, 60)
 
@@ -111,72 +2242,104 @@ async def raid_command(message: types.Message):
 
 
 async def raid_command_handler(message: types.Message):
-    global ongoing_raid, stop_engagement_task, raid_start_time
+    state = raid_manager.get(message.chat.id)
     args = message.text.split()
 
     if len(args) < 6:
-        await bot.send_message(message.chat.id,
-                               "Usage: /raid <post link> <likes> <retweets> <replies> <bookmarks>")
+        await outbox.send_message(chat_id=message.chat.id, text=f"Usage: /raid {RAID_USAGE}")
         return
 
-    post_link = args[1]
-    new_likes_goal, new_retweets_goal, new_replies_goal, new_bookmarks_goal = map(int, args[2:6])
+    try:
+        post_link, goals = parse_raid_args(args[1:6])
+    except ValueError as e:
+        await outbox.send_message(chat_id=message.chat.id, text=f"Invalid raid: {str(e)}.\nUsage: /raid {RAID_USAGE}")
+        return
+    new_likes_goal, new_retweets_goal, new_replies_goal, new_bookmarks_goal = goals
 
     post_id = extract_post_id(post_link)
 
     try:
         # Fetch the current engagement metrics using the correct fields
-        response = twitter_client.get_tweet(id=post_id, tweet_fields=['public_metrics'])
-        metrics = response.data['public_metrics']
-
-        current_likes = metrics.get('like_count', 0)
-        current_retweets = metrics.get('retweet_count', 0)
-        current_replies = metrics.get('reply_count', 0)
-        current_bookmarks = metrics.get('bookmark_count', 0)
-
-        if ongoing_raid:
-            if queue_enabled:
-                raid_queue.append({
-                    "post_link": post_link,
-                    "likes_goal": new_likes_goal,
-                    "retweets_goal": new_retweets_goal,
-                    "replies_goal": new_replies_goal,
-                    "bookmarks_goal": new_bookmarks_goal,
-                    "message": message  # Store the message object for use when this raid starts
-                })
-                await bot.send_message(message.chat.id, "A raid is already ongoing. Your raid has been queued.")
+        metrics = await metrics_cache.get(post_id)
+
+        if state.ongoing_raid:
+            if state.queue_enabled:
+                raid_manager.enqueue(state, queued_raid(message.chat.id, message.message_id, post_link, goals,
+                                                        message.from_user.id))
+                await outbox.send_message(chat_id=message.chat.id, text="A raid is already ongoing. Your raid has been queued.")
             else:
-                await bot.send_message(message.chat.id, "A raid is already ongoing. Queueing is currently disabled.")
+                await outbox.send_message(chat_id=message.chat.id, text="A raid is already ongoing. Queueing is currently disabled.")
         else:
-            stop_engagement_task = False  # Reset the flag for a new raid
-            raid_start_time = datetime.utcnow()  # Start tracking the time for the raid
-            ongoing_raid = {
-                "post_link": post_link,
-                "likes_goal": new_likes_goal,
-                "retweets_goal": new_retweets_goal,
-                "replies_goal": new_replies_goal,
-                "bookmarks_goal": new_bookmarks_goal,
-                "initial_likes": current_likes,
-                "initial_retweets": current_retweets,
-                "initial_replies": current_replies,
-                "initial_bookmarks": current_bookmarks,
-                "likes": current_likes,
-                "retweets": current_retweets,
-                "replies": current_replies,
-                "bookmarks": current_bookmarks,
-                "message": message  # Store the message object for use in updates
-            }
-            # Ensure initial progress is 0%
-            pinned_message = await send_full_raid_update(message, ongoing_raid, initial=True)
-            await bot.pin_chat_message(chat_id=message.chat.id, message_id=pinned_message.message_id,
-                                       disable_notification=True)
-            # Store the pinned message ID in ongoing_raid for deletion later
-            ongoing_raid['pinned_message_id'] = pinned_message.message_id
-
-    except tweepy.errors.TweepyException as e:
-        await bot.send_message(message.chat.id, f"Error fetching tweet metrics: {str(e)}")
+            await start_raid(state, new_raid(post_link, new_likes_goal, new_retweets_goal, new_replies_goal,
+                                             new_bookmarks_goal, message.chat.id, message.message_id,
+                                             baseline=metrics))
+
+    except TwitterError as e:
+        await outbox.send_message(chat_id=message.chat.id, text=f"Error fetching tweet metrics: {str(e)}")
     except Exception as e:
-        await bot.send_message(message.chat.id, f"Unexpected error: {str(e)}")
+        await outbox.send_message(chat_id=message.chat.id, text=f"Unexpected error: {str(e)}")
+
+
+@dp.message_handler(commands=['raidbatch'])
+async def raid_batch(message: types.Message):
+    await admin_only(message, raid_batch_handler)
+
+
+async def raid_batch_handler(message: types.Message):
+    """Queue many raids at once, one `<post link> <likes> <retweets> <replies> <bookmarks>` per line.
+
+    Every line is validated and every tweet looked up in one batched request before anything
+    is queued; lines that fail are reported and skipped without affecting the others.
+    """
+    chat_id = message.chat.id
+    state = raid_manager.get(chat_id)
+    lines = [(number, line.split()) for number, line in enumerate(message.get_args().splitlines(), 1)
+             if line.strip()]
+    if not lines:
+        await outbox.send_message(chat_id=chat_id, text=f"Usage: /raidbatch followed by one {RAID_USAGE} per line")
+        return
+    if not state.queue_enabled:
+        await outbox.send_message(chat_id=chat_id, text="Queueing is currently disabled. Use /queueon to queue a batch.")
+        return
+
+    errors = []
+    parsed = []
+    for number, words in lines:
+        try:
+            parsed.append((number, *parse_raid_args(words)))
+        except ValueError as e:
+            errors.append((number, str(e)))
+
+    try:
+        metrics = await metrics_cache.get_many([extract_post_id(post_link) for _, post_link, _ in parsed]) if parsed else {}
+    except TwitterError as e:
+        await outbox.send_message(chat_id=chat_id, text=f"Error fetching tweet metrics: {str(e)}")
+        return
+
+    accepted = []
+    for number, post_link, goals in parsed:
+        baseline = metrics.get(extract_post_id(post_link))
+        if baseline is None:
+            errors.append((number, "tweet not found"))
+        else:
+            accepted.append((post_link, goals, baseline))
+
+    # Nothing is awaited between queueing the batch and activating its first raid, so no other
+    # command can slip in between
+    first = accepted.pop(0) if accepted and not state.ongoing_raid else None
+    # Queued raids take their baseline when they start, the lookup only proved their tweets exist
+    raid_manager.enqueue_many(state, [queued_raid(chat_id, message.message_id, post_link, goals, message.from_user.id)
+                                      for post_link, goals, _ in accepted])
+    if first:
+        post_link, goals, baseline = first
+        await start_raid(state, new_raid(post_link, *goals, chat_id, message.message_id, baseline=baseline))
+
+    summary = f"Queued {len(accepted)} raids from the batch."
+    if first:
+        summary = f"Started 1 raid and queued {len(accepted)} more from the batch."
+    if errors:
+        summary += "\n\nSkipped lines:\n" + "\n".join(f"Line {number}: {error}" for number, error in sorted(errors))
+    await outbox.send_message(chat_id=chat_id, text=summary)
 
 
 @dp.message_handler(commands=['cancel'])
@@ -185,68 +2348,62 @@ async def cancel_raid(message: types.Message):
 
 
 async def cancel_raid_handler(message: types.Message):
-    global ongoing_raid, stop_engagement_task
-    if ongoing_raid:
-        stop_engagement_task = True  # Signal to stop engagement tracking
-        await bot.send_message(message.chat.id, "The current raid has been canceled.")
-        await cleanup_tracking_messages(ongoing_raid['message'].chat.id, delay=0)  # Set delay to 0 for instant cleanup
-        ongoing_raid = None
-
-        if queue_enabled and raid_queue:
-            next_raid = raid_queue.popleft()  # Use popleft() to efficiently pop from the deque
-            stop_engagement_task = False  # Reset the flag for the next raid
-            ongoing_raid = {
-                "post_link": next_raid['post_link'],
-                "likes_goal": next_raid['likes_goal'],
-                "retweets_goal": next_raid['retweets_goal'],
-                "replies_goal": next_raid['replies_goal'],
-                "bookmarks_goal": next_raid['bookmarks_goal'],
-                "initial_likes": 0,
-                "initial_retweets": 0,
-                "initial_replies": 0,
-                "initial_bookmarks": 0,
-                "likes": 0,
-                "retweets": 0,
-                "replies": 0,
-                "bookmarks": 0,
-                "message": next_raid['message']  # Pass the correct message object
-            }
-            # Send and pin the full raid update message with progress at 0%
-            pinned_message = await send_full_raid_update(next_raid['message'], ongoing_raid, initial=True)
-            await bot.pin_chat_message(chat_id=ongoing_raid['message'].chat.id,
-                                       message_id=pinned_message.message_id, disable_notification=True)
-            ongoing_raid['pinned_message_id'] = pinned_message.message_id
+    """Cancel the ongoing raid, the queued raid at `/cancel <position>`, or the ones queued by the replied-to command."""
+    state = raid_manager.get(message.chat.id)
+    args = message.get_args().split()
+    # The raids queued by the /raid or /raidbatch command being replied to, if any
+    replied = message.reply_to_message
+    entries = state.raid_queue.by_message(replied.message_id) if replied and not args else []
+    if args:
+        entry = state.raid_queue.at(int(args[0])) if args[0].isdigit() else None
+        if entry:
+            raid_manager.remove_queued(state, entry)
+            await outbox.send_message(chat_id=message.chat.id, text=f"Queued raid {args[0]} has been canceled.")
+        else:
+            await outbox.send_message(chat_id=message.chat.id, text="There is no queued raid at that position. See /queue.")
+    elif entries:
+        for entry in entries:
+            raid_manager.remove_queued(state, entry)
+        await outbox.send_message(chat_id=message.chat.id, text="The raid was in the queue and has been canceled.")
+    elif state.ongoing_raid:
+        raid = state.ongoing_raid
+        await outbox.send_message(chat_id=message.chat.id, text="The current raid has been canceled.")
+        await finish_raid(state, raid, cleanup_delay=0)  # Set delay to 0 for instant cleanup
     else:
-        # Check if the message was queued and remove it
-        removed = False
-        for raid in raid_queue:
-            if raid['message'].message_id == message.message_id:
-                raid_queue.remove(raid)
-                removed = True
-                break
+        await outbox.send_message(chat_id=message.chat.id, text="No ongoing or queued raid to cancel.")
 
-        if removed:
-            await bot.send_message(message.chat.id, "The raid was in the queue and has been canceled.")
-        else:
-            await bot.send_message(message.chat.id, "No ongoing or queued raid to cancel.")
+
+@dp.message_handler(commands=['bump'])
+async def bump_raid(message: types.Message):
+    await admin_only(message, bump_raid_handler)
+
+
+async def bump_raid_handler(message: types.Message):
+    """Serve the queued raid at `/bump <position>` before the raids that weren't bumped."""
+    state = raid_manager.get(message.chat.id)
+    args = message.get_args().split()
+    entry = state.raid_queue.at(int(args[0])) if args and args[0].isdigit() else None
+    if entry is None:
+        await outbox.send_message(chat_id=message.chat.id, text="Usage: /bump <position in /queue>")
+        return
+    raid_manager.reprioritize(state, entry, entry['priority'] + 1)
+    await outbox.send_message(chat_id=message.chat.id, text=f"Queued raid {args[0]} has been moved up.")
 
 
 @dp.message_handler(commands=['cancelall'])
 async def cancel_all_raids_handler(message: types.Message):
-    global ongoing_raid, stop_engagement_task, raid_queue
-
-    # Cancel the ongoing raid if there is one
-    if ongoing_raid:
-        stop_engagement_task = True
-        await bot.send_message(message.chat.id, "All raids have been canceled.")
-        await cleanup_tracking_messages(ongoing_raid['message'].chat.id, delay=60)
-        ongoing_raid = None
+    state = raid_manager.get(message.chat.id)
 
     # Clear the queue
-    if raid_queue:
-        raid_queue.clear()
+    raid_manager.clear_queue(state)
 
-    await bot.send_message(message.chat.id, "The raid queue has been cleared.")
+    # Cancel the ongoing raid if there is one
+    if state.ongoing_raid:
+        raid = state.ongoing_raid
+        await outbox.send_message(chat_id=message.chat.id, text="All raids have been canceled.")
+        await finish_raid(state, raid, cleanup_delay=60)
+
+    await outbox.send_message(chat_id=message.chat.id, text="The raid queue has been cleared.")
 
 
 @dp.message_handler(commands=['queue'])
@@ -255,15 +2412,22 @@ async def queue_status(message: types.Message):
 
 
 async def queue_status_handler(message: types.Message):
-    global ongoing_raid, raid_queue
-    if not ongoing_raid and not raid_queue:
+    state = raid_manager.get(message.chat.id)
+    if not state.ongoing_raid and not state.raid_queue:
         await send_message_with_deletion(message.chat.id, "No ongoing or queued raids at the moment.", 20)
     else:
         status = "*UPCOMING RAIDS*\n\n"
-        if queue_enabled and raid_queue:
-            status += "\n"
-            for i, raid in enumerate(raid_queue, 1):
-                status += f"{i}. [Tweet]({raid['post_link']}) {raid['likes_goal']} {raid['retweets_goal']} {raid['replies_goal']} {raid['bookmarks_goal']}\n"
+        if state.queue_enabled and state.raid_queue:
+            args = message.get_args().split()
+            pages = -(-len(state.raid_queue) // QUEUE_PAGE_SIZE)
+            page = min(max(int(args[0]), 1), pages) if args and args[0].isdigit() else 1
+            first = (page - 1) * QUEUE_PAGE_SIZE + 1
+            status += "\n" + "".join(
+                f"{i}. [Tweet]({raid['post_link']}) {raid['likes_goal']} {raid['retweets_goal']} {raid['replies_goal']} {raid['bookmarks_goal']}\n"
+                for i, raid in enumerate(state.raid_queue.page(page), first)
+            )
+            if pages > 1:
+                status += f"\nPage {page} of {pages}, use /queue <page> to see the others.\n"
         else:
             status += "No upcoming raid.\n\n"
         await send_message_with_deletion(message.chat.id, status, 20, parse_mode="Markdown")
@@ -274,50 +2438,23 @@ async def raid_status(message: types.Message):
 
 
 async def raid_status_handler(message: types.Message):
-    global ongoing_raid
+    ongoing_raid = raid_manager.get(message.chat.id).ongoing_raid
     if not ongoing_raid:
         await send_message_with_deletion(message.chat.id, "No ongoing raid at the moment.", 60)
         return
 
-    post_link = ongoing_raid['post_link']
-    post_id = extract_post_id(post_link)
-
     try:
         # Fetch tweet metrics
-        response = twitter_client.get_tweet(id=post_id, tweet_fields='public_metrics')
-        metrics = response.data['public_metrics']
-
-        current_likes = metrics.get('like_count', 0)
-        current_retweets = metrics.get('retweet_count', 0)
-        current_replies = metrics.get('reply_count', 0)
-        current_bookmarks = metrics.get('bookmark_count', 0)
-
-        # Calculate progress toward goals relative to the start of the raid
-        likes_progress = (current_likes - ongoing_raid['initial_likes']) / ongoing_raid['likes_goal'] * 100 if ongoing_raid['likes_goal'] > 0 else 100
-        retweets_progress = (current_retweets - ongoing_raid['initial_retweets']) / ongoing_raid['retweets_goal'] * 100 if ongoing_raid['retweets_goal'] > 0 else 100
-        replies_progress = (current_replies - ongoing_raid['initial_replies']) / ongoing_raid['replies_goal'] * 100 if ongoing_raid['replies_goal'] > 0 else 100
-        bookmarks_progress = (current_bookmarks - ongoing_raid['initial_bookmarks']) / ongoing_raid['bookmarks_goal'] * 100 if ongoing_raid['bookmarks_goal'] > 0 else 100
-
-        overall_progress = (likes_progress + retweets_progress + replies_progress + bookmarks_progress) / 4
-
-        ongoing_raid['likes'] = current_likes
-        ongoing_raid['retweets'] = current_retweets
-        ongoing_raid['replies'] = current_replies
-        ongoing_raid['bookmarks'] = current_bookmarks
-
-        status_message = (
-            f"\n*SMASH THE RAID OR PASTA DIES*\n"
-            f"◖{'▮' * int(20 * (overall_progress / 100))}{'▯' * (20 - int(20 * (overall_progress / 100)))}◗\n\n"
-            f"{get_color_for_completion(likes_progress)} Likes: {current_likes} of {ongoing_raid['initial_likes'] + ongoing_raid['likes_goal']}\n"
-            f"{get_color_for_completion(retweets_progress)} Retweets: {current_retweets} of {ongoing_raid['initial_retweets'] + ongoing_raid['retweets_goal']}\n"
-            f"{get_color_for_completion(replies_progress)} Replies: {current_replies} of {ongoing_raid['initial_replies'] + ongoing_raid['replies_goal']}\n"
-            f"{get_color_for_completion(bookmarks_progress)} Bookmarks: {current_bookmarks} of {ongoing_raid['initial_bookmarks'] + ongoing_raid['bookmarks_goal']}\n\n"
-            f"{post_link}"
-        )
+        metrics = await metrics_cache.get(ongoing_raid.post_id)
+        if ongoing_raid.slot is None:
+            return  # Canceled while the metrics were fetched
+
+        ongoing_raid.set_counts([metrics.get(key, 0) for key in PUBLIC_METRIC_KEYS])
+        raid_table.evaluate([ongoing_raid.slot])
 
-        await send_full_raid_update(message, ongoing_raid)
+        await send_full_raid_update(message.chat.id, ongoing_raid)
 
-    except tweepy.errors.TweepyException as e:
+    except TwitterError as e:
         await send_message_with_deletion(message.chat.id, f"Error fetching tweet metrics: {str(e)}", 60)
     except ServerDisconnectedError:
         await send_message_with_deletion(message.chat.id, "Server disconnected. Please try again.", 60)
@@ -325,15 +2462,103 @@ async def raid_status_handler(message: types.Message):
         await send_message_with_deletion(message.chat.id, f"Unexpected error: {str(e)}", 60)
 
 
+@dp.message_handler(commands=['stats'])
+async def raid_stats(message: types.Message):
+    await admin_only(message, raid_stats_handler)
+
+
+async def raid_stats_handler(message: types.Message):
+    raid = raid_manager.get(message.chat.id).ongoing_raid
+    if not raid:
+        await send_message_with_deletion(message.chat.id, "No ongoing raid at the moment.", 20)
+        return
+
+    series = raid.series
+    targets = raid.targets()
+    lines = ["*RAID STATS*\n"]
+    for name, count, target, rate, eta in zip(METRIC_NAMES, raid.counts(), targets, series.rates(), series.etas(targets)):
+        if eta == 0:
+            eta_text = "done"
+        elif eta is None:
+            eta_text = "stalled"
+        else:
+            eta_text = f"ETA {format_duration(int(eta))}"
+        lines.append(f"{name.capitalize()}: {count} of {target} | {rate * 60:+.1f}/min | {eta_text}")
+    lines.append(f"\nUpdated every ~{int(poll_scheduler.interval(raid))} seconds")
+    await send_message_with_deletion(message.chat.id, "\n".join(lines), 60, parse_mode="Markdown")
+
+
+@dp.message_handler(commands=['leaderboard'])
+async def raid_leaderboard(message: types.Message):
+    await admin_only(message, raid_leaderboard_handler)
+
+
+async def raid_leaderboard_handler(message: types.Message):
+    """Rank every group raiding the same tweet as this chat by how close they are to their goals.
+
+    Other groups are only named if they opted in with /leaderboardon.
+    """
+    raid = raid_manager.get(message.chat.id).ongoing_raid
+    if not raid:
+        await send_message_with_deletion(message.chat.id, "No ongoing raid at the moment.", 20)
+        return
+
+    subscriptions = raid_manager.subscriptions
+    if message.chat.title:
+        subscriptions.titles[message.chat.id] = message.chat.title
+    # Read the progress before awaiting the titles, a raid that ends meanwhile releases its slot
+    rows = []
+    for other in subscriptions.raids(raid.post_id):
+        if other.slot is None:
+            continue
+        gained = ", ".join(f"+{count - baseline} {name}" for name, count, baseline, goal
+                           in zip(METRIC_NAMES, other.counts(), other.baselines(), other.goals()) if goal > 0)
+        named = other is raid or raid_manager.get(other.chat_id).leaderboard_listed
+        rows.append((other.overall, other.chat_id, other is raid, named, gained))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    named_ids = [chat_id for _, chat_id, _, named, _ in rows if named]
+    titles = dict(zip(named_ids, await asyncio.gather(*(subscriptions.title(chat_id) for chat_id in named_ids))))
+    lines = ["*RAID LEADERBOARD*\n"]
+    for rank, (overall, chat_id, own, _, gained) in enumerate(rows, 1):
+        title = titles.get(chat_id, "Anonymous group")
+        for character in '_*`[':  # Group names must not open Markdown entities
+            title = title.replace(character, '\\' + character)
+        lines.append(f"{rank}. {title}: {overall:.0f}%" + (f" ({gained})" if gained else "")
+                     + (" ⬅️" if own else ""))
+    lines.append(f"\n{len(rows)} groups raiding this tweet")
+    await send_message_with_deletion(message.chat.id, "\n".join(lines), 60, parse_mode="Markdown")
+
+
+@dp.message_handler(commands=['leaderboardon'])
+async def list_on_leaderboards(message: types.Message):
+    await admin_only(message, list_on_leaderboards_handler)
+
+
+async def list_on_leaderboards_handler(message: types.Message):
+    raid_manager.set_leaderboard_listed(raid_manager.get(message.chat.id), True)
+    await outbox.send_message(chat_id=message.chat.id,
+                              text="Other groups raiding the same tweet will now see this group's name.")
+
+
+@dp.message_handler(commands=['leaderboardoff'])
+async def hide_from_leaderboards(message: types.Message):
+    await admin_only(message, hide_from_leaderboards_handler)
+
+
+async def hide_from_leaderboards_handler(message: types.Message):
+    raid_manager.set_leaderboard_listed(raid_manager.get(message.chat.id), False)
+    await outbox.send_message(chat_id=message.chat.id,
+                              text="This group is now listed anonymously on other groups' leaderboards.")
+
+
 @dp.message_handler(commands=['queueon'])
 async def enable_queue(message: types.Message):
     await admin_only(message, enable_queue_handler)
 
 
 async def enable_queue_handler(message: types.Message):
-    global queue_enabled
-    queue_enabled = True
-    await bot.send_message(message.chat.id, "Raid queueing has been enabled.")
+    raid_manager.set_queue_enabled(raid_manager.get(message.chat.id), True)
+    await outbox.send_message(chat_id=message.chat.id, text="Raid queueing has been enabled.")
 
 
 @dp.message_handler(commands=['queueoff'])
@@ -342,9 +2567,41 @@ async def disable_queue(message: types.Message):
 
 
 async def disable_queue_handler(message: types.Message):
-    global queue_enabled
-    queue_enabled = False
-    await bot.send_message(message.chat.id, "Raid queueing has been disabled.")
+    raid_manager.set_queue_enabled(raid_manager.get(message.chat.id), False)
+    await outbox.send_message(chat_id=message.chat.id, text="Raid queueing has been disabled.")
+
+
+@dp.message_handler(commands=['setbanner'])
+async def set_banner(message: types.Message):
+    await admin_only(message, set_banner_handler)
+
+
+async def set_banner_handler(message: types.Message):
+    source = message.reply_to_message
+    if source is None:
+        await media_cache.set_chat_banner(message.chat.id, None, None)
+        await send_message_with_deletion(message.chat.id, "The default raid banner has been restored.", 20)
+        return
+
+    file_id = media_file_id(source)
+    if file_id is None:
+        await send_message_with_deletion(message.chat.id, "Reply to a photo or video to use it as the raid banner.", 20)
+        return
+
+    kind = 'video' if source.video else 'animation' if source.animation else 'photo'
+    await media_cache.set_chat_banner(message.chat.id, kind, file_id)
+    await send_message_with_deletion(message.chat.id, "The raid banner for this group has been updated.", 20)
+
+
+@dp.chat_member_handler()
+async def chat_member_update_handler(update: types.ChatMemberUpdated):
+    admin_roster.apply_update(update)
+
+
+@dp.my_chat_member_handler()
+async def my_chat_member_update_handler(update: types.ChatMemberUpdated):
+    # The bot itself was added, removed or had its rights changed: fetch the roster again next time
+    admin_roster.invalidate(update.chat.id)
 
 
 @dp.inline_handler()
@@ -352,7 +2609,8 @@ async def inline_query_handler(inline_query: InlineQuery):
     query = inline_query.query.lower()
 
     commands = [
-        "queueon", "queueoff", "queue", "cancel", "cancelall", "raid", "status"
+        "queueon", "queueoff", "queue", "cancel", "cancelall", "bump", "raid", "raidbatch", "status", "stats", "leaderboard",
+        "leaderboardon", "leaderboardoff", "setbanner"
     ]
     results = []
 
@@ -366,236 +2624,872 @@ async def inline_query_handler(inline_query: InlineQuery):
                 )
             )
 
-    await bot.answer_inline_query(inline_query.id, results)
+    await outbox.answer_inline_query(inline_query.id, results)
 
 
 async def track_engagement():
-    global ongoing_raid, stop_engagement_task, raid_start_time
-
+    """Shared scheduler polling the raids of every chat that are due on each tick."""
     while True:
-        if ongoing_raid:
-            post_link = ongoing_raid['post_link']
-            post_id = extract_post_id(post_link)
-
+        now = time.monotonic()
+        if twitter_client.circuit_open(poll_scheduler.endpoint):
+            # Twitter is down: don't poll until the circuit lets a probe through, and pause the
+            # raids so they don't fail because of the outage
+            await asyncio.gather(*(pause_raid(state, state.ongoing_raid) for state in raid_manager.active_chats()
+                                   if state.ongoing_raid.metrics_delayed_since is None))
+            due = None
+        else:
+            due = poll_scheduler.select([state.ongoing_raid for state in raid_manager.active_chats()], now)
+        if due:
+            # Pair each chat with the raid being polled so raids canceled mid-tick are skipped
+            tracked = [(raid_manager.get(raid.chat_id), raid) for raid in due]
+            previous = [raid.counts() for raid in due]
+            started = time.perf_counter()
             try:
-                metrics = twitter_client.get_tweet(id=post_id, tweet_fields='public_metrics').data['public_metrics']
-
-                current_likes = metrics['like_count']
-                current_retweets = metrics['retweet_count']
-                current_replies = metrics['reply_count']
-                current_bookmarks = metrics['bookmark_count']
-
-                # Update the ongoing raid metrics
-                ongoing_raid['likes'] = current_likes
-                ongoing_raid['retweets'] = current_retweets
-                ongoing_raid['replies'] = current_replies
-                ongoing_raid['bookmarks'] = current_bookmarks
-
-                # Calculate progress for each metric relative to the initial values
-                likes_percentage = (current_likes - ongoing_raid['initial_likes']) / ongoing_raid['likes_goal'] * 100 if ongoing_raid['likes_goal'] > 0 else 100
-                retweets_percentage = (current_retweets - ongoing_raid['initial_retweets']) / ongoing_raid['retweets_goal'] * 100 if ongoing_raid['retweets_goal'] > 0 else 100
-                replies_percentage = (current_replies - ongoing_raid['initial_replies']) / ongoing_raid['replies_goal'] * 100 if ongoing_raid['replies_goal'] > 0 else 100
-                bookmarks_percentage = (current_bookmarks - ongoing_raid['initial_bookmarks']) / ongoing_raid['bookmarks_goal'] * 100 if ongoing_raid['bookmarks_goal'] > 0 else 100
-
-                # Stop sending updates if the raid has been canceled
-                if stop_engagement_task:
-                    return
-
-                # Check if the raid has exceeded the 1-hour time limit
-                if datetime.utcnow() - raid_start_time > timedelta(hours=1):
-                    await bot.send_message(
-                        chat_id=ongoing_raid['message'].chat.id,
-                        text="Damn, we didn't smash that raid enough 😭😭",
-                        parse_mode="Markdown",
-                        reply_to_message_id=ongoing_raid['pinned_message_id']
-                    )
-                    await cleanup_tracking_messages(ongoing_raid['message'].chat.id, delay=10)
-                    ongoing_raid = None
-
-                    if queue_enabled and raid_queue:
-                        next_raid = raid_queue.popleft()
-                        stop_engagement_task = False  # Reset the flag for the next raid
-                        raid_start_time = datetime.utcnow()  # Start tracking the time for the new raid
-                        ongoing_raid = {
-                            "post_link": next_raid['post_link'],
-                            "likes_goal": next_raid['likes_goal'],
-                            "retweets_goal": next_raid['retweets_goal'],
-                            "replies_goal": next_raid['replies_goal'],
-                            "bookmarks_goal": next_raid['bookmarks_goal'],
-                            "initial_likes": 0,
-                            "initial_retweets": 0,
-                            "initial_replies": 0,
-                            "initial_bookmarks": 0,
-                            "likes": 0,
-                            "retweets": 0,
-                            "replies": 0,
-                            "bookmarks": 0,
-                            "message": next_raid['message']  # Pass the correct message object
-                        }
-                        pinned_message = await send_full_raid_update(ongoing_raid['message'], ongoing_raid, initial=True)
-                        await bot.pin_chat_message(chat_id=ongoing_raid['message'].chat.id,
-                                                   message_id=pinned_message.message_id, disable_notification=True)
-                        ongoing_raid['pinned_message_id'] = pinned_message.message_id
-                else:
-                    # Determine the color for each metric
-                    likes_color = get_color_for_completion(likes_percentage)
-                    retweets_color = get_color_for_completion(retweets_percentage)
-                    replies_color = get_color_for_completion(replies_percentage)
-                    bookmarks_color = get_color_for_completion(bookmarks_percentage)
-
-                    if (likes_percentage >= 100 and retweets_percentage >= 100 and
-                            replies_percentage >= 100 and bookmarks_percentage >= 100):
-                        raid_duration = datetime.utcnow() - raid_start_time  # Calculate raid duration
-                        duration_str = format_duration(int(raid_duration.total_seconds()))  # Format the duration
-                        alert_message = (
-                            f"GJ BOYS WE FUCKED THAT RAID 🙏🙏\n\n"
-                            f"COMPLETED IN JUST {duration_str}!! 😈😈"
-                        )
-                        # Send the final raid completion message as a reply to the pinned message
-                        await bot.send_message(
-                            chat_id=ongoing_raid['message'].chat.id,
-                            text=alert_message,
-                            parse_mode="Markdown",
-                            reply_to_message_id=ongoing_raid['pinned_message_id']  # Reply to the last pinned message
-                        )
-
-                        await cleanup_tracking_messages(ongoing_raid['message'].chat.id, delay=10)
-                        ongoing_raid = None
-
-                        if queue_enabled and raid_queue:
-                            next_raid = raid_queue.popleft()
-                            stop_engagement_task = False  # Reset the flag for the next raid
-                            raid_start_time = datetime.utcnow()  # Start tracking the time for the new raid
-                            ongoing_raid = {
-                                "post_link": next_raid['post_link'],
-                                "likes_goal": next_raid['likes_goal'],
-                                "retweets_goal": next_raid['retweets_goal'],
-                                "replies_goal": next_raid['replies_goal'],
-                                "bookmarks_goal": next_raid['bookmarks_goal'],
-                                "initial_likes": 0,
-                                "initial_retweets": 0,
-                                "initial_replies": 0,
-                                "initial_bookmarks": 0,
-                                "likes": 0,
-                                "retweets": 0,
-                                "replies": 0,
-                                "bookmarks": 0,
-                                "message": next_raid['message']  # Pass the correct message object
-                            }
-                            pinned_message = await send_full_raid_update(ongoing_raid['message'], ongoing_raid, initial=True)
-                            await bot.pin_chat_message(chat_id=ongoing_raid['message'].chat.id,
-                                                       message_id=pinned_message.message_id, disable_notification=True)
-                            ongoing_raid['pinned_message_id'] = pinned_message.message_id
-                    else:
-                        # Delete the previously pinned message before sending the next update
-                        if 'pinned_message_id' in ongoing_raid and ongoing_raid['pinned_message_id']:
-                            try:
-                                await bot.delete_message(chat_id=ongoing_raid['message'].chat.id,
-                                                         message_id=ongoing_raid['pinned_message_id'])
-                            except Exception as e:
-                                print(f"Error deleting pinned message: {str(e)}")
-
-                        # Send the updated raid status
-                        pinned_message = await send_full_raid_update(ongoing_raid['message'], ongoing_raid)
-
-                        # Pin the new message
-                        await bot.pin_chat_message(chat_id=ongoing_raid['message'].chat.id,
-                                                   message_id=pinned_message.message_id,
-                                                   disable_notification=True)
-
-                        # Store the ID of the current message to delete it later
-                        ongoing_raid['pinned_message_id'] = pinned_message.message_id
-
+                await poll_raid_metrics(due, max_age=MIN_POLL_INTERVAL)
+                polled_at = time.monotonic()
+                for raid, before in zip(due, previous):
+                    if raid.slot is None:
+                        continue  # Ended while the metrics were fetched
+                    poll_scheduler.record(raid, before, polled_at)
+                    raid.series.append(polled_at, raid.counts())
+                for state, raid in tracked:
+                    resume_raid(state, raid)
+                await asyncio.gather(*(update_raid_progress(state, raid) for state, raid in tracked))
             except ServerDisconnectedError:
                 print("Server disconnected. Retrying...")
             except Exception as e:
                 print(f"Unexpected error during tracking: {str(e)}")
+            metrics.observe('deraid_tracker_tick_seconds', time.perf_counter() - started)
+
+        # Tick on wall-clock multiples of the interval so shard workers poll together and the
+        # coordinator can merge their lookups
+        await asyncio.sleep(MIN_POLL_INTERVAL - time.time() % MIN_POLL_INTERVAL)
+
+
+async def pause_raid(state, raid):
+    """Stop the raid's clock while Twitter is unreachable and show its metrics as delayed."""
+    raid.metrics_delayed_since = datetime.utcnow()
+    try:
+        await refresh_raid_card(state, raid)
+    except Exception as e:
+        print(f"Error showing delayed metrics: {str(e)}")
+
+
+def resume_raid(state, raid):
+    """Restart a paused raid's clock once fresh metrics came in, giving back the time Twitter was down."""
+    if raid.metrics_delayed_since is None:
+        return
+    if state.ongoing_raid is raid:
+        state.raid_start_time += datetime.utcnow() - raid.metrics_delayed_since
+        raid_manager.save(state)
+    raid.metrics_delayed_since = None
+
+
+async def update_raid_progress(state, raid):
+    """Handle one tracker tick for a chat: fail, complete or refresh its raid card."""
+    # Stop sending updates if the raid has been canceled
+    if state.ongoing_raid is not raid:
+        return
+
+    chat_id = state.chat_id
+    try:
+        # Check if the raid has exceeded the 1-hour time limit
+        if datetime.utcnow() - state.raid_start_time > RAID_TIME_LIMIT:
+            await outbox.send_message(
+                chat_id=chat_id,
+                text="Damn, we didn't smash that raid enough 😭😭",
+                parse_mode="Markdown",
+                reply_to_message_id=raid.pinned_message_id
+            )
+            await finish_raid(state, raid, cleanup_delay=10)
+        elif raid.complete:
+            raid_duration = datetime.utcnow() - state.raid_start_time  # Calculate raid duration
+            duration_str = format_duration(int(raid_duration.total_seconds()))  # Format the duration
+            # Over the whole raid: the series only holds its last SERIES_CAPACITY samples
+            pace = ", ".join(f"{rate * 60:.1f} {name}/min"
+                             for name, rate in zip(METRIC_NAMES, raid.average_rates(raid_duration.total_seconds()))
+                             if rate > 0)
+            alert_message = (
+                f"GJ BOYS WE FUCKED THAT RAID 🙏🙏\n\n"
+                f"COMPLETED IN JUST {duration_str}!! 😈😈"
+            )
+            if pace:
+                alert_message += f"\n\nAverage pace: {pace}"
+
+            # Send the final raid completion message as a reply to the pinned message
+            await outbox.send_message(
+                chat_id=chat_id,
+                text=alert_message,
+                parse_mode="Markdown",
+                reply_to_message_id=raid.pinned_message_id  # Reply to the last pinned message
+            )
+            await finish_raid(state, raid, cleanup_delay=10)
+        else:
+            await refresh_raid_card(state, raid)
+
+    except ServerDisconnectedError:
+        print("Server disconnected. Retrying...")
+    except Exception as e:
+        print(f"Unexpected error during tracking: {str(e)}")
+
 
-        await asyncio.sleep(15)  # Check every 15 seconds
+async def poll_raid_metrics(raids, max_age=None):
+    """Refresh the metrics of every tracked raid with batched tweet lookups.
+
+    All post ids are collected and fetched together, then each result is fanned out to the
+    raids tracking that tweet and their progress is evaluated in one pass. Returns the raids
+    that were updated.
+    """
+    metrics_by_post = await metrics_cache.get_many([raid.post_id for raid in raids], max_age=max_age)
+
+    updated = []
+    for raid in raids:
+        metrics = metrics_by_post.get(raid.post_id)
+        if metrics is None or raid.slot is None:
+            continue
+        raid.set_counts([metrics.get(key, 0) for key in PUBLIC_METRIC_KEYS])
+        updated.append(raid)
+    raid_table.evaluate([raid.slot for raid in updated])
+    return updated
 
 
 def extract_post_id(post_link):
-    return post_link.split('/')[-1]
-
-
-async def send_full_raid_update(message: types.Message, raid_data, initial=False):
-    likes_progress = 0 if initial else (raid_data['likes'] - raid_data['initial_likes'])
-    retweets_progress = 0 if initial else (raid_data['retweets'] - raid_data['initial_retweets'])
-    replies_progress = 0 if initial else (raid_data['replies'] - raid_data['initial_replies'])
-    bookmarks_progress = 0 if initial else (raid_data['bookmarks'] - raid_data['initial_bookmarks'])
-
-    likes_percentage = (likes_progress / raid_data['likes_goal'] * 100) if raid_data['likes_goal'] > 0 else 100
-    retweets_percentage = (retweets_progress / raid_data['retweets_goal'] * 100) if raid_data['retweets_goal'] > 0 else 100
-    replies_percentage = (replies_progress / raid_data['replies_goal'] * 100) if raid_data['replies_goal'] > 0 else 100
-    bookmarks_percentage = (bookmarks_progress / raid_data['bookmarks_goal'] * 100) if raid_data['bookmarks_goal'] > 0 else 100
-
-    # Determine the color for each metric
-    likes_color = get_color_for_completion(likes_percentage)
-    retweets_color = get_color_for_completion(retweets_percentage)
-    replies_color = get_color_for_completion(replies_percentage)
-    bookmarks_color = get_color_for_completion(bookmarks_percentage)
-
-    # Create the progress bar (represented as text)
-    total_blocks = 20
-    valid_percentages = [
-        likes_percentage if raid_data['likes_goal'] > 0 else None,
-        retweets_percentage if raid_data['retweets_goal'] > 0 else None,
-        replies_percentage if raid_data['replies_goal'] > 0 else None,
-        bookmarks_percentage if raid_data['bookmarks_goal'] > 0 else None
-    ]
-    valid_percentages = [p for p in valid_percentages if p is not None]
-    overall_progress = sum(valid_percentages) / len(valid_percentages) if valid_percentages else 100
+    # Drop share-link query strings such as "?s=20" so the id can be used in batched lookups
+    return post_link.split('?')[0].rstrip('/').split('/')[-1]
+
+
+def render_raid_card(raid):
+    """Build the Markdown text of a raid card from its last evaluated progress."""
+    if raid.metrics_delayed_since is not None:
+        # The last numbers are stale, don't show them as if they were live
+        return (
+            f"\n*SMASH THE RAID OR PASTA DIES*\n\n"
+            f"⏳ Metrics delayed: Twitter is not responding. The raid timer is paused until fresh numbers come in.\n\n"
+            f"{raid.post_link}"
+        )
 
-    filled_blocks = int(total_blocks * (overall_progress / 100))
-    empty_blocks = total_blocks - filled_blocks
-    progress_bar = (
-            "◖" + "▮" * filled_blocks + "▯" * empty_blocks + "◗"
+    filled_blocks = raid.filled
+    progress_bar = "◖" + "▮" * filled_blocks + "▯" * (PROGRESS_BAR_BLOCKS - filled_blocks) + "◗"
+    metric_lines = "".join(
+        f"{color} {name.capitalize()}: {count} of {target}\n"
+        for name, color, count, target in zip(METRIC_NAMES, raid.colors(), raid.counts(), raid.targets())
     )
-
-    interaction_text = (
+    return (
         f"\n*SMASH THE RAID OR PASTA DIES*\n\n"
         f"{progress_bar}\n\n"
-        f"{likes_color} Likes: {raid_data['likes']} of {raid_data['initial_likes'] + raid_data['likes_goal']}\n"
-        f"{retweets_color} Retweets: {raid_data['retweets']} of {raid_data['initial_retweets'] + raid_data['retweets_goal']}\n"
-        f"{replies_color} Replies: {raid_data['replies']} of {raid_data['initial_replies'] + raid_data['replies_goal']}\n"
-        f"{bookmarks_color} Bookmarks: {raid_data['bookmarks']} of {raid_data['initial_bookmarks'] + raid_data['bookmarks_goal']}\n\n"
-        f"{raid_data['post_link']}"
+        f"{metric_lines}\n"
+        f"{raid.post_link}"
     )
 
-    if BANNER_IMAGE_PATH.lower().endswith('.mp4'):
-        if os.path.exists(BANNER_IMAGE_PATH):
-            with open(BANNER_IMAGE_PATH, 'rb') as banner:
-                return await bot.send_video(chat_id=message.chat.id, video=banner, caption=interaction_text,
-                                            parse_mode="Markdown")
-        else:
-            return await bot.send_message(chat_id=message.chat.id, text=interaction_text, parse_mode="Markdown")
-    elif BANNER_IMAGE_PATH.startswith("http://") or BANNER_IMAGE_PATH.startswith("https://"):
-        return await bot.send_photo(chat_id=message.chat.id, photo=BANNER_IMAGE_PATH, caption=interaction_text,
-                                    parse_mode="Markdown")
-    else:
-        if os.path.exists(BANNER_IMAGE_PATH):
-            with open(BANNER_IMAGE_PATH, 'rb') as banner:
-                return await bot.send_photo(chat_id=message.chat.id, photo=banner, caption=interaction_text,
-                                            parse_mode="Markdown")
-        else:
-            return await bot.send_message(chat_id=message.chat.id, text=interaction_text, parse_mode="Markdown")
 
+async def send_full_raid_update(chat_id: int, raid, priority=PRIORITY_COMMAND):
+    interaction_text = render_raid_card(raid)
+    return await media_cache.send_banner(chat_id, interaction_text, parse_mode="Markdown", priority=priority)
 
-async def cleanup_tracking_messages(chat_id: int, delay: int):
-    """Deletes the pinned tracking message after a specified delay."""
-    await asyncio.sleep(delay)
+
+async def cleanup_tracking_messages(chat_id: int, delay: int, message_id=None):
+    """Schedules the deletion of the tracking message (or whatever is pinned, if not given) after a delay."""
     try:
-        chat = await bot.get_chat(chat_id)
-        pinned_message = chat.pinned_message
-        if pinned_message:
-            await bot.delete_message(chat_id, pinned_message.message_id)
+        if message_id is None:
+            chat = await bot.get_chat(chat_id)
+            pinned_message = chat.pinned_message
+            message_id = pinned_message.message_id if pinned_message else None
+        if message_id:
+            deletion_scheduler.schedule(chat_id, message_id, delay)
     except Exception as e:
         print(f"Error during cleanup of tracking messages: {str(e)}")
 
 
+class WebhookServer:
+    """Receives updates from Telegram on an embedded aiohttp server.
+
+    Requests without the configured secret token are rejected, and so is every request when
+    no secret is configured. Accepted updates are put on a bounded queue and answered with
+    200 straight away; a fixed pool of workers feeds them to the dispatcher. When the queue
+    is full Telegram gets a 503 and delivers the update again later instead of the bot
+    running an unbounded number of handlers.
+    """
+
+    def __init__(self, dispatcher, secret=WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE,
+                 process=None):
+        self.dispatcher = dispatcher
+        self.process = process or dispatcher.process_update  # The shard coordinator routes updates instead
+        self.secret = secret
+        self.workers = workers
+        self._updates = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+
+    async def handle(self, request):
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not self.secret or not hmac.compare_digest(token, self.secret):
+            return web.Response(status=401)
+        try:
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):  # Not JSON, or JSON that isn't an object
+            return web.Response(status=400)
+        try:
+            self._updates.put_nowait(update)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _work(self):
+        while True:
+            update = await self._updates.get()
+            try:
+                await self.process(update)
+            except Exception as e:
+                print(f"Error processing update {update.update_id}: {str(e)}")
+            finally:
+                self._updates.task_done()
+
+    def start(self):
+        Dispatcher.set_current(self.dispatcher)
+        Bot.set_current(self.dispatcher.bot)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(process=None):
+    """Serve updates through the webhook until the process is stopped."""
+    server = WebhookServer(dp, process=process)
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    server.start()
+    await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, allowed_updates=ALLOWED_UPDATES,
+                          secret_token=WEBHOOK_SECRET)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await runner.cleanup()
+
+
+class HashRing:
+    """Consistent hashing of chat ids onto shards, so resizing moves only the chats that have to."""
+
+    def __init__(self, shards, replicas=HASH_RING_REPLICAS):
+        self.shards = sorted(shards)
+        points = sorted((self._hash(f"{shard}:{i}"), shard) for shard in self.shards for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key):
+        # Python's hash() of strings differs between processes, the ring must not
+        return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+    def owner(self, key):
+        return self._owners[bisect_left(self._hashes, self._hash(key)) % len(self._hashes)]
+
+
+def update_shard_key(update: dict):
+    """Return the id an update is routed by: its chat, or the user for updates outside a chat."""
+    for kind in ('message', 'edited_message', 'chat_member', 'my_chat_member'):
+        if kind in update:
+            return update[kind]['chat']['id']
+    for kind in ('inline_query', 'callback_query'):
+        if kind in update:
+            return update[kind]['from']['id']
+    return update['update_id']
+
+
+class BrokerConnection:
+    """One end of the newline-delimited JSON stream between the coordinator and a worker."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._lock = asyncio.Lock()  # drain() must not be awaited concurrently on Python 3.9
+
+    async def send(self, message):
+        async with self._lock:
+            self.writer.write(json.dumps(message).encode() + b"\n")
+            await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+class ShardCoordinator:
+    """Spreads chats over SHARD_COUNT worker processes by consistent hashing of the chat id.
+
+    The coordinator receives every update and forwards it to the worker owning its chat,
+    and answers the workers' tweet lookups from its own MetricsCache, merging the lookups
+    that arrive within SHARD_LOOKUP_WINDOW into one batch, so no tweet is fetched twice
+    whatever shard asked for it. Workers connect over a Unix socket, a stand-in for a real
+    broker on a single box.
+
+    SIGTTIN adds a worker and SIGTTOU removes one. Resizing holds updates back and runs in
+    two phases: every worker first flushes and forgets the chats it no longer owns, then
+    loads the chats it gained from the raid store, so active raids move without being
+    dropped. Workers that crash are started again and restore their chats the same way.
+    """
+
+    def __init__(self, count, socket_path=SHARD_SOCKET):
+        self.count = count
+        self.socket_path = socket_path
+        self.ring = HashRing(range(count))
+        self._server = None
+        self._processes = {}  # shard -> worker process
+        self._supervisors = []
+        self._ready = {}  # shard -> connection of workers that restored their chats
+        self._acks = {}  # (shard, ack type) -> future
+        self._backlog = {}  # shard -> updates that arrived while it was not ready
+        self._routable = asyncio.Event()
+        self._routable.set()
+        self._resizing = asyncio.Lock()
+        self._lookup_batch = None
+        self._stopping = False
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._serve, self.socket_path, limit=BROKER_LINE_LIMIT)
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTTIN, lambda: run_in_background(self.resize(self.count + 1)))
+        loop.add_signal_handler(signal.SIGTTOU, lambda: run_in_background(self.resize(self.count - 1)))
+        for shard in range(self.count):
+            self._supervisors.append(asyncio.create_task(self._supervise(shard)))
+        print(f"Coordinating {self.count} shards on {self.socket_path}")
+
+    async def stop(self):
+        self._stopping = True
+        for connection in list(self._ready.values()):
+            try:
+                await connection.send({'type': 'stop'})
+            except ConnectionError:
+                pass
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _supervise(self, shard):
+        """Run the worker of `shard`, starting it again if it exits while the shard still exists."""
+        env = dict(os.environ, SHARD_ID=str(shard))
+        if METRICS_PORT:
+            env['METRICS_PORT'] = str(METRICS_PORT + 1 + shard)
+        while not self._stopping and shard < self.count:
+            process = self._processes[shard] = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), env=env)
+            code = await process.wait()
+            if not self._stopping and shard < self.count:
+                print(f"Shard {shard} exited with code {code}, restarting it")
+                await asyncio.sleep(1)
+
+    async def _serve(self, reader, writer):
+        connection = BrokerConnection(writer)
+        hello = json.loads(await reader.readline())
+        shard = hello['shard']
+        run_in_background(self._adopt(shard, connection))
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message['type'] == 'metrics':
+                    run_in_background(self._answer_lookup(connection, message))
+                else:
+                    future = self._acks.pop((shard, message['type']), None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+        finally:
+            if self._ready.get(shard) is connection:
+                del self._ready[shard]
+            for key in [key for key in self._acks if key[0] == shard]:
+                self._acks.pop(key).set_exception(ConnectionError(f"Shard {shard} disconnected"))
+            connection.close()
+
+    async def _request(self, shard, connection, message, ack):
+        """Send `message` to a worker and wait for its `ack` message."""
+        future = self._acks[(shard, ack)] = asyncio.get_running_loop().create_future()
+        await connection.send(message)
+        return await future
+
+    async def _adopt(self, shard, connection):
+        """Have a worker load the chats it owns, then deliver the updates held back for it."""
+        try:
+            await self._request(shard, connection, {'type': 'adopt', 'shards': self.ring.shards}, 'adopted')
+            backlog = self._backlog.pop(shard, [])
+            while backlog:
+                for update in backlog:
+                    await connection.send({'type': 'update', 'update': update})
+                backlog = self._backlog.pop(shard, [])
+            self._ready[shard] = connection
+        except ConnectionError as e:
+            print(f"Error starting shard {shard}: {str(e)}")
+
+    async def route(self, update: types.Update):
+        """Forward an update to the worker owning its chat."""
+        await self._routable.wait()
+        update = update.to_python()
+        shard = self.ring.owner(update_shard_key(update))
+        connection = self._ready.get(shard)
+        if connection is not None:
+            try:
+                await connection.send({'type': 'update', 'update': update})
+                return
+            except ConnectionError:
+                pass
+        self._backlog.setdefault(shard, []).append(update)
+
+    async def resize(self, count):
+        if not 1 <= count <= MAX_SHARDS:
+            return
+        async with self._resizing:
+            ring = HashRing(range(count))
+            self._routable.clear()
+            try:
+                ready = dict(self._ready)
+                results = await asyncio.gather(*(
+                    self._request(shard, connection, {'type': 'release', 'shards': ring.shards}, 'released')
+                    for shard, connection in ready.items()), return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        print(f"Error releasing chats: {str(result)}")
+
+                previous, self.count, self.ring = self.count, count, ring
+                for shard, connection in ready.items():
+                    if shard >= count:
+                        del self._ready[shard]
+                        await connection.send({'type': 'stop'})
+                await asyncio.gather(*(
+                    self._request(shard, connection, {'type': 'adopt', 'shards': ring.shards}, 'adopted')
+                    for shard, connection in ready.items() if shard < count), return_exceptions=True)
+                for shard in range(previous, count):
+                    self._supervisors.append(asyncio.create_task(self._supervise(shard)))
+                # Updates held for removed shards go to the chats' new owners
+                orphans = [update for shard in list(self._backlog) if shard >= count
+                           for update in self._backlog.pop(shard)]
+            finally:
+                self._routable.set()
+            for update in orphans:
+                await self.route(types.Update(**update))
+            print(f"Resized from {previous} to {count} shards")
+
+    async def _answer_lookup(self, connection, message):
+        reply = {'type': 'metrics', 'id': message['id']}
+        try:
+            reply['metrics'] = await self._lookup(message['post_ids'], message['max_age'])
+        except Exception as e:
+            reply['error'] = str(e)
+        reply['rate_limits'] = twitter_client.rate_limits
+        reply['circuits'] = twitter_client.circuits()
+        try:
+            await connection.send(reply)
+        except ConnectionError:
+            pass
+
+    async def _lookup(self, post_ids, max_age):
+        """Fetch `post_ids` in the same batch as the other lookups arriving within SHARD_LOOKUP_WINDOW."""
+        if self._lookup_batch is None:
+            self._lookup_batch = (set(), [], asyncio.get_running_loop().create_future())
+            run_in_background(self._fetch_lookup_batch())
+        ids, max_ages, future = self._lookup_batch
+        ids.update(post_ids)
+        max_ages.append(max_age)
+        metrics = await asyncio.shield(future)
+        return {post_id: metrics[post_id] for post_id in post_ids if post_id in metrics}
+
+    async def _fetch_lookup_batch(self):
+        await asyncio.sleep(SHARD_LOOKUP_WINDOW)
+        ids, max_ages, future = self._lookup_batch
+        self._lookup_batch = None
+        try:
+            max_age = min((age for age in max_ages if age is not None), default=None)
+            future.set_result(await metrics_cache.get_many(ids, max_age=max_age))
+        except Exception as e:
+            future.set_exception(e)
+
+    async def poll(self):
+        """Long-poll Telegram for updates and route them until the process is stopped."""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=20, allowed_updates=ALLOWED_UPDATES)
+            except Exception as e:
+                print(f"Error fetching updates: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.route(update)
+                offset = update.update_id + 1
+
+
+class ShardWorker:
+    """Worker end of the broker, handling the chats the coordinator routes to one shard.
+
+    It stands in for the MetricsCache in worker processes, sending tweet lookups to the
+    coordinator, and splits Telegram's global limit and the Twitter quota evenly with the
+    other shards.
+    """
+
+    def __init__(self, shard, socket_path=SHARD_SOCKET):
+        self.shard = shard
+        self.socket_path = socket_path
+        self.connection = None
+        self._lookups = {}  # request id -> future of the reply
+        self._lookup_ids = itertools.count(1)
+        self._tracker = None
+        self.remote_lookups = 0
+
+    def stats(self):
+        return {"remote": self.remote_lookups}
+
+    async def get(self, post_id):
+        """Return the `public_metrics` dict of a single tweet."""
+        metrics = (await self.get_many([post_id])).get(str(post_id))
+        if metrics is None:
+            raise TwitterError(f"Tweet {post_id} could not be found")
+        return metrics
+
+    async def get_many(self, post_ids, max_age=None):
+        """Return `{post_id: public_metrics}` for many tweets, fetched by the coordinator."""
+        request_id = next(self._lookup_ids)
+        self.remote_lookups += 1
+        future = self._lookups[request_id] = asyncio.get_running_loop().create_future()
+        await self.connection.send({'type': 'metrics', 'id': request_id,
+                                    'post_ids': [str(post_id) for post_id in post_ids], 'max_age': max_age})
+        reply = await future
+        twitter_client.rate_limits.update((endpoint, tuple(limit)) for endpoint, limit in reply['rate_limits'].items())
+        twitter_client.mirror_circuits(reply['circuits'])
+        if 'error' in reply:
+            raise TwitterError(reply['error'])
+        return reply['metrics']
+
+    async def release(self, ring):
+        """Flush and forget the chats that `ring` gives to other shards."""
+        gone = [state for state in raid_manager.states() if ring.owner(state.chat_id) != self.shard]
+        for state in gone:
+            raid_manager.forget(state)
+        deletion_scheduler.forget({state.chat_id for state in gone})
+        await raid_store.flush()
+        print(f"Shard {self.shard} released {len(gone)} chats")
+
+    async def adopt(self, ring):
+        """Load the chats `ring` gives to this shard that it does not hold yet."""
+        held = {state.chat_id for state in raid_manager.states()}
+        media_cache.reload()
+        adopted = await restore_raids(include=lambda chat_id: ring.owner(chat_id) == self.shard and chat_id not in held)
+        run_in_background(reconcile_chats(adopted))
+        poll_scheduler.share = 1 / len(ring.shards)
+        outbox.set_global_rate(TELEGRAM_GLOBAL_RATE / len(ring.shards))
+        if self._tracker is None:
+            self._tracker = asyncio.create_task(track_engagement())
+
+    async def _process(self, update):
+        try:
+            await dp.process_update(types.Update(**update))
+        except Exception as e:
+            print(f"Error processing update {update['update_id']}: {str(e)}")
+
+    async def run(self):
+        """Serve the coordinator until it says stop or goes away."""
+        Dispatcher.set_current(dp)
+        Bot.set_current(bot)
+        raid_store.shard, raid_store.queue_id_stride = self.shard, MAX_SHARDS
+        reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=BROKER_LINE_LIMIT)
+        self.connection = BrokerConnection(writer)
+        await self.connection.send({'type': 'hello', 'shard': self.shard})
+        async for line in reader:
+            message = json.loads(line)
+            kind = message['type']
+            if kind == 'update':
+                run_in_background(self._process(message['update']))
+            elif kind == 'metrics':
+                future = self._lookups.pop(message['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+            elif kind == 'release':
+                await self.release(HashRing(message['shards']))
+                await self.connection.send({'type': 'released'})
+            elif kind == 'adopt':
+                await self.adopt(HashRing(message['shards']))
+                await self.connection.send({'type': 'adopted'})
+            elif kind == 'stop':
+                break
+        self.connection.close()
+
+
+async def run_shard_worker(shard):
+    """Handle the chats of one shard until the coordinator stops it."""
+    global metrics_cache
+    worker = metrics_cache = ShardWorker(shard)
+    start_loop_monitoring()
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    try:
+        await worker.run()
+    finally:
+        await (await bot.get_session()).close()
+        await twitter_client.close()
+        await raid_store.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+async def run_coordinator():
+    """Route updates to SHARD_COUNT worker processes until the process is stopped."""
+    coordinator = ShardCoordinator(SHARD_COUNT)
+    await coordinator.start()
+    start_loop_monitoring()
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook(process=coordinator.route)
+        else:
+            await coordinator.poll()
+    finally:
+        await coordinator.stop()
+        await twitter_client.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+async def monitor_event_loop_lag():
+    """Measure how much later than asked the event loop resumes a short sleep."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        lag = time.perf_counter() - started - EVENT_LOOP_LAG_INTERVAL
+        metrics.observe('deraid_event_loop_lag_seconds', max(lag, 0))
+
+
+def format_stack(frame):
+    """Collapse a thread's stack into one `file:function;...` line, outermost frame first."""
+    names = []
+    while frame is not None:
+        names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class LoopWatchdog:
+    """Logs the stack of whatever blocks the event loop for longer than `threshold` seconds.
+
+    A coroutine refreshes a heartbeat while a daemon thread checks it; when the heartbeat is
+    late the thread prints the loop thread's current stack, which is the blocking code.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self._beat = time.monotonic()
+        self._loop_thread = None
+
+    async def heartbeat(self):
+        self._loop_thread = threading.get_ident()
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        stalled_beat = None
+        while True:
+            time.sleep(self.interval)
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked > self.threshold and beat != stalled_beat:
+                stalled_beat = beat
+                metrics.inc('deraid_event_loop_stalls_total')
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "(unavailable)\n"
+                print(f"Event loop blocked for over {blocked:.2f}s in:\n{stack}", end="")
+            elif stalled_beat is not None and beat != stalled_beat:
+                print(f"Event loop resumed after {beat - stalled_beat:.2f}s")
+                stalled_beat = None
+
+
+class StackSampler:
+    """Sampling profiler counting the event loop thread's stacks every `interval` seconds.
+
+    `dump()` returns the samples in the folded format flame graph tools read, one
+    `stack count` line per distinct stack, most frequent first.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = {}
+        self._loop_thread = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        threading.Thread(target=self._sample, name='stack-sampler', daemon=True).start()
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                stack = format_stack(frame)
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def dump(self):
+        samples = sorted(self.samples.items(), key=lambda sample: sample[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in samples)
+
+
+stack_sampler = StackSampler(PROFILER_INTERVAL) if PROFILER_INTERVAL else None
+
+
+def start_loop_monitoring():
+    """Start the lag probe, plus the watchdog and the profiler when enabled, in every kind of process."""
+    run_in_background(monitor_event_loop_lag())
+    if WATCHDOG_THRESHOLD:
+        run_in_background(LoopWatchdog(WATCHDOG_THRESHOLD).heartbeat())
+    if stack_sampler is not None:
+        if not METRICS_PORT:
+            # The samples are only readable on the metrics server's /debug/profile
+            print("PROFILER_INTERVAL is set but METRICS_PORT is not, the profiler is not started")
+        else:
+            stack_sampler.start()
+
+
+async def start_metrics_server():
+    """Serve `GET /metrics` for Prometheus, and the profiler's samples on `GET /debug/profile`
+    when it is enabled; returns the runner so it can be cleaned up."""
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type='text/plain')
+
+    async def handle_profile(request):
+        if stack_sampler is None:
+            return web.Response(status=404, text="Set PROFILER_INTERVAL to enable the profiler")
+        return web.Response(text=stack_sampler.dump(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    app.router.add_get('/debug/profile', handle_profile)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    print(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+
+async def restore_raids(include=None):
+    """Rebuild the in-memory raid state from the store so tracking resumes after a restart.
+
+    `include(chat_id)` limits it to some chats, such as the ones a shard worker owns.
+    """
+    raids, queued, chats, deletions = await raid_store.load()
+    if include is not None:
+        raids = [row for row in raids if include(row[RAID_COLUMNS.index('chat_id')])]
+        queued = [row for row in queued if include(row[QUEUED_RAID_COLUMNS.index('chat_id')])]
+        chats = [row for row in chats if include(row[0])]
+        deletions = [row for row in deletions if include(row[0])]
+    for chat_id, message_id, due_at in deletions:
+        deletion_scheduler.schedule_at(chat_id, message_id, due_at, persist=False)
+    for chat_id, queue_enabled, leaderboard_listed in chats:
+        state = raid_manager.get(chat_id)
+        state.queue_enabled = bool(queue_enabled)
+        state.leaderboard_listed = bool(leaderboard_listed)
+    for row in queued:
+        entry = dict(zip(QUEUED_RAID_COLUMNS, row))
+        raid_manager.enqueue(raid_manager.get(entry['chat_id']), entry, persist=False)
+    for row in raids:
+        record = dict(zip(RAID_COLUMNS, row))
+        raid = new_raid(record['post_link'], record['likes_goal'], record['retweets_goal'], record['replies_goal'],
+                        record['bookmarks_goal'], record['chat_id'], record['message_id'], baseline={
+                            'like_count': record['initial_likes'],
+                            'retweet_count': record['initial_retweets'],
+                            'reply_count': record['initial_replies'],
+                            'bookmark_count': record['initial_bookmarks'],
+                        })
+        raid.pinned_message_id = record['pinned_message_id']
+        raid.card_has_caption = bool(record['card_has_caption'])
+        # The baselines were taken when the raid started, not now: the first poll seeds the series
+        raid.series = EngagementSeries()
+        raid_manager.activate(raid_manager.get(record['chat_id']), raid,
+                              started_at=datetime.fromisoformat(record['started_at']), persist=False)
+    print(f"Restored {len(raids)} ongoing and {len(queued)} queued raids, {len(deletions)} pending deletions")
+    return ({row[RAID_COLUMNS.index('chat_id')] for row in raids}
+            | {row[QUEUED_RAID_COLUMNS.index('chat_id')] for row in queued}
+            | {row[0] for row in chats} | {row[0] for row in deletions})
+
+
+async def reconcile_chat(chat_id):
+    """Bring one chat restored from the store back in line with Telegram.
+
+    A chat the bot was removed from while it was down loses its raid, its queue and its
+    pending deletions. Otherwise a card the bot left pinned without a raid behind it is
+    unpinned, the ongoing raid's card is pinned again if someone unpinned it, and the chat's
+    admin roster is fetched so the first command does not wait for it.
+    """
+    state = raid_manager.get(chat_id)
+    try:
+        chat = await bot.get_chat(chat_id)
+    except (ChatNotFound, Unauthorized) as e:
+        print(f"Chat {chat_id} can no longer be reached, dropping its raids: {str(e)}")
+        raid_manager.deactivate(state)
+        raid_manager.clear_queue(state)
+        deletion_scheduler.discard(chat_id)
+        return
+
+    raid = state.ongoing_raid
+    card_id = raid.pinned_message_id if raid is not None else None
+    pinned = chat.pinned_message
+    if pinned is not None and pinned.from_user is not None and pinned.from_user.id == bot.id \
+            and pinned.message_id != card_id:
+        # The bot only pins raid cards, this one outlived its raid
+        await outbox.unpin_chat_message(chat_id=chat_id, message_id=pinned.message_id, priority=PRIORITY_BACKGROUND)
+    if card_id is not None and (pinned is None or pinned.message_id != card_id):
+        try:
+            await outbox.pin_chat_message(chat_id=chat_id, message_id=card_id, disable_notification=True,
+                                          priority=PRIORITY_BACKGROUND)
+        except BadRequest:
+            raid.pinned_message_id = None  # The card is gone, the tracker sends a new one
+    if chat.type != types.ChatType.PRIVATE:
+        await admin_roster.get(chat_id)
+
+
+async def reconcile_chats(chat_ids, concurrency=STARTUP_CONCURRENCY):
+    """Reconcile `chat_ids` with Telegram after a restart, `concurrency` chats at a time.
+
+    Runs in the background: updates are received and the tracker ticks meanwhile, so the
+    first command is answered without waiting for every chat to be checked.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def reconcile(chat_id):
+        async with semaphore:
+            try:
+                await reconcile_chat(chat_id)
+            except Exception as e:
+                print(f"Error reconciling chat {chat_id}: {str(e)}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(reconcile(chat_id) for chat_id in chat_ids))
+    print(f"Reconciled {len(chat_ids)} chats in {time.perf_counter() - started:.1f}s")
+
+
 async def main():
+    if BOT_MODE == 'webhook' and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        # Without a secret anyone who finds the URL could post updates as Telegram
+        raise SystemExit("BOT_MODE=webhook needs WEBHOOK_URL and WEBHOOK_SECRET to be set")
+    if SHARD_ID is not None:
+        await run_shard_worker(int(SHARD_ID))
+        return
+    if SHARD_COUNT > 1:
+        await run_coordinator()
+        return
+    run_in_background(reconcile_chats(await restore_raids()))
     asyncio.create_task(track_engagement())
-    await dp.start_polling()
+    start_loop_monitoring()
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            await dp.start_polling(allowed_updates=ALLOWED_UPDATES)
+    finally:
+        await twitter_client.close()
+        await raid_store.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
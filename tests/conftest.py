@@ -0,0 +1,74 @@
+import contextlib
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('API_TOKEN', '123456:TESTTESTTESTTESTTESTTESTTESTTESTTEST')
+os.environ.setdefault('BEARER_TOKEN', 'test')
+# Keep the import-time singletons away from the raids and media index of a local run
+WORKDIR = tempfile.mkdtemp(prefix='deraid-tests-')
+os.environ.setdefault('RAID_DB_PATH', os.path.join(WORKDIR, 'raids.db'))
+os.environ.setdefault('MEDIA_CACHE_PATH', os.path.join(WORKDIR, 'media_cache.json'))
+
+import benchmark  # noqa: E402
+import bot  # noqa: E402
+from aiogram.bot.api import TelegramAPIServer  # noqa: E402
+
+
+@pytest.fixture
+def stand_ins(monkeypatch, tmp_path):
+    """Return an async context manager running the bot's singletons against fresh API stand-ins.
+
+    Every module-level singleton is replaced for the test, so state never leaks between
+    tests and nothing stays bound to the event loop of an earlier `asyncio.run`. Its
+    keyword arguments configure the Twitter stand-in.
+    """
+    monkeypatch.chdir(ROOT)  # The banners are read relative to the working directory
+
+    @contextlib.asynccontextmanager
+    async def start(quota=100000, curve='flat', growth=0):
+        telegram = benchmark.FakeTelegram(benchmark.Latency(0, 0), global_rate=100000, chat_rate=100000)
+        twitter = benchmark.FakeTwitter(benchmark.Latency(0, 0), quota, 900, curve, growth)
+        runners = []
+        for app in (telegram.app(), twitter.app()):
+            runner, url = await benchmark.serve(app)
+            runners.append((runner, url))
+        telegram_bot = bot.InstrumentedBot(token=bot.API_TOKEN, server=TelegramAPIServer.from_base(runners[0][1]))
+        twitter_client = bot.TwitterMetricsClient('test', base_url=runners[1][1])
+        raid_store = bot.RaidStore(path=str(tmp_path / 'raids.db'))
+        singletons = {
+            'bot': telegram_bot,
+            'outbox': bot.TelegramDispatcher(telegram_bot, global_rate=100000, chat_rate=100000,
+                                             chat_burst=100000),
+            'twitter_client': twitter_client,
+            'metrics_cache': bot.MetricsCache(twitter_client),
+            'poll_scheduler': bot.PollScheduler(twitter_client),
+            'raid_store': raid_store,
+            'raid_manager': bot.RaidManager(raid_store),
+            'deletion_scheduler': bot.DeletionScheduler(raid_store),
+            'raid_table': bot.RaidTable(),
+            'admin_roster': bot.AdminRoster(),
+            'media_cache': bot.MediaCache(str(tmp_path / 'media_cache.json')),
+            'background_tasks': set(),
+        }
+        for name, value in singletons.items():
+            monkeypatch.setattr(bot, name, value)
+        monkeypatch.setattr(bot.dp, 'bot', telegram_bot)
+        bot.Bot.set_current(telegram_bot)
+        bot.Dispatcher.set_current(bot.dp)
+        try:
+            yield telegram, twitter
+        finally:
+            for task in bot.background_tasks:
+                task.cancel()
+            await twitter_client.close()
+            await raid_store.close()
+            await (await telegram_bot.get_session()).close()
+            for runner, _ in runners:
+                await runner.cleanup()
+
+    return start
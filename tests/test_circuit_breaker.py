@@ -0,0 +1,94 @@
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock the test moves forward by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def trip(breaker):
+    for _ in range(breaker.threshold):
+        assert breaker.acquire()
+        breaker.failed()
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = bot.CircuitBreaker(threshold=3, base_delay=10, max_delay=100)
+    for _ in range(2):
+        assert breaker.acquire()
+        assert not breaker.failed()
+    assert breaker.acquire()
+    assert breaker.failed()
+
+    assert breaker.state == breaker.OPEN
+    assert breaker.is_open()
+    assert not breaker.acquire()
+    assert 5 <= breaker.retry_in() <= 10
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = bot.CircuitBreaker(threshold=2, base_delay=10, max_delay=100)
+    breaker.failed()
+    breaker.succeeded()
+    breaker.failed()
+
+    assert breaker.state == breaker.CLOSED
+
+
+def test_one_probe_goes_through_once_the_delay_is_over(clock):
+    breaker = bot.CircuitBreaker(threshold=1, base_delay=10, max_delay=100, probe_timeout=5)
+    trip(breaker)
+    clock[0] += 10
+
+    assert breaker.acquire()
+    assert breaker.state == breaker.HALF_OPEN
+    # Everything else waits for the probe's answer, and is told to wait
+    assert breaker.is_open()
+    assert not breaker.acquire()
+    assert breaker.retry_in() == 5
+    clock[0] += 30
+    assert breaker.is_open()
+    assert breaker.retry_in() == breaker.MIN_RETRY_IN
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = bot.CircuitBreaker(threshold=1, base_delay=10, max_delay=100)
+    trip(breaker)
+    clock[0] += 10
+    assert breaker.acquire()
+    breaker.succeeded()
+
+    assert breaker.state == breaker.CLOSED
+    assert not breaker.is_open()
+    assert breaker.retry_in() == 0
+    assert breaker.acquire()
+
+
+def test_failed_probe_reopens_with_a_longer_delay(clock):
+    breaker = bot.CircuitBreaker(threshold=1, base_delay=10, max_delay=15)
+    trip(breaker)
+    clock[0] += 10
+    assert breaker.acquire()
+    assert breaker.failed()
+
+    assert breaker.state == breaker.OPEN
+    assert not breaker.acquire()
+    assert 7.5 <= breaker.retry_in() <= 15  # Doubled to 20, capped at max_delay
+
+
+def test_abandoned_probe_lets_the_next_request_probe(clock):
+    breaker = bot.CircuitBreaker(threshold=1, base_delay=10, max_delay=100)
+    trip(breaker)
+    clock[0] += 10
+    assert breaker.acquire()
+    breaker.abandoned()
+
+    assert not breaker.is_open()
+    assert breaker.retry_in() == 0
+    assert breaker.acquire()
+    assert breaker.probing
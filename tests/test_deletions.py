@@ -0,0 +1,32 @@
+import asyncio
+
+import bot
+
+
+def test_due_messages_are_deleted_with_one_call_per_chat(stand_ins):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            for message_id in (1, 2, 3):
+                bot.deletion_scheduler.schedule(-1, message_id, 0)
+            bot.deletion_scheduler.schedule(-2, 4, 0)
+            while telegram.calls.get('deleteMessages', 0) < 2:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)
+            return telegram.calls['deleteMessages'], bot.deletion_scheduler.pending()
+
+    assert asyncio.run(scenario()) == (2, 0)
+
+
+def test_bulk_deletes_wait_for_the_chat_bucket(stand_ins, monkeypatch):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            # One call per minute in a chat, and the chat has just spent it
+            monkeypatch.setattr(bot, 'outbox', bot.TelegramDispatcher(bot.bot, chat_rate=1 / 60, chat_burst=1))
+            await bot.outbox.send_message(chat_id=-1, text="Raid started")
+            bot.deletion_scheduler.schedule(-1, 1, 0)
+            bot.deletion_scheduler.schedule(-2, 2, 0)
+            await asyncio.sleep(0.5)
+            return telegram.calls.get('deleteMessages', 0)
+
+    # Only the quiet chat's deletion went out
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import bot
+
+
+def test_series_rates_cover_the_last_samples():
+    series = bot.EngagementSeries(capacity=4, width=1)
+    for second, likes in enumerate([0, 10, 20, 50, 80]):
+        series.append(second, [likes])
+
+    assert series.size == 4
+    assert series.rates(samples=2) == [30.0]
+    assert series.rates(samples=4) == [70 / 3]
+    assert series.etas([110], samples=2) == [1.0]
+
+
+def test_completion_pace_covers_the_whole_raid(stand_ins, monkeypatch):
+    sent = []
+
+    async def send_message(**kwargs):
+        sent.append(kwargs['text'])
+
+    async def scenario():
+        async with stand_ins():
+            monkeypatch.setattr(bot.outbox, 'send_message', send_message)
+            state = bot.raid_manager.get(-1)
+            raid = bot.new_raid("https://x.com/test/status/1000", 100, 0, 0, 0, -1, 1, baseline={'like_count': 50})
+            bot.raid_manager.activate(state, raid, started_at=datetime.utcnow() - timedelta(minutes=10),
+                                      persist=False)
+            # The series only keeps the last samples, which show a much faster pace than the average
+            for second in range(2 * bot.SERIES_CAPACITY):
+                raid.series.append(second, [150 - 2 * bot.SERIES_CAPACITY + second, 0, 0, 0])
+            raid.set_counts([150, 0, 0, 0])
+            bot.raid_table.evaluate([raid.slot])
+            await bot.update_raid_progress(state, raid)
+
+    asyncio.run(scenario())
+
+    assert "Average pace: 10.0 likes/min" in sent[0]
+
+
+def test_restored_raid_is_seeded_by_its_first_poll(stand_ins):
+    async def scenario():
+        async with stand_ins():
+            raid = bot.new_raid("https://x.com/test/status/1000", 100, 0, 0, 0, -1, 1, baseline={'like_count': 50})
+            bot.raid_store.save_raid(-1, raid, datetime.utcnow() - timedelta(minutes=10))
+            await bot.raid_store.flush()
+            await bot.restore_raids()
+            return bot.raid_manager.get(-1).ongoing_raid
+
+    restored = asyncio.run(scenario())
+
+    assert restored.series.size == 0
+    assert restored.baselines() == [50, 0, 0, 0]
@@ -0,0 +1,66 @@
+import asyncio
+
+import bot
+
+CHATS = {-1: 'Alpha', -2: 'Bravo', -3: 'Charlie'}
+
+
+def start_raids():
+    for chat_id, title in CHATS.items():
+        raid = bot.new_raid("https://x.com/test/status/1000", 100, 0, 0, 0, chat_id, 1)
+        bot.raid_manager.activate(bot.raid_manager.get(chat_id), raid, persist=False)
+        bot.raid_manager.subscriptions.titles[chat_id] = title
+
+
+def command(chat_id):
+    return bot.types.Message(**{
+        'message_id': 1, 'date': 0, 'text': '/leaderboard', 'from': {'id': 1, 'is_bot': False, 'first_name': 'A'},
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': CHATS[chat_id]},
+    })
+
+
+def run_leaderboard(stand_ins, monkeypatch, before=None):
+    """Show chat -1's leaderboard and return its text; `before(raid_manager)` runs during the title lookups."""
+    sent = []
+
+    async def capture(chat_id, text, delay, parse_mode=None):
+        sent.append(text)
+
+    async def scenario():
+        async with stand_ins():
+            monkeypatch.setattr(bot, 'send_message_with_deletion', capture)
+            start_raids()
+            bot.raid_manager.set_leaderboard_listed(bot.raid_manager.get(-2), True)
+            if before:
+                title = bot.raid_manager.subscriptions.title
+
+                async def racing_title(chat_id):
+                    before(bot.raid_manager)
+                    return await title(chat_id)
+
+                monkeypatch.setattr(bot.raid_manager.subscriptions, 'title', racing_title)
+            await bot.raid_leaderboard_handler(command(-1))
+
+    asyncio.run(scenario())
+    return sent[0]
+
+
+def test_only_groups_that_opted_in_are_named(stand_ins, monkeypatch):
+    text = run_leaderboard(stand_ins, monkeypatch)
+
+    assert 'Alpha' in text
+    assert 'Bravo' in text
+    assert 'Charlie' not in text
+    assert 'Anonymous group' in text
+    assert '3 groups raiding this tweet' in text
+
+
+def test_raid_ending_during_the_title_lookups_is_still_shown(stand_ins, monkeypatch):
+    def end_bravo(raid_manager):
+        state = raid_manager.get(-2)
+        if state.ongoing_raid is not None:
+            raid_manager.deactivate(state)
+
+    text = run_leaderboard(stand_ins, monkeypatch, before=end_bravo)
+
+    assert '3 groups raiding this tweet' in text
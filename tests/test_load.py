@@ -0,0 +1,29 @@
+import asyncio
+import math
+
+import bot
+from benchmark import raid_update
+
+CHATS = 2000
+
+
+def test_one_process_serves_thousands_of_chats(stand_ins):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            updates = [bot.types.Update(**raid_update(i + 1, -1000000000000 - i, 1000 + i, 1000))
+                       for i in range(CHATS)]
+            # In batches of 100, as getUpdates hands them over
+            for i in range(0, CHATS, 100):
+                await asyncio.gather(*(bot.dp.process_update(update) for update in updates[i:i + 100]))
+            tasks = [task for task in asyncio.all_tasks() if task.get_coro().cr_code.co_filename == bot.__file__]
+            lookups = twitter.requests
+            raids = [state.ongoing_raid for state in bot.raid_manager.active_chats()]
+            updated = await bot.poll_raid_metrics(raids, max_age=0)  # Past the baselines' cache entries
+            return telegram.answered, len(raids), len(tasks), twitter.requests - lookups, len(updated)
+
+    answered, active, tasks, tick_lookups, updated = asyncio.run(scenario())
+
+    assert answered == active == updated == CHATS
+    # No coroutine is parked per chat, every raid is polled by the one shared tracker
+    assert tasks <= 3
+    assert tick_lookups == math.ceil(CHATS / bot.TWEET_LOOKUP_BATCH_SIZE)
@@ -0,0 +1,69 @@
+import asyncio
+
+import bot
+from benchmark import Latency
+
+
+def run_with_cache(stand_ins, scenario, **options):
+    """Run `scenario(cache)` on a fresh cache over the Twitter stand-in; return its result and the requests made."""
+    async def run():
+        async with stand_ins() as (telegram, twitter):
+            twitter.latency = Latency(50, 0)  # Long enough for concurrent callers to overlap
+            result = await scenario(bot.MetricsCache(bot.twitter_client, **options))
+            return result, twitter.requests
+
+    return asyncio.run(run())
+
+
+def test_concurrent_lookups_of_a_tweet_share_one_call(stand_ins):
+    async def scenario(cache):
+        results = await asyncio.gather(*(cache.get('1000') for _ in range(10)))
+        return results, cache.stats()
+
+    (results, stats), requests = run_with_cache(stand_ins, scenario)
+
+    assert requests == 1
+    assert all(result == results[0] for result in results)
+    assert (stats['misses'], stats['coalesced']) == (1, 9)
+
+
+def test_fresh_entries_are_served_until_the_ttl_expires(stand_ins):
+    async def scenario(cache):
+        await cache.get('1000')
+        await cache.get('1000')
+        await asyncio.sleep(0.3)
+        await cache.get('1000')
+        return cache.stats()
+
+    stats, requests = run_with_cache(stand_ins, scenario, ttl=0.2)
+
+    assert requests == 2
+    assert (stats['hits'], stats['misses']) == (1, 2)
+
+
+def test_least_recently_used_tweet_is_evicted(stand_ins):
+    async def scenario(cache):
+        for post_id in ('1', '2', '1', '3'):  # Reading 1 again makes 2 the least recently used
+            await cache.get(post_id)
+        hits = cache.hits
+        await cache.get('1')
+        await cache.get('2')
+        return cache.hits - hits, cache.stats()['size']
+
+    (hits, size), requests = run_with_cache(stand_ins, scenario, max_size=2)
+
+    assert (hits, size) == (1, 2)
+    assert requests == 4
+
+
+def test_failed_lookup_is_raised_to_every_waiter(stand_ins):
+    async def scenario(cache):
+        cache.client.breakers[bot.poll_scheduler.endpoint] = breaker = bot.CircuitBreaker(threshold=1)
+        breaker.failed()
+        results = await asyncio.gather(cache.get('1000'), cache.get('1000'), return_exceptions=True)
+        return [type(result) for result in results]
+
+    results, requests = run_with_cache(stand_ins, scenario)
+
+    assert results == [bot.CircuitOpenError, bot.CircuitOpenError]
+    assert requests == 0
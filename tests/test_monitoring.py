@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+class RecordingSampler(bot.StackSampler):
+    def __init__(self):
+        super().__init__(interval=0.01)
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+
+@pytest.mark.parametrize('port, started', [(0, False), (9100, True)])
+def test_profiler_only_runs_where_its_samples_can_be_read(monkeypatch, capsys, port, started):
+    sampler = RecordingSampler()
+    monkeypatch.setattr(bot, 'stack_sampler', sampler)
+    monkeypatch.setattr(bot, 'METRICS_PORT', port)
+    monkeypatch.setattr(bot, 'background_tasks', set())
+
+    async def scenario():
+        bot.start_loop_monitoring()
+        tasks = set(bot.background_tasks)
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    # The lag probe and the watchdog are kept by run_in_background
+    assert asyncio.run(scenario()) == (2 if bot.WATCHDOG_THRESHOLD else 1)
+    assert sampler.started == started
+    assert ("METRICS_PORT is not" in capsys.readouterr().out) != started
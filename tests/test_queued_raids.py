@@ -0,0 +1,35 @@
+import asyncio
+
+import bot
+
+
+class OpenCircuitCache:
+    """MetricsCache stand-in whose lookups are refused as if a probe were in flight."""
+
+    def __init__(self, retry_in):
+        self.retry_in = retry_in
+        self.lookups = 0
+
+    async def get(self, post_id):
+        self.lookups += 1
+        raise bot.CircuitOpenError('/2/tweets/:id', self.retry_in)
+
+
+def test_open_circuit_retries_the_queue_no_sooner_than_a_tick(stand_ins, monkeypatch):
+    cache = OpenCircuitCache(retry_in=0)
+
+    async def scenario():
+        async with stand_ins():
+            monkeypatch.setattr(bot, 'metrics_cache', cache)
+            monkeypatch.setattr(bot, 'MIN_POLL_INTERVAL', 0.2)
+            state = bot.raid_manager.get(-1)
+            state.queue_enabled = True
+            bot.raid_manager.enqueue(state, bot.queued_raid(-1, 1, "https://x.com/test/status/1000",
+                                                            [100, 25, 10, 5], 1))
+            await bot.start_next_queued_raid(state)
+            await asyncio.sleep(0.5)
+            return len(state.raid_queue), state.ongoing_raid
+
+    assert asyncio.run(scenario()) == (1, None)
+    # The first lookup and one retry per 0.2 s, not a retry per loop iteration
+    assert cache.lookups <= 4
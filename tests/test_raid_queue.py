@@ -0,0 +1,44 @@
+import bot
+
+
+def entry(queue_id, requester, priority=0):
+    return {'queue_id': queue_id, 'message_id': queue_id, 'requested_by': requester, 'priority': priority}
+
+
+def queue_ids(queue):
+    return [item['queue_id'] for item in queue]
+
+
+def test_requesters_are_served_round_robin():
+    queue = bot.RaidQueue()
+    for queue_id in range(1, 4):
+        queue.push(entry(queue_id, 'A'))
+    queue.push(entry(4, 'B'))
+
+    assert queue_ids(queue) == [1, 4, 2, 3]
+
+
+def test_bumped_raid_does_not_push_new_requesters_back():
+    queue = bot.RaidQueue()
+    for queue_id in range(1, 11):
+        queue.push(entry(queue_id, 'A'))
+    queue.push(entry(11, 'B'))
+    queue.reprioritize(10, 1)
+
+    assert queue.pop()['queue_id'] == 10
+    queue.push(entry(12, 'C'))
+
+    assert queue_ids(queue) == [1, 11, 12, 2, 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_requester_with_nothing_waiting_rejoins_the_current_round():
+    queue = bot.RaidQueue()
+    for queue_id in range(1, 4):
+        queue.push(entry(queue_id, 'A'))
+    queue.remove(1)
+    queue.remove(2)
+    queue.remove(3)
+    queue.push(entry(4, 'B'))
+    queue.push(entry(5, 'A'))
+
+    assert queue_ids(queue) == [4, 5]
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import bot
+
+POST_LINK = "https://x.com/test/status/1000"
+
+
+def restart(monkeypatch):
+    """Replace the in-memory state with what a freshly started process would have."""
+    raid_store = bot.RaidStore(path=bot.raid_store.path)
+    monkeypatch.setattr(bot, 'raid_store', raid_store)
+    monkeypatch.setattr(bot, 'raid_manager', bot.RaidManager(raid_store))
+    monkeypatch.setattr(bot, 'deletion_scheduler', bot.DeletionScheduler(raid_store))
+    monkeypatch.setattr(bot, 'raid_table', bot.RaidTable())
+
+
+def test_raids_queues_and_deletions_survive_a_restart(stand_ins, monkeypatch):
+    started_at = datetime.utcnow() - timedelta(minutes=5)
+    due_at = time.time() + 3600
+
+    async def scenario():
+        async with stand_ins():
+            state = bot.raid_manager.get(-1)
+            raid = bot.new_raid(POST_LINK, 100, 25, 10, 5, -1, 1, baseline={'like_count': 40})
+            raid.pinned_message_id = 2
+            bot.raid_manager.activate(state, raid, started_at=started_at)
+            bot.raid_manager.set_queue_enabled(state, True)
+            bot.raid_manager.set_leaderboard_listed(state, True)
+            entries = [bot.queued_raid(-1, 10 + i, f"{POST_LINK}{i}", [100, 0, 0, 0], i) for i in range(3)]
+            bot.raid_manager.enqueue_many(state, entries)
+            bot.raid_manager.reprioritize(state, entries[2], 1)
+            bot.raid_manager.remove_queued(state, entries[0])
+            bot.deletion_scheduler.schedule_at(-1, 3, due_at)
+            # A raid that ended before the restart must not come back
+            finished = bot.raid_manager.get(-2)
+            bot.raid_manager.activate(finished, bot.new_raid(POST_LINK, 100, 0, 0, 0, -2, 1))
+            bot.raid_manager.deactivate(finished)
+            await bot.raid_store.close()
+
+            restart(monkeypatch)
+            restored_chats = await bot.restore_raids()
+            state = bot.raid_manager.get(-1)
+            return (restored_chats, state, [entry['queue_id'] for entry in state.raid_queue],
+                    [entry['queue_id'] for entry in entries], bot.deletion_scheduler.chat_ids(),
+                    bot.deletion_scheduler.pending(), bot.raid_manager.get(-2).ongoing_raid)
+
+    restored_chats, state, queued, entries, deletion_chats, deletions, finished = asyncio.run(scenario())
+
+    raid = state.ongoing_raid
+    assert restored_chats == {-1}
+    assert (raid.post_link, raid.pinned_message_id) == (POST_LINK, 2)
+    assert raid.goals() == [100, 25, 10, 5]
+    assert raid.baselines() == [40, 0, 0, 0]
+    assert state.raid_start_time == started_at
+    assert state.queue_enabled and state.leaderboard_listed
+    # The bumped raid still comes first, the cancelled one is gone
+    assert queued == [entries[2], entries[1]]
+    assert (deletion_chats, deletions) == ({-1}, 1)
+    assert finished is None
+
+
+def test_queue_ids_keep_growing_after_a_restart(stand_ins, monkeypatch):
+    async def scenario():
+        async with stand_ins():
+            state = bot.raid_manager.get(-1)
+            entry = bot.queued_raid(-1, 1, POST_LINK, [100, 0, 0, 0], 1)
+            bot.raid_manager.enqueue(state, entry)
+            await bot.raid_store.close()
+
+            restart(monkeypatch)
+            await bot.restore_raids()
+            return entry['queue_id'], bot.raid_store.next_queue_id()
+
+    before, after = asyncio.run(scenario())
+
+    assert after > before
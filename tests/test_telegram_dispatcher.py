@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import bot
+
+
+def dispatcher(**limits):
+    """A dispatcher over the stand-in bot, unthrottled unless `limits` say otherwise."""
+    limits = {'global_rate': 100000, 'chat_rate': 100000, 'chat_burst': 100000, **limits}
+    return bot.TelegramDispatcher(bot.bot, **limits)
+
+
+def test_higher_priority_calls_are_sent_first(stand_ins):
+    async def scenario():
+        async with stand_ins():
+            outbox = dispatcher()
+            # Queued together, so the chat's calls are released one at a time in priority order
+            messages = await asyncio.gather(
+                outbox.send_message(chat_id=-1, text="cleanup", priority=bot.PRIORITY_BACKGROUND),
+                outbox.send_message(chat_id=-1, text="card", priority=bot.PRIORITY_PROGRESS),
+                outbox.send_message(chat_id=-1, text="reply", priority=bot.PRIORITY_COMMAND),
+            )
+            # The stand-in numbers messages in the order it receives them
+            return [message.text for message in sorted(messages, key=lambda message: message.message_id)]
+
+    assert asyncio.run(scenario()) == ["reply", "card", "cleanup"]
+
+
+def test_queued_edits_with_the_same_key_are_coalesced(stand_ins):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            outbox = dispatcher()
+            results = await asyncio.gather(*(
+                outbox.edit_message_text(chat_id=-1, message_id=1, text=f"{percentage}%", coalesce_key=(-1, 1))
+                for percentage in (10, 20, 30)
+            ))
+            return [result.text for result in results], telegram.calls['editMessageText'], outbox.coalesced
+
+    # Only the newest text is sent, and every caller gets its result
+    assert asyncio.run(scenario()) == (["30%"] * 3, 1, 2)
+
+
+def test_chat_bucket_throttles_one_chat_only(stand_ins):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            outbox = dispatcher(chat_rate=1 / 60, chat_burst=2)
+            for i in range(3):
+                asyncio.ensure_future(outbox.send_message(chat_id=-1, text=f"busy {i}"))
+            await outbox.send_message(chat_id=-2, text="quiet")
+            await asyncio.sleep(0.3)
+            return telegram.calls['sendMessage'], outbox.pending()
+
+    # The busy chat's burst went out, its third message waits without holding the other chat back
+    assert asyncio.run(scenario()) == (3, 1)
+
+
+def test_retry_after_requeues_the_call(stand_ins):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            telegram.global_rate = 1  # The stand-in answers a second call within a second with a 429
+            outbox = dispatcher()
+            started = time.perf_counter()
+            messages = await asyncio.gather(outbox.send_message(chat_id=-1, text="first"),
+                                            outbox.send_message(chat_id=-1, text="second"))
+            return ([message.text for message in messages], telegram.throttled, outbox.retried,
+                    time.perf_counter() - started)
+
+    texts, throttled, retried, elapsed = asyncio.run(scenario())
+
+    assert texts == ["first", "second"]
+    assert throttled == retried == 1
+    assert elapsed >= 1
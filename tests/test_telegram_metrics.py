@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+def sample(name, **labels):
+    """Value of one sample in the rendered metrics, 0 if it was never recorded."""
+    prefix = name + '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '} '
+    for line in bot.metrics.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0
+
+
+def test_calls_that_bypass_the_outbox_are_timed(stand_ins):
+    before = [sample('deraid_telegram_request_seconds_count', method=method)
+              for method in ('getChat', 'getChatAdministrators')]
+
+    async def scenario():
+        async with stand_ins():
+            await bot.bot.get_chat(-1)
+            await bot.bot.get_chat_administrators(-1)
+
+    asyncio.run(scenario())
+
+    assert sample('deraid_telegram_request_seconds_count', method='getChat') == before[0] + 1
+    assert sample('deraid_telegram_request_seconds_count', method='getChatAdministrators') == before[1] + 1
+
+
+def test_flood_control_errors_are_counted(stand_ins):
+    before = sample('deraid_telegram_errors_total', method='pinChatMessage', error='RetryAfter')
+
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            telegram.global_rate = 1
+            await bot.bot.pin_chat_message(-1, 1)
+            with pytest.raises(bot.RetryAfter):
+                await bot.bot.pin_chat_message(-1, 1)
+
+    asyncio.run(scenario())
+
+    assert sample('deraid_telegram_errors_total', method='pinChatMessage', error='RetryAfter') == before + 1
@@ -0,0 +1,58 @@
+import asyncio
+import math
+import time
+
+import pytest
+
+import bot
+
+
+def track_raids(chats, tweets):
+    """Start a raid in each of `chats` chats, spread over `tweets` distinct tweets."""
+    for i in range(chats):
+        chat_id = -1000000000000 - i
+        raid = bot.new_raid(f"https://x.com/test/status/{1000 + i % tweets}", 1000, 250, 100, 50, chat_id, 1)
+        bot.raid_manager.activate(bot.raid_manager.get(chat_id), raid, persist=False)
+    return [state.ongoing_raid for state in bot.raid_manager.active_chats()]
+
+
+@pytest.mark.parametrize('chats, tweets', [(250, 250), (250, 120), (1, 1)])
+def test_tick_looks_up_the_due_tweets_in_batches(stand_ins, chats, tweets):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            raids = track_raids(chats, tweets)
+            updated = await bot.poll_raid_metrics(raids, max_age=bot.MIN_POLL_INTERVAL)
+            return twitter.requests, len(updated)
+
+    requests, updated = asyncio.run(scenario())
+
+    assert requests == math.ceil(tweets / bot.TWEET_LOOKUP_BATCH_SIZE)
+    assert updated == chats
+
+
+@pytest.mark.parametrize('remaining, polled', [(100000, 250), (bot.POLL_QUOTA_RESERVE + 300, 100)])
+def test_tick_polls_as_many_raids_as_the_quota_allows(stand_ins, remaining, polled):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            raids = track_raids(250, 250)
+            bot.twitter_client.rate_limits[bot.poll_scheduler.endpoint] = (remaining, time.time() + 900)
+            now = time.monotonic()
+            bot.poll_scheduler.select(raids, now - bot.MIN_POLL_INTERVAL)  # The previous tick
+            return bot.poll_scheduler.select(raids, now)
+
+    assert len(asyncio.run(scenario())) == polled
+
+
+def test_effective_poll_intervals_are_reported(stand_ins):
+    async def scenario():
+        async with stand_ins():
+            raids = track_raids(3, 3)
+            for raid, interval in zip(raids, (5, 20, None)):
+                raid.effective_poll_interval = interval
+            return bot.poll_scheduler.report(), bot.metrics.render()
+
+    report, rendered = asyncio.run(scenario())
+
+    assert sorted(report.values()) == sorted([5, 20, bot.TRACKING_INTERVAL])
+    assert 'deraid_poll_interval_seconds{stat="median"} 15' in rendered
+    assert 'deraid_poll_interval_seconds{stat="max"} 20' in rendered
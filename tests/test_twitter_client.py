@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+import bot
+from benchmark import serve
+
+PUBLIC_METRICS = {'like_count': 7, 'retweet_count': 3, 'reply_count': 2, 'bookmark_count': 1}
+STUB_DELAY = 2.0
+
+
+async def slow_lookup(request):
+    await asyncio.sleep(STUB_DELAY)
+    return web.json_response({'data': {'id': request.match_info['id'], 'public_metrics': PUBLIC_METRICS}})
+
+
+async def with_slow_twitter(scenario, timeout=10):
+    """Run `scenario(client)` with a client pointed at a Twitter stub that answers after STUB_DELAY."""
+    app = web.Application()
+    app.router.add_get('/2/tweets/{id}', slow_lookup)
+    runner, url = await serve(app)
+    client = bot.TwitterMetricsClient('test', base_url=url, timeout=timeout)
+    try:
+        return await scenario(client)
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+async def max_lag_until(task, interval=0.01):
+    """Sleep `interval` repeatedly until `task` is done, returning the longest overshoot."""
+    lag = 0.0
+    while not task.done():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(lag, time.perf_counter() - started - interval)
+    return lag
+
+
+def test_lookup_keeps_the_event_loop_responsive():
+    async def scenario(client):
+        started = time.perf_counter()
+        lookup = asyncio.create_task(client.get_public_metrics('1'))
+        lag = await max_lag_until(lookup)
+        return await lookup, lag, time.perf_counter() - started
+
+    result, lag, elapsed = asyncio.run(with_slow_twitter(scenario))
+
+    assert result == PUBLIC_METRICS
+    assert elapsed >= STUB_DELAY
+    assert lag < 0.1
+
+
+def test_lookup_is_abandoned_after_the_timeout():
+    async def scenario(client):
+        started = time.perf_counter()
+        with pytest.raises(bot.TwitterError):
+            await client.get_public_metrics('1')
+        return time.perf_counter() - started
+
+    assert asyncio.run(with_slow_twitter(scenario, timeout=0.3)) < STUB_DELAY
+
+
+def test_cancelling_the_caller_cancels_the_lookup():
+    async def scenario(client):
+        lookup = asyncio.create_task(client.get_public_metrics('1'))
+        await asyncio.sleep(0.2)
+        started = time.perf_counter()
+        lookup.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lookup
+        return time.perf_counter() - started
+
+    assert asyncio.run(with_slow_twitter(scenario)) < 0.5
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import bot
+from benchmark import raid_update, serve
+
+SECRET = 'test-secret'
+
+
+async def post_updates(bodies, secret=SECRET, token=SECRET, workers=2, queue_size=10):
+    """POST each body to a fresh WebhookServer in turn and return the response statuses."""
+    server = bot.WebhookServer(bot.dp, secret=secret, workers=workers, queue_size=queue_size)
+    app = web.Application()
+    app.router.add_post(bot.WEBHOOK_PATH, server.handle)
+    runner, url = await serve(app)
+    server.start()
+    headers = {'X-Telegram-Bot-Api-Secret-Token': token} if token is not None else {}
+    statuses = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            for body in bodies:
+                async with session.post(url + bot.WEBHOOK_PATH, data=body, headers=headers) as response:
+                    statuses.append(response.status)
+        if workers:
+            await server._updates.join()
+    finally:
+        await server.stop()
+        await runner.cleanup()
+    return statuses
+
+
+@pytest.mark.parametrize('secret, token', [(SECRET, None), (SECRET, 'wrong'), (None, ''), (None, 'anything')])
+def test_requests_without_the_secret_are_rejected(stand_ins, secret, token):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            statuses = await post_updates([json.dumps(raid_update(1, -1, 1000, 100))], secret=secret, token=token)
+            return statuses, telegram.answered
+
+    assert asyncio.run(scenario()) == ([401], 0)
+
+
+@pytest.mark.parametrize('body', ['not json', '[1, 2]', '"update"', 'null'])
+def test_bodies_that_are_not_json_objects_are_a_bad_request(stand_ins, body):
+    async def scenario():
+        async with stand_ins():
+            return await post_updates([body])
+
+    assert asyncio.run(scenario()) == [400]
+
+
+def test_updates_with_the_secret_are_processed(stand_ins):
+    async def scenario():
+        async with stand_ins() as (telegram, twitter):
+            statuses = await post_updates([json.dumps(raid_update(1, -1, 1000, 100))])
+            return statuses, telegram.answered, bot.raid_manager.active_count()
+
+    assert asyncio.run(scenario()) == ([200], 1, 1)
+
+
+def test_a_full_queue_asks_telegram_to_retry(stand_ins):
+    async def scenario():
+        async with stand_ins():
+            bodies = [json.dumps(raid_update(i + 1, -1 - i, 1000 + i, 100)) for i in range(3)]
+            return await post_updates(bodies, workers=0, queue_size=2)
+
+    assert asyncio.run(scenario()) == [200, 200, 503]
+
+
+def test_webhook_mode_needs_a_url_and_a_secret(monkeypatch):
+    monkeypatch.setattr(bot, 'BOT_MODE', 'webhook')
+    monkeypatch.setattr(bot, 'WEBHOOK_URL', 'https://example.com')
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRET', None)
+
+    with pytest.raises(SystemExit, match='WEBHOOK_SECRET'):
+        asyncio.run(bot.main())